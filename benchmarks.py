@@ -0,0 +1,261 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from contextlib import redirect_stdout
+import pandas as pd
+from dotenv import load_dotenv
+from sheet_publish import col_num_to_letter
+from hash_aggregate import PartialAggregate
+from run_reports import load_report_module
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Lines per benchmark run (each size is benchmarked separately)
+BENCH_SIZES = os.getenv("BENCH_SIZES", "10000,100000,1000000")
+# Timed runs per benchmark; the fastest counts
+BENCH_REPEATS = int(os.getenv("BENCH_REPEATS", "3"))
+# --compare fails when throughput drops, or peak allocations grow, by more than these fractions
+BENCH_MAX_SLOWDOWN = float(os.getenv("BENCH_MAX_SLOWDOWN", "0.2"))
+BENCH_MAX_ALLOC_GROWTH = float(os.getenv("BENCH_MAX_ALLOC_GROWTH", "0.2"))
+# Allocation growth below this many bytes is noise, whatever the fraction
+BENCH_MIN_ALLOC_BYTES = int(os.getenv("BENCH_MIN_ALLOC_BYTES", "65536"))
+
+# Baseline results --compare checks against, committed with the code they were measured on
+BENCH_BASELINE = os.getenv("BENCH_BASELINE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json"))
+PAGE_LINES = 1000
+PAGE_COUNT = 10
+
+# --------- Synthetic Records ---------
+# Shaped like web_search_read results of the reports' specifications, with
+# enough distinct values that grouping produces a realistic number of groups
+def _m2o(rng, prefix, count, **extra):
+    i = rng.randrange(count)
+    return {"id": i + 1, "display_name": f"{prefix} {i}", **extra}
+
+def sale_order_pages(seed=0):
+    """PAGE_COUNT pages of sale orders, PAGE_LINES order lines per page"""
+    rng = random.Random(seed)
+    pages, order_id = [], 0
+    for _ in range(PAGE_COUNT):
+        page, lines = [], 0
+        while lines < PAGE_LINES:
+            order_id += 1
+            count = min(rng.randint(1, 4), PAGE_LINES - lines)
+            order = {
+                "id": order_id, "display_name": f"SO{order_id:06d}",
+                "brand_group": _m2o(rng, "Brand Group", 5),
+                "team_id": _m2o(rng, "Team", 8),
+                "buyer_name": _m2o(rng, "Buyer", 100, brand=_m2o(rng, "Brand", 20))
+            }
+            page.append({
+                "id": order_id,
+                "date_order": f"2025-{rng.randint(4, 12):02d}-{rng.randint(1, 28):02d} 10:00:00",
+                "partner_id": _m2o(rng, "Customer", 500),
+                "order_line": [{
+                    "id": order_id * 10 + j,
+                    "order_id": order,
+                    "order_partner_id": _m2o(rng, "Customer", 500),
+                    "product_template_id": {"id": 1, "fg_categ_type": _m2o(rng, "Category", 10)},
+                    "price_total": round(rng.uniform(10, 1000), 2),
+                    "price_subtotal": round(rng.uniform(10, 1000), 2),
+                    "product_uom_qty": rng.randint(1, 500),
+                    "qty_to_invoice": rng.randint(0, 500),
+                    "slidercodesfg": rng.choice([False, *[f"SC{k}" for k in range(300)]])
+                } for j in range(count)]
+            })
+            lines += count
+        pages.append(page)
+    return pages
+
+def operation_pages(seed=0):
+    """PAGE_COUNT pages of operation.details records (one line each)"""
+    rng = random.Random(seed)
+    return [[{
+        "id": p * PAGE_LINES + i,
+        "action_date": f"2025-{rng.randint(4, 12):02d}-{rng.randint(1, 28):02d} 08:00:00",
+        "date_order": f"2025-{rng.randint(4, 12):02d}-{rng.randint(1, 28):02d} 10:00:00",
+        "oa_id": _m2o(rng, "OA", 2000),
+        "buyer_id": {"id": 1, "brand": _m2o(rng, "Brand", 2)},
+        "partner_id": _m2o(rng, "Customer", 500),
+        "fg_categ_type": rng.choice(["Zipper", "Slider", "Button", "Puller"]),
+        "slidercodesfg": rng.choice([False, *[f"SC{k}" for k in range(300)]]),
+        "final_price": round(rng.uniform(0.1, 5), 2),
+        "qty": rng.randint(1, 5000)
+    } for i in range(PAGE_LINES)] for p in range(PAGE_COUNT)]
+
+def _cycle(pages, lines):
+    """Pages to process for `lines` lines, reusing the synthetic pages"""
+    return [pages[i % len(pages)] for i in range(max(lines // PAGE_LINES, 1))]
+
+# --------- Benchmarks ---------
+# Each returns a function doing the measured work on `lines` lines; setup
+# (building frames to group) happens before and isn't timed.
+
+def bench_get_string_value(lines):
+    pend = REPORTS["pend_pi"]
+    rng = random.Random(0)
+    values = [
+        rng.choice([(_m2o(rng, "Buyer", 100, brand=_m2o(rng, "Brand", 20)), "brand"),
+                    (_m2o(rng, "Buyer", 100), None), (rng.randint(1, 9999), None), (False, None), ("text", None)])
+        for _ in range(PAGE_LINES)
+    ]
+    def run():
+        for i in range(lines):
+            pend.get_string_value(*values[i % PAGE_LINES])
+    return run
+
+def bench_flatten_regular_sale_record(lines):
+    pend = REPORTS["pend_pi"]
+    pages = _cycle(sale_order_pages(), lines)
+    def run():
+        for page in pages:
+            for rec in page:
+                pend.flatten_regular_sale_record(rec)
+    return run
+
+def bench_flatten_carters_journey_record(lines):
+    journey = REPORTS["journey"]
+    pages = _cycle(sale_order_pages(), lines)
+    def run():
+        for page in pages:
+            for rec in page:
+                journey.flatten_carters_journey_record(rec)
+    return run
+
+def bench_col_num_to_letter(lines):
+    def run():
+        for i in range(lines):
+            col_num_to_letter(i % 18278 + 1)
+    return run
+
+def bench_group_regular_sale_data(lines):
+    pend = REPORTS["pend_pi"]
+    flat_records = pend.new_row_store(pend.REGULAR_SALE_COLUMN_FIELDS, pend.REGULAR_SALE_GROUP_COLUMNS)
+    for page in _cycle(sale_order_pages(), lines):
+        flat_records.extend_columns(pend.flatten_regular_sale_page(page))
+    df = flat_records.to_frame()
+    return lambda: pend.group_regular_sale_data(df, flat_records)
+
+def bench_group_pi_bank_data(lines):
+    pi_bank = REPORTS["pi_bank"]
+    rng = random.Random(0)
+    df = pd.DataFrame({
+        "PI Date": [f"2025-{rng.randint(8, 12):02d}-{rng.randint(1, 28):02d}" for _ in range(lines)],
+        "Bank": [f"Bank {rng.randrange(12)}" for _ in range(lines)],
+        "Total": [round(rng.uniform(100, 50000), 2) for _ in range(lines)]
+    })
+    return lambda: pi_bank.group_pi_bank_data(df)
+
+def bench_aggregate_carters_journey(lines):
+    journey = REPORTS["journey"]
+    pages = _cycle(sale_order_pages(), lines)
+    def run():
+        journey_agg = PartialAggregate(["Order Lines/Order Reference"], journey.JOURNEY_AGGREGATIONS,
+                                       journey.JOURNEY_LINE_TOTALS)
+        for page in pages:
+            journey_agg.merge(journey.aggregate_carters_journey_page(page, company_id=1))
+        return journey_agg.to_frame()
+    return run
+
+def bench_aggregate_fg_delivery(lines):
+    dispatch = REPORTS["dispatch"]
+    pages = _cycle(operation_pages(), lines)
+    def run():
+        dispatch_agg = PartialAggregate(dispatch.FG_DELIVERY_GROUP_COLUMNS, {"Qty": "sum"})
+        for page in pages:
+            dispatch_agg.merge(dispatch.aggregate_fg_delivery_page(page, company_name="Zipper"))
+        return dispatch_agg.to_frame(columns=list(dispatch.FG_DELIVERY_COLUMN_FIELDS))
+    return run
+
+BENCHMARKS = {
+    "get_string_value": bench_get_string_value,
+    "flatten_regular_sale_record": bench_flatten_regular_sale_record,
+    "flatten_carters_journey_record": bench_flatten_carters_journey_record,
+    "col_num_to_letter": bench_col_num_to_letter,
+    "group_regular_sale_data": bench_group_regular_sale_data,
+    "group_pi_bank_data": bench_group_pi_bank_data,
+    "aggregate_carters_journey": bench_aggregate_carters_journey,
+    "aggregate_fg_delivery": bench_aggregate_fg_delivery
+}
+REPORTS = {}
+
+# --------- Measurement ---------
+def measure(run, lines):
+    """Fastest of BENCH_REPEATS timed runs, then one traced run for the allocation peak"""
+    best = float("inf")
+    with redirect_stdout(io.StringIO()):
+        for _ in range(BENCH_REPEATS):
+            started = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - started)
+        tracemalloc.start()
+        run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"lines": lines, "seconds": round(best, 4), "lines_per_second": round(lines / best), "peak_bytes": peak}
+
+def compare(results, baseline):
+    """Print each result against its baseline and return the number of regressions"""
+    regressions = 0
+    print(f"\n{'Benchmark':<44}{'Lines/s':>12}{'Change':>9}{'Peak KiB':>11}{'Change':>9}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            print(f"{key:<44}{result['lines_per_second']:>12,}{'new':>9}{result['peak_bytes'] / 1024:>11.0f}{'new':>9}")
+            continue
+        speed = result["lines_per_second"] / base["lines_per_second"] - 1
+        growth = result["peak_bytes"] / max(base["peak_bytes"], 1) - 1
+        grown = growth > BENCH_MAX_ALLOC_GROWTH and result["peak_bytes"] - base["peak_bytes"] > BENCH_MIN_ALLOC_BYTES
+        failed = speed < -BENCH_MAX_SLOWDOWN or grown
+        regressions += failed
+        print(f"{key:<44}{result['lines_per_second']:>12,}{speed:>+9.0%}{result['peak_bytes'] / 1024:>11.0f}"
+              f"{growth:>+9.0%}{'  ❌ regression' if failed else ''}")
+    return regressions
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the flattening and grouping hot paths")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="Benchmark to run (repeatable)")
+    parser.add_argument("--sizes", default=BENCH_SIZES, help="Comma-separated line counts (default: %(default)s)")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="Exit with 1 when a result regressed past the thresholds")
+    parser.add_argument("--baseline", default=BENCH_BASELINE, help="Baseline JSON file (default: %(default)s)")
+    args = parser.parse_args()
+
+    # Without GOOGLE_CREDENTIALS_BASE64 the scripts import without a Sheets
+    # client; nothing is fetched or uploaded
+    REPORTS.update(
+        pend_pi=load_report_module("pend_pi"),
+        pi_bank=load_report_module("pi_bank"),
+        journey=load_report_module("Carter's Journey"),
+        dispatch=load_report_module("Dispatch")
+    )
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        for lines in (int(size) for size in args.sizes.split(",")):
+            print(f"⏱️ {name} @ {lines:,} lines")
+            results[f"{name}@{lines}"] = measure(BENCHMARKS[name](lines), lines)
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+    regressions = compare(results, baseline)
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n💾 Saved {len(results)} results as the baseline in {args.baseline}")
+    if args.compare and regressions:
+        print(f"\n❌ {regressions} benchmark(s) regressed past the thresholds "
+              f"(slowdown > {BENCH_MAX_SLOWDOWN:.0%} or allocations > +{BENCH_MAX_ALLOC_GROWTH:.0%})")
+        sys.exit(1)
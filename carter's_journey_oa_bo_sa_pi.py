@@ -1,5 +1,7 @@
 import os
+import sys
 import json
+import argparse
 import base64
 import requests
 import pandas as pd
@@ -9,6 +11,23 @@ from gspread_dataframe import set_with_dataframe
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
+from odoo_fetch import fetch_all_pages, odoo_post, login_uid
+from sheets_rate import RateLimitedHTTPClient
+from cost_plan import plan_dataset, print_plan
+from run_stats import record_run
+from upload_staging import stage_frame, mark_published, staged_frames
+from report_db import load_table
+from output_sinks import write_outputs
+from stage_profile import enable_profiling, profile_stage
+from odoo_spec import build_specification, report_unused_fields
+from functools import partial
+from hash_aggregate import PartialAggregate
+from page_pool import PagePool
+from sheet_publish import (
+    frame_fingerprint, is_unchanged, remember_upload,
+    tab_requests, frame_requests, timestamp_request, resize_request, publish_batch,
+    shard_frame, open_worksheet, remove_stale_shards
+)
 load_dotenv()
 
 # --------- Config from Environment ---------
@@ -19,13 +38,16 @@ ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
 GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1WFalOBdShdwWopazEohOlE4mbjKCIMynlx5R2mFBqR8"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
 
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
@@ -43,14 +65,41 @@ def odoo_login():
         },
         "id": 1
     }
-    resp = session.post(url, data=json.dumps(payload))
-    resp.raise_for_status()
+    resp = odoo_post(session, url, json.dumps(payload))
     return resp.json()['result']['uid']
 
-# --------- Fetch Carter's Journey OA/BO/SA PI Data ---------
-def fetch_carters_journey_data(uid, company_id, sales_types, batch_size=1000):
-    all_records, offset = [], 0
-    
+# --------- Published Columns ---------
+# Odoo fields (relative to sale.order) behind each column that reaches the sheet
+CARTERS_JOURNEY_COLUMN_FIELDS = {
+    "Order Date": ["date_order"],
+    "Order Lines/Order Reference": ["order_line.order_id.display_name"],
+    "Order Lines/Order Reference/Brand Group": ["order_line.order_id.brand_group.display_name"],
+    "Order Lines/Customer": ["order_line.order_partner_id.display_name"],
+    "Order Lines/Order Reference/Sales Team": ["order_line.order_id.team_id.display_name"],
+    "Order Lines/Product Template/FG Category": ["order_line.product_template_id.fg_categ_type.display_name"],
+    "Order Lines/Slider Code (SFG)": ["order_line.slidercodesfg"],
+    "Order Lines/Quantity": ["order_line.product_uom_qty"],
+    "Order Lines/Subtotal": ["order_line.price_subtotal"],
+    "Company": []
+}
+
+# Group by Order Reference: sum Quantity and Subtotal, keep first occurrence of other columns
+JOURNEY_AGGREGATIONS = {
+    "Order Date": "first",
+    "Order Lines/Order Reference/Brand Group": "first",
+    "Order Lines/Customer": "first",
+    "Order Lines/Order Reference/Sales Team": "first",
+    "Order Lines/Product Template/FG Category": "first",
+    "Order Lines/Slider Code (SFG)": "first",
+    "Order Lines/Quantity": "sum",
+    "Order Lines/Subtotal": "sum",
+    "Company": "first"
+}
+# Summed per line as well, to check the per-order sums against
+JOURNEY_LINE_TOTALS = ["Order Lines/Subtotal"]
+
+# --------- Carter's Journey OA/BO/SA PI Domain ---------
+def carters_journey_domain(sales_types):
     # Get date range: from 2025-04-01 to current date for the domain filter
     local_tz = pytz.timezone("Asia/Dhaka")
     now = datetime.now(local_tz)
@@ -59,76 +108,23 @@ def fetch_carters_journey_data(uid, company_id, sales_types, batch_size=1000):
     start_date = "2025-04-01 00:00:00"
     
     # Base domain for all sales types (same filters for OA/BO/SA/PI)
-    domain = [
+    return [
         "&", ["brand_group", "in", [183784, 180989]],
         "&", "&", ["date_order", ">=", start_date],
         ["date_order", "<=", current_date],
         "&", ["state", "=", "sale"],
         ["sales_type", "in", sales_types]
     ]
-    
-    specification = {
-        "date_order": {},
-        "order_line": {
-            "fields": {
-                "order_id": {
-                    "fields": {
-                        "display_name": {},
-                        "brand_group": {"fields": {"display_name": {}}},
-                        "team_id": {"fields": {"display_name": {}}}
-                    }
-                },
-                "order_partner_id": {"fields": {"display_name": {}}},
-                "product_template_id": {
-                    "fields": {
-                        "fg_categ_type": {"fields": {"display_name": {}}}
-                    }
-                },
-                "slidercodesfg": {},
-                "product_uom_qty": {},
-                "price_subtotal": {}
-            }
-        }
-    }
 
-    while True:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "sale.order",
-                "method": "web_search_read",
-                "args": [],
-                "kwargs": {
-                    "domain": domain,
-                    "specification": specification,
-                    "offset": offset,
-                    "limit": batch_size,
-                    "context": {
-                        "lang": "en_US",
-                        "tz": "Asia/Dhaka",
-                        "uid": uid,
-                        "allowed_company_ids": [company_id],
-                        "bin_size": True,
-                        "current_company_id": company_id
-                    },
-                    "count_limit": 10001
-                }
-            },
-            "id": 2
-        }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read", data=json.dumps(payload))
-        resp.raise_for_status()
-        result = resp.json()['result']
-        records = result['records']
-        all_records.extend(records)
-        print(f"[Company {company_id}] Carter's Journey: Fetched {len(records)} records, total so far: {len(all_records)}")
-        if len(records) < batch_size:
-            break
-        offset += batch_size
-
-    print(f"Company {company_id} Carter's Journey total records fetched: {len(all_records)}")
-    return all_records
+# --------- Fetch Carter's Journey OA/BO/SA PI Data ---------
+def fetch_carters_journey_data(uid, company_id, sales_types, batch_size=1000, on_page=None):
+    domain = carters_journey_domain(sales_types)
+    specification = build_specification(CARTERS_JOURNEY_COLUMN_FIELDS)
+
+    return fetch_all_pages(
+        session, ODOO_URL, uid, company_id, "sale.order", domain, specification,
+        "Carter's Journey", batch_size, on_page
+    )
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -190,68 +186,125 @@ def flatten_carters_journey_record(rec):
     
     return flattened_rows
 
+# --------- Aggregate a Page of Carter's Journey Records ---------
+def aggregate_carters_journey_page(records, company_id):
+    """
+    Flatten one fetched page (each order line becomes a row) into per-order
+    running totals. Runs in a page worker when PAGE_WORKERS > 1.
+    """
+    report_unused_fields(
+        "Carter's Journey",
+        build_specification(CARTERS_JOURNEY_COLUMN_FIELDS),
+        records,
+        flatten_carters_journey_record
+    )
+    page_agg = PartialAggregate(["Order Lines/Order Reference"], JOURNEY_AGGREGATIONS, JOURNEY_LINE_TOTALS)
+    for r in records:
+        flat_rows = flatten_carters_journey_record(r)
+        for row in flat_rows:
+            # Add Company Type column to each row
+            row["Company"] = "Zipper" if company_id == 1 else "Metal Trims"
+            # Remove timestamp from Order Date column (keep only date part)
+            row["Order Date"] = str(row["Order Date"]).split()[0] if row["Order Date"] else ""
+        page_agg.add_rows(flat_rows)
+    return page_agg
+
 # --------- Upload to Google Sheet ---------
-def paste_to_gsheet(df, sheet_name):
-    worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
+def paste_tabs_to_gsheet(tab_frames):
+    """
+    Publish every Carter's Journey tab with a single spreadsheet batchUpdate.
+
+    tab_frames is a list of (sheet_name, df). All tabs are cleared (A:J),
+    written, timestamped and resized to their data in one request, so the
+    dashboard recalculates once and never shows a mix of old and new tabs.
+    Frames over SHEETS_TAB_CELL_BUDGET are split across numbered tabs.
+    """
+    spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
+    all_worksheets = spreadsheet.worksheets()
+    worksheets = {ws.title: ws for ws in all_worksheets}
+
+    # A:J plus the timestamp in K
+    sharded_frames = []
+    for sheet_name, df in tab_frames:
+        shards = shard_frame(sheet_name, df, extra_columns=11 - len(df.columns))
+        for shard_tab, _ in shards[1:]:
+            if shard_tab not in worksheets:
+                worksheets[shard_tab] = open_worksheet(spreadsheet, shard_tab)
+        remove_stale_shards(spreadsheet, sheet_name, len(shards), all_worksheets)
+        sharded_frames.extend(shards)
+
+    local_tz = pytz.timezone("Asia/Dhaka")
+    current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+    timestamp_text = f"Last Updated: {current_timestamp}"
+
+    requests, published = [], []
+    for sheet_name, df in sharded_frames:
+        worksheet = worksheets[sheet_name]
+        fingerprint = frame_fingerprint(df)
+
+        if df.empty:
+            print(f"Empty DataFrame for {sheet_name}, pasting message.")
+            rows = [["There is no data for this period from date to current date"]]
+            # Timestamp in J1, inside the cleared range
+            requests.extend(tab_requests(worksheet, rows, 10, (0, 9), timestamp_text))
+        elif is_unchanged(GOOGLE_SHEET_ID, sheet_name, fingerprint):
+            # Skip the clear/update cycle when the data matches the last upload
+            print(f"⏭️ {sheet_name} unchanged since last upload, only refreshed the timestamp.")
+            requests.append(timestamp_request(worksheet, (0, 10), timestamp_text))
+            requests.append(resize_request(worksheet, len(df) + 1, 11))
+            continue
+        else:
+            # Header + data in A:J, timestamp in K1
+            requests.extend(frame_requests(worksheet, df, 10, (0, 10), timestamp_text))
+            print(f"Prepared {sheet_name} with {len(df)} rows.")
+        published.append((sheet_name, fingerprint))
+
+    publish_batch(spreadsheet, requests)
+    for sheet_name, fingerprint in published:
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, fingerprint)
+
+    print(f"Data pasted to Google Sheet tabs {', '.join(name for name, _ in sharded_frames)} in one batch update.")
+
+# --------- Summary ---------
+JOURNEY_SUMMARY_COLUMNS = [
+    "Order Date",
+    "Company",
+    "Order Lines/Order Reference/Brand Group",
+    "Order Lines/Customer",
+    "Order Lines/Order Reference/Sales Team",
+    "Order Lines/Product Template/FG Category"
+]
+
+def summarize_journey(df):
+    """Quantity and Subtotal per day, customer, team and category; what Sheets gets with the sheets-summary sink"""
     if df.empty:
-        print(f"Empty DataFrame for {sheet_name}, pasting message.")
-        worksheet.batch_clear(["A:J"])
-        worksheet.update(range_name="A1", values=[["There is no data for this period from date to current date"]])
-        # Update timestamp
-        local_tz = pytz.timezone("Asia/Dhaka")
-        current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-        worksheet.update(range_name="J1", values=[[f"Last Updated: {current_timestamp}"]])
-        return
-
-    # Helper function to convert column number to letter (1=A, 27=AA, etc.)
-    def col_num_to_letter(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(65 + (n % 26)) + result
-            n //= 26
-        return result
-    
-    # Clear only range A:I instead of entire sheet
-    worksheet.batch_clear(["A:J"])
-    print(f"Cleared range A:I from sheet: {sheet_name}")
-    
-    # Write header
-    header = df.columns.tolist()
-    end_col_letter = col_num_to_letter(len(header))
-    worksheet.update(range_name=f"A1:{end_col_letter}1", values=[header])
-    
-    # Prepare data for writing (convert DataFrame to list of lists)
-    values_to_write = df.values.tolist()
-    
-    if values_to_write:
-        # Calculate required rows
-        required_rows = 1 + len(values_to_write)  # Header + data rows
-        current_row_count = worksheet.row_count
-        
-        # Expand sheet if necessary
-        if required_rows > current_row_count:
-            rows_to_add = required_rows - current_row_count
-            worksheet.add_rows(rows_to_add)
-            print(f"📊 Added {rows_to_add} rows to sheet. New total: {required_rows}")
-        
-        # Calculate the end column letter
-        end_col = col_num_to_letter(len(df.columns))
-        
-        # Write data starting from row 2
-        range_to_update = f"A2:{end_col}{1 + len(values_to_write)}"
-        worksheet.update(range_name=range_to_update, values=values_to_write)
-        
-        # Update timestamp
-        local_tz = pytz.timezone("Asia/Dhaka")
-        current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
-        worksheet.update(range_name="K1", values=[[f"Last Updated: {current_timestamp}"]])
-        
-        print(f"Data pasted to Google Sheet ({sheet_name}) with {len(values_to_write)} rows.")
+        return df
+    return df.groupby(JOURNEY_SUMMARY_COLUMNS, as_index=False)[
+        ["Order Lines/Quantity", "Order Lines/Subtotal"]
+    ].sum()
 
 # --------- Main ---------
-if __name__ == "__main__":
-    uid = odoo_login()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch Carter's Journey OA/BO/SA/PI data and publish it to Google Sheets")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only estimate this run's Odoo and Sheets cost (runs search_count, uploads nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish frames staged by a run whose upload failed, without fetching from Odoo")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling("Carter's Journey")
+
+    if args.resume_upload:
+        tab_frames = staged_frames("Carter's Journey")
+        if tab_frames:
+            write_outputs("Carter's Journey", tab_frames, paste_tabs_to_gsheet, summarize=summarize_journey)
+        for sheet_tab, _ in tab_frames:
+            mark_published("Carter's Journey", sheet_tab)
+        sys.exit(0)
+
+    uid = login_uid(odoo_login)
     
     # Carter's Journey data - Sales Types mapping to Sheet Tab names
     carters_journey_map = [
@@ -261,60 +314,72 @@ if __name__ == "__main__":
         (["sale"], "PI")
     ]
 
+    if args.plan:
+        datasets = [
+            plan_dataset(session, ODOO_URL, uid, company_id, "sale.order", carters_journey_domain(sales_types), "Carter's Journey", 1000)
+            for sales_types, _ in carters_journey_map
+            for company_id in [1, 3]
+        ]
+        # All tabs go out together: 2 metadata reads and one batchUpdate
+        sys.exit(1 if print_plan("Carter's Journey", datasets, len(CARTERS_JOURNEY_COLUMN_FIELDS), 1, 2, 1,
+                                  gc.open_by_key(GOOGLE_SHEET_ID), [tab for _, tab in carters_journey_map]) else 0)
+
     # Fetch Carter's Journey data
     print("\n========== Fetching Carter's Journey OA/BO/SA PI Data ==========")
+    pool = PagePool()
+    # Fetch every tab from both companies first; each page is folded into
+    # per-order running totals as it arrives (in worker processes when
+    # PAGE_WORKERS > 1), so only one entry per order is kept in memory
     for sales_types, sheet_tab in carters_journey_map:
-        all_flat_records = []
-        
-        # Fetch data from both companies
         for company_id in [1, 3]:
-            records = fetch_carters_journey_data(uid, company_id, sales_types)
-            # Flatten records (each order line becomes a row)
-            for r in records:
-                flat_rows = flatten_carters_journey_record(r)
-                # Add Company Type column to each row
-                for row in flat_rows:
-                    row["Company"] = "Zipper" if company_id == 1 else "Metal Trims"
-                all_flat_records.extend(flat_rows)
+            fetch_carters_journey_data(
+                uid, company_id, sales_types,
+                on_page=pool.on_page(partial(aggregate_carters_journey_page, company_id=company_id), tag=sheet_tab)
+            )
+
+    tab_frames = []
+    for sales_types, sheet_tab in carters_journey_map:
+        with profile_stage("group"):
+            journey_agg = PartialAggregate(["Order Lines/Order Reference"], JOURNEY_AGGREGATIONS, JOURNEY_LINE_TOTALS)
+            for page_agg in pool.collect(sheet_tab):
+                journey_agg.merge(page_agg)
+            df = journey_agg.to_frame()
         
-        # Create DataFrame
-        df = pd.DataFrame(all_flat_records)
-        print(f"[{sheet_tab}] Total records after flattening: {len(df)}")
+        print(f"[{sheet_tab}] Total records after flattening: {journey_agg.row_count}")
         
         if not df.empty:
-            # Calculate subtotal before any processing
-            subtotal_before = df["Order Lines/Subtotal"].sum()
+            # Running sum of every line's subtotal, kept apart from the per-order sums
+            subtotal_before = journey_agg.total("Order Lines/Subtotal")
             print(f"[{sheet_tab}] Total Subtotal (before grouping): {subtotal_before}")
             
-            # Remove timestamp from Order Date column (keep only date part)
-            df["Order Date"] = df["Order Date"].apply(lambda x: str(x).split()[0] if x else "")
-            
-            # Group by Order Reference and sum Quantity and Subtotal
-            # Keep first occurrence of other columns
-            df_grouped = df.groupby("Order Lines/Order Reference", as_index=False).agg({
-                "Order Date": "first",
-                "Order Lines/Order Reference/Brand Group": "first",
-                "Order Lines/Customer": "first",
-                "Order Lines/Order Reference/Sales Team": "first",
-                "Order Lines/Product Template/FG Category": "first",
-                "Order Lines/Slider Code (SFG)": "first",
-                "Order Lines/Quantity": "sum",
-                "Order Lines/Subtotal": "sum",
-                "Company": "first"
-            })
-            
             # Sort by Order Date
-            df_grouped = df_grouped.sort_values(by="Order Date").reset_index(drop=True)
+            df = df.sort_values(by="Order Date").reset_index(drop=True)
             
-            print(f"[{sheet_tab}] Records after grouping by Order Reference: {len(df_grouped)}")
+            print(f"[{sheet_tab}] Records after grouping by Order Reference: {len(df)}")
             
             # Calculate subtotal after grouping
-            subtotal_after = df_grouped["Order Lines/Subtotal"].sum()
+            subtotal_after = df["Order Lines/Subtotal"].sum()
             print(f"[{sheet_tab}] Total Subtotal (after grouping): {subtotal_after}")
             print(f"[{sheet_tab}] Subtotal difference: {subtotal_before - subtotal_after}")
-            
-            df = df_grouped
         
-        paste_to_gsheet(df, sheet_tab)
+        tab_frames.append((sheet_tab, df))
+
+    pool.close()
+
+    # Publish all four tabs together, staged first so a failed upload can be
+    # retried with --resume-upload
+    for sheet_tab, df in tab_frames:
+        stage_frame("Carter's Journey", sheet_tab, df)
+    with profile_stage("upload"):
+        write_outputs("Carter's Journey", tab_frames, paste_tabs_to_gsheet, summarize=summarize_journey)
+    for sheet_tab, _ in tab_frames:
+        mark_published("Carter's Journey", sheet_tab)
+    load_table("carters_journey", pd.concat(
+        [df.assign(Tab=sheet_tab) for sheet_tab, df in tab_frames], ignore_index=True
+    ))
+    record_run("Carter's Journey", sum(len(df) for _, df in tab_frames), sum(df.size for _, df in tab_frames))
     
     print("\nAll Carter's Journey OA/BO/SA PI data fetched and uploaded successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 import os
+import sys
 import json
+import argparse
 import base64
 import requests
-import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
+from odoo_fetch import fetch_all_pages, odoo_post, login_uid
+from sheets_rate import RateLimitedHTTPClient
+from cost_plan import plan_dataset, print_plan
+from run_stats import record_run
+from upload_staging import stage_frame, mark_published, staged_frames
+from report_db import load_table
+from output_sinks import write_outputs
+from stage_profile import enable_profiling, profile_stage
+from odoo_spec import build_specification, report_unused_fields
+from functools import partial
+from compact_rows import new_row_store, to_columns
+from page_pool import PagePool
+from id_snapshot import ID_DIFF_REFRESH, diff_fetch
+from sheet_publish import (
+    frame_fingerprint, is_unchanged, remember_upload, fit_worksheet, col_num_to_letter, upload_frame,
+    SHEETS_TAB_CELL_BUDGET, shard_frame, open_worksheet, remove_stale_shards
+)
 load_dotenv()
 
 # --------- Config from Environment ---------
@@ -18,13 +36,16 @@ ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
 GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1WFalOBdShdwWopazEohOlE4mbjKCIMynlx5R2mFBqR8"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
 
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
@@ -42,83 +63,54 @@ def odoo_login():
         },
         "id": 1
     }
-    resp = session.post(url, data=json.dumps(payload))
-    resp.raise_for_status()
+    resp = odoo_post(session, url, json.dumps(payload))
     return resp.json()['result']['uid']
 
-# --------- Fetch Manufacturing Order Data ---------
-def fetch_manufacturing_order_data(uid, company_id, batch_size=1000):
-    all_records, offset = [], 0
-    
+# --------- Published Columns ---------
+# Odoo fields (relative to manufacturing.order) behind each column that reaches the sheet
+PENDING_ORDER_COLUMN_FIELDS = {
+    "Order Date": ["date_order"],
+    "OA": ["oa_id.display_name"],
+    "Buyer Name/Brand Group": ["buyer_id.brand.display_name"],
+    "Customer": ["partner_id.display_name"],
+    "Item": ["fg_categ_type"],
+    "Sale Order Line/Slider Code (SFG)": ["slidercodesfg"],
+    "Lead Time": ["lead_time"],
+    "Quantity": ["product_uom_qty"],
+    "Done Qty": ["done_qty"],
+    "Balance": ["balance_qty"],
+    "Final Price": ["final_price"],
+    "Company": []
+}
+# Columns whose values repeat across rows (dictionary-encoded when DIMENSION_ENCODING=1)
+PENDING_ORDER_DIMENSION_COLUMNS = [
+    "Buyer Name/Brand Group", "Customer", "Item", "Sale Order Line/Slider Code (SFG)", "Company"
+]
+
+# --------- Manufacturing Order Domain ---------
+def manufacturing_order_domain():
     # Domain filters:
     # - oa_total_balance > 0
     # - oa_id != false
     # - state not in [closed, cancel, hold]
     # - buyer_id.brand in [183784, 180989]
-    domain = [
+    return [
         ["oa_total_balance", ">", 0],
         ["oa_id", "!=", False],
         ["state", "not in", ["closed", "cancel", "hold"]],
         ["buyer_id.brand", "in", [183784, 180989]]
     ]
-    
-    specification = {
-        "date_order": {},
-        "oa_id": {"fields": {"display_name": {}}},
-        "buyer_id": {"fields": {"brand": {"fields": {"display_name": {}}}}},
-        "partner_id": {"fields": {"display_name": {}}},
-        "fg_categ_type": {},
-        "slidercodesfg": {},
-        "lead_time": {},
-        "product_uom_qty": {},
-        "done_qty": {},
-        "balance_qty": {},
-        "final_price": {}
-    }
 
-    while True:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "manufacturing.order",
-                "method": "web_search_read",
-                "args": [],
-                "kwargs": {
-                    "domain": domain,
-                    "specification": specification,
-                    "offset": offset,
-                    "limit": batch_size,
-                    "context": {
-                        "lang": "en_US",
-                        "tz": "Asia/Dhaka",
-                        "uid": uid,
-                        "allowed_company_ids": [company_id],
-                        "bin_size": True,
-                        "current_company_id": company_id
-                    },
-                    "count_limit": 10001
-                }
-            },
-            "id": 2
-        }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/manufacturing.order/web_search_read", data=json.dumps(payload))
-        resp.raise_for_status()
-        response_json = resp.json()
-        print("Debug - Odoo response:", response_json)
-        result = response_json['result']
-        records = result['records']
-        
-        all_records.extend(records)
-        print(f"[Company {company_id}] Manufacturing Orders: Fetched {len(records)} records, total so far: {len(all_records)}")
-        
-        if len(records) < batch_size:
-            break
-            
-        offset += batch_size
+# --------- Fetch Manufacturing Order Data ---------
+def fetch_manufacturing_order_data(uid, company_id, batch_size=1000, on_page=None,
+                                   extra_domain=(), specification=None, label="Manufacturing Orders"):
+    domain = manufacturing_order_domain() + list(extra_domain)
+    specification = specification or build_specification(PENDING_ORDER_COLUMN_FIELDS)
 
-    print(f"Company {company_id} Manufacturing Orders total records fetched: {len(all_records)}")
-    return all_records
+    return fetch_all_pages(
+        session, ODOO_URL, uid, company_id, "manufacturing.order", domain, specification,
+        label, batch_size, on_page
+    )
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -172,6 +164,21 @@ def flatten_manufacturing_order_record(rec, company_name):
         "Company": company_name
     }
 
+# --------- Flatten a Page of Manufacturing Orders ---------
+def flatten_manufacturing_order_page(records, company_name):
+    """Flatten one fetched page into column lists (runs in a page worker when PAGE_WORKERS > 1)"""
+    report_unused_fields(
+        "Pending_Orders",
+        build_specification(PENDING_ORDER_COLUMN_FIELDS),
+        records,
+        lambda r: flatten_manufacturing_order_record(r, company_name)
+    )
+    return to_columns(
+        (flatten_manufacturing_order_record(r, company_name) for r in records),
+        list(PENDING_ORDER_COLUMN_FIELDS),
+        PENDING_ORDER_DIMENSION_COLUMNS
+    )
+
 # --------- Upload to Google Sheet ---------
 def paste_to_gsheet(df, sheet_name):
     try:
@@ -196,27 +203,27 @@ def paste_to_gsheet(df, sheet_name):
         local_tz = pytz.timezone("Asia/Dhaka")
         current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
         worksheet.update(range_name="B2", values=[[f"Last Updated: {current_timestamp}"]])
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, frame_fingerprint(df))
+        fit_worksheet(worksheet, 2, 2)
+        return
+
+    # Skip the clear/update cycle when the data matches the last upload
+    fingerprint = frame_fingerprint(df)
+    if is_unchanged(GOOGLE_SHEET_ID, sheet_name, fingerprint):
+        local_tz = pytz.timezone("Asia/Dhaka")
+        current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+        worksheet.update(range_name=f"{col_num_to_letter(len(df.columns) + 2)}2", values=[[f"Last Updated: {current_timestamp}"]])
+        fit_worksheet(worksheet, 2 + len(df), len(df.columns) + 2)
+        print(f"⏭️ {sheet_name} unchanged since last upload, only refreshed the timestamp.")
         return
 
-    # Helper function to convert column number to letter (1=A, 27=AA, etc.)
-    def col_num_to_letter(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(65 + (n % 26)) + result
-            n //= 26
-        return result
-    
     # Clear only range A:I instead of entire sheet
     worksheet.batch_clear(["A:M"])
     print(f"Cleared range A:M from sheet: {sheet_name}")
     
-    # Prepare data for writing (convert DataFrame to list of lists)
-    values_to_write = df.values.tolist()
-
-    if values_to_write:
+    if not df.empty:
         # Calculate required rows
-        required_rows = 2 + len(values_to_write)  # Header row 2 + data rows starting from row 3
+        required_rows = 2 + len(df)  # Header row 2 + data rows starting from row 3
         current_row_count = worksheet.row_count
 
         # Expand sheet if necessary
@@ -233,19 +240,57 @@ def paste_to_gsheet(df, sheet_name):
         worksheet.update(range_name=f"A2:{end_col}2", values=[header])
 
         # Write data starting from row 3 (A3)
-        range_to_update = f"A3:{end_col}{2 + len(values_to_write)}"
-        worksheet.update(range_name=range_to_update, values=values_to_write)
+        upload_frame(worksheet, df, 3)
 
         # Update timestamp (move one column to the right due to Company column, and to row 2)
         local_tz = pytz.timezone("Asia/Dhaka")
         current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
         worksheet.update(range_name=f"{col_num_to_letter(len(df.columns) + 2)}2", values=[[f"Last Updated: {current_timestamp}"]])
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, fingerprint)
+        # Blank row 1, header row 2 and the data; columns up to the timestamp
+        fit_worksheet(worksheet, required_rows, len(df.columns) + 2)
         
-        print(f"Data pasted to Google Sheet ({sheet_name}) with {len(values_to_write)} rows.")
+        print(f"Data pasted to Google Sheet ({sheet_name}) with {len(df)} rows.")
+
+# --------- Sheets Sink ---------
+def publish_tabs(tabs):
+    """
+    Paste each (sheet_name, df) with paste_to_gsheet; the Sheets sink of write_outputs.
+    Frames over SHEETS_TAB_CELL_BUDGET are split across numbered tabs.
+    """
+    for sheet_name, df in tabs:
+        # Two extra columns: the gap and the timestamp
+        shards = shard_frame(sheet_name, df, extra_columns=2)
+        if SHEETS_TAB_CELL_BUDGET:
+            spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
+            for shard_tab, _ in shards[1:]:
+                open_worksheet(spreadsheet, shard_tab)
+            remove_stale_shards(spreadsheet, sheet_name, len(shards))
+        for shard_tab, shard in shards:
+            paste_to_gsheet(shard, shard_tab)
 
 # --------- Main ---------
-if __name__ == "__main__":
-    uid = odoo_login()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch Carter's pending manufacturing orders and upload them to Google Sheets")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only estimate this run's Odoo and Sheets cost (runs search_count, uploads nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish frames staged by a run whose upload failed, without fetching from Odoo")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="With ID_DIFF_REFRESH=1, refetch every record instead of only new and changed ones")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling('Pending_Orders')
+
+    if args.resume_upload:
+        for sheet_tab, df in staged_frames("Pending_Orders"):
+            write_outputs("Pending_Orders", [(sheet_tab, df)], publish_tabs)
+            mark_published("Pending_Orders", sheet_tab)
+        sys.exit(0)
+
+    uid = login_uid(odoo_login)
 
     # Define company mapping with company names
     companies = [
@@ -253,7 +298,17 @@ if __name__ == "__main__":
         {"id": 3, "name": "Metal Trims"}
     ]
 
-    all_flat_records = []
+    if args.plan:
+        datasets = [
+            plan_dataset(session, ODOO_URL, uid, company["id"], "manufacturing.order", manufacturing_order_domain(), "Manufacturing Orders", 1000)
+            for company in companies
+        ]
+        # One tab: 2 metadata reads; clear, add rows, header, data and timestamp writes
+        sys.exit(1 if print_plan("Pending_Orders", datasets, len(PENDING_ORDER_COLUMN_FIELDS), 1, 2, 5,
+                                  gc.open_by_key(GOOGLE_SHEET_ID), ["Pending_Orders"]) else 0)
+
+    pool = PagePool()
+    diff_frames = []
 
     for company in companies:
         company_id = company["id"]
@@ -261,19 +316,46 @@ if __name__ == "__main__":
 
         print(f"\n========== Fetching Manufacturing Order Data for Company {company_id} ({company_name}) ==========")
 
-        # Fetch Manufacturing Order data
-        records = fetch_manufacturing_order_data(uid, company_id)
-
-        # Flatten records with company name
-        for r in records:
-            all_flat_records.append(flatten_manufacturing_order_record(r, company_name))
+        if ID_DIFF_REFRESH:
+            # Open orders close and leave the set, so diff the current ids against the last run's
+            diff_frames.append(diff_fetch(
+                partial(fetch_manufacturing_order_data, uid, company_id),
+                "Pending_Orders", company_id, "Manufacturing Orders",
+                build_specification(PENDING_ORDER_COLUMN_FIELDS),
+                partial(flatten_manufacturing_order_record, company_name=company_name),
+                list(PENDING_ORDER_COLUMN_FIELDS), full=args.full_refresh
+            ))
+        else:
+            # Fetch Manufacturing Order data
+            # Flatten each page with the company name as it arrives (in worker processes
+            # when PAGE_WORKERS > 1) so raw records are not kept in memory
+            fetch_manufacturing_order_data(
+                uid, company_id,
+                on_page=pool.on_page(partial(flatten_manufacturing_order_page, company_name=company_name))
+            )
 
         print(f"Data fetched successfully for Company {company_id} ({company_name})!")
 
     # Create DataFrame from all records
-    df = pd.DataFrame(all_flat_records)
+    with profile_stage("group"):
+        all_flat_records = new_row_store(PENDING_ORDER_COLUMN_FIELDS, PENDING_ORDER_DIMENSION_COLUMNS)
+        for columns in pool.collect():
+            all_flat_records.extend_columns(columns)
+        for frame in diff_frames:
+            all_flat_records.extend_columns([frame[col].tolist() for col in PENDING_ORDER_COLUMN_FIELDS])
+        pool.close()
+        df = all_flat_records.to_frame()
 
     # Paste to single sheet 'Pending_Orders'
-    paste_to_gsheet(df, "Pending_Orders")
+    # Staged first so a failed upload can be retried with --resume-upload
+    stage_frame("Pending_Orders", "Pending_Orders", df)
+    with profile_stage("upload"):
+        write_outputs("Pending_Orders", [("Pending_Orders", df)], publish_tabs)
+    mark_published("Pending_Orders", "Pending_Orders")
+    load_table("pending_orders", df)
+    record_run("Pending_Orders", len(df), df.size)
 
     print("\nAll companies' manufacturing order data processed successfully to 'Pending_Orders' sheet!")
+
+if __name__ == "__main__":
+    main()
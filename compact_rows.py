@@ -0,0 +1,207 @@
+import os
+import sys
+from array import array
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Set COMPACT_ROWS=1 to keep flattened rows as tuples instead of one dict per row
+COMPACT_ROWS = os.getenv("COMPACT_ROWS", "") not in ("", "0", "false", "False")
+# Set DIMENSION_ENCODING=1 to store repeated dimension values (customer, buyer,
+# category, ...) once per distinct value and keep integer codes per row
+DIMENSION_ENCODING = os.getenv("DIMENSION_ENCODING", "") not in ("", "0", "false", "False")
+
+# --------- Row Stores ---------
+class RowBlock:
+    """
+    Flattened rows kept as tuples that share one column index.
+
+    A dict per row repeats every column name and carries a hash table; a tuple
+    only holds the values, which makes large windows several times smaller.
+    """
+
+    __slots__ = ("columns", "index", "rows")
+
+    def __init__(self, columns):
+        self.columns = tuple(columns)
+        self.index = {col: i for i, col in enumerate(self.columns)}
+        self.rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def append(self, row):
+        self.rows.append(row)
+
+    def extend_dicts(self, dict_rows):
+        """Add flattened dict rows, keeping only their values in column order"""
+        columns = self.columns
+        self.rows.extend(tuple(row.get(col, "") for col in columns) for row in dict_rows)
+
+    def extend_columns(self, column_lists):
+        """Add rows given as one list per column (see to_columns)"""
+        self.rows.extend(zip(*column_lists))
+
+    def column(self, name):
+        i = self.index[name]
+        return [row[i] for row in self.rows]
+
+    def to_frame(self):
+        return pd.DataFrame.from_records(self.rows, columns=list(self.columns))
+
+class DictRows(list):
+    """Default row store: the flattened dicts as they are"""
+
+    def __init__(self, columns=()):
+        super().__init__()
+        self.columns = tuple(columns)
+
+    def extend_dicts(self, dict_rows):
+        self.extend(dict_rows)
+
+    def extend_columns(self, column_lists):
+        columns = self.columns
+        self.extend(dict(zip(columns, values)) for values in zip(*column_lists))
+
+    def to_frame(self):
+        return pd.DataFrame(list(self))
+
+# --------- Dimension Encoding ---------
+class Dictionary:
+    """Distinct values of one dimension column, each stored once and numbered in first-seen order"""
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        # Keyed by type too, so False and 0 (or 1 and 1.0) get separate codes
+        key = (value.__class__, value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.values)
+            self.values.append(sys.intern(value) if value.__class__ is str else value)
+        return code
+
+    def decode(self, codes):
+        """Values for an array of codes, as an object array"""
+        lookup = np.empty(len(self.values), dtype=object)
+        for i, value in enumerate(self.values):
+            lookup[i] = value
+        return lookup[np.asarray(codes)]
+
+class EncodedRows:
+    """
+    Column-oriented row store with dictionary-encoded dimension columns.
+
+    Dimension columns keep a 4-byte code per row plus one copy of each
+    distinct value; the other columns (amounts, quantities) are kept as
+    plain lists. Values are only decoded when the frame is built, and
+    group_sum() groups on the codes so hashing cost follows the number of
+    distinct values rather than the length of the strings.
+    """
+
+    def __init__(self, columns, dimensions):
+        self.columns = tuple(columns)
+        dimensions = set(dimensions)
+        self.dictionaries = {col: Dictionary() for col in self.columns if col in dimensions}
+        self.data = {col: array("I") if col in self.dictionaries else [] for col in self.columns}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def extend_dicts(self, dict_rows):
+        targets = [
+            (col, self.data[col], self.dictionaries.get(col))
+            for col in self.columns
+        ]
+        for row in dict_rows:
+            for col, values, dictionary in targets:
+                value = row.get(col, "")
+                values.append(dictionary.encode(value) if dictionary is not None else value)
+            self.length += 1
+
+    def extend_columns(self, column_lists):
+        """Add rows given as one list per column (see to_columns)"""
+        for col, column_values in zip(self.columns, column_lists):
+            dictionary = self.dictionaries.get(col)
+            if dictionary is not None:
+                encode = dictionary.encode
+                self.data[col].extend(encode(value) for value in column_values)
+            else:
+                self.data[col].extend(column_values)
+        self.length += len(column_lists[0]) if column_lists else 0
+
+    def column(self, name):
+        if name in self.dictionaries:
+            return self.dictionaries[name].decode(self.data[name]).tolist()
+        return list(self.data[name])
+
+    def _decoded(self, col):
+        if col in self.dictionaries:
+            return self.dictionaries[col].decode(self.data[col])
+        return self.data[col]
+
+    def to_frame(self):
+        if not self.length:
+            return pd.DataFrame()
+        return pd.DataFrame({col: self._decoded(col) for col in self.columns})
+
+    def group_sum(self, group_columns, sum_columns):
+        """
+        Same result as df.groupby(group_columns).agg(sum).reset_index(), but
+        the rows are grouped on their integer codes and only the distinct
+        groups are decoded.
+        """
+        if any(col not in self.dictionaries for col in group_columns):
+            frame = self.to_frame()
+            return frame.groupby(group_columns).agg({col: "sum" for col in sum_columns}).reset_index()
+
+        codes = pd.DataFrame({col: np.asarray(self.data[col]) for col in group_columns})
+        for col in sum_columns:
+            codes[col] = self._decoded(col)
+        by_code = codes.groupby(group_columns, sort=False).agg({col: "sum" for col in sum_columns}).reset_index()
+
+        # Decode the (few) group keys, then order them the way a groupby on the values would
+        for col in group_columns:
+            by_code[col] = self.dictionaries[col].decode(by_code[col].to_numpy())
+        return by_code.groupby(group_columns).agg({col: "sum" for col in sum_columns}).reset_index()
+
+def to_columns(dict_rows, columns, dimensions=()):
+    """
+    Turn flattened dict rows into one list per column.
+
+    This is the compact form page workers send back to the main process:
+    the column names are not repeated per row and the lists pickle far
+    smaller than a list of dicts. Strings in `dimensions` are interned, so
+    each distinct value is pickled once per page instead of once per row.
+    """
+    column_lists = [[] for _ in columns]
+    dimensions = set(dimensions)
+    interned = [col in dimensions for col in columns]
+    for row in dict_rows:
+        for values, col, intern in zip(column_lists, columns, interned):
+            value = row.get(col, "")
+            values.append(sys.intern(value) if intern and value.__class__ is str else value)
+    return column_lists
+
+def new_row_store(columns, dimensions=()):
+    """
+    Return an EncodedRows when DIMENSION_ENCODING is enabled and the report
+    names its dimension columns, a RowBlock when COMPACT_ROWS is enabled,
+    otherwise a plain list of dicts
+    """
+    if DIMENSION_ENCODING and dimensions:
+        return EncodedRows(columns, dimensions)
+    return RowBlock(columns) if COMPACT_ROWS else DictRows(columns)
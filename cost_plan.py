@@ -0,0 +1,137 @@
+import re
+import math
+from dotenv import load_dotenv
+from odoo_fetch import search_count, ODOO_PAGE_MIN, ODOO_PAGE_MAX, ODOO_ADAPTIVE_PAGING, PAGE_STATE
+from pipeline_state import load_state, update_state
+from run_stats import last_run
+from sheets_rate import SHEETS_READS_PER_MINUTE, SHEETS_WRITES_PER_MINUTE
+load_dotenv()
+
+# --------- Limits ---------
+# web_search_read is called with count_limit 10001: beyond that Odoo stops counting
+ODOO_COUNT_LIMIT = 10001
+# Google Sheets: cells per spreadsheet
+SHEETS_CELL_LIMIT = 10_000_000
+
+# Planned cells per "<spreadsheet id>:<report>", with the tabs the report replaces
+SHEET_PLAN_STATE = "sheet_plans"
+
+# --------- Per-Dataset Estimate ---------
+def plan_dataset(session, odoo_url, uid, company_id, model, domain, label, batch_size):
+    """
+    Count the records one fetch would return and estimate its pages, bytes and
+    seconds from the per-record costs the adaptive pager stored last run.
+    Only search_count is called, nothing is fetched.
+    """
+    count = search_count(session, odoo_url, uid, company_id, model, domain)
+    saved = load_state(PAGE_STATE).get(f"{model}:{label}", {}) if ODOO_ADAPTIVE_PAGING else {}
+    limit = max(ODOO_PAGE_MIN, min(ODOO_PAGE_MAX, saved["limit"])) if "limit" in saved else batch_size
+    bytes_per_record = saved.get("bytes_per_record")
+    seconds_per_record = saved.get("seconds_per_record")
+    return {
+        "label": label,
+        "company_id": company_id,
+        "count": count,
+        "limit": limit,
+        # A full last page is followed by one more, empty, request
+        "pages": count // limit + 1,
+        "bytes": count * bytes_per_record if bytes_per_record is not None else None,
+        "seconds": count * seconds_per_record if seconds_per_record is not None else None
+    }
+
+# --------- Spreadsheet Size ---------
+def _replaces(tabs, title):
+    # Shard tabs ("Dispatch 2", see sheet_publish.shard_frame) are replaced with their first tab
+    return any(title == tab or re.fullmatch(rf"{re.escape(tab)} \d+", title) for tab in tabs)
+
+def spreadsheet_cells(spreadsheet, report, cells, replaced_tabs):
+    """
+    (cells, reports): the cells `spreadsheet` will hold after this run of
+    `report`, and the reports whose plans were counted.
+
+    Every tab counts with its current grid (one metadata read), on top of
+    which `report` adds `cells`, except the tabs a report replaces: those
+    count with that report's planned cells instead. Each report's plan is
+    recorded, so reports sharing a spreadsheet see each other's latest plan.
+    A report that appends (no replaced tabs) only counts in its own plan: once
+    it ran, its rows are part of the current grid.
+    """
+    update_state(SHEET_PLAN_STATE, f"{spreadsheet.id}:{report}", {"tabs": list(replaced_tabs), "cells": cells})
+    plans = {
+        key.split(":", 1)[1]: plan for key, plan in load_state(SHEET_PLAN_STATE).items()
+        if key.startswith(f"{spreadsheet.id}:")
+    }
+    plans = {name: plan for name, plan in plans.items() if name == report or plan["tabs"]}
+    replaced = [tab for plan in plans.values() for tab in plan["tabs"]]
+    total = sum(plan["cells"] for plan in plans.values())
+    for worksheet in spreadsheet.worksheets():
+        if not _replaces(replaced, worksheet.title):
+            total += worksheet.row_count * worksheet.col_count
+    return total, sorted(plans)
+
+# --------- Report Plan ---------
+def _size(num_bytes):
+    return f"{num_bytes / (1024 * 1024):.1f} MiB" if num_bytes is not None else "unknown"
+
+def print_plan(report, datasets, columns, tabs, reads_per_tab, writes_per_tab,
+               spreadsheet=None, replaced_tabs=()):
+    """
+    Print the expected Odoo and Sheets cost of a report run and return the
+    number of warnings (Sheets limits or the count_limit cap).
+
+    Rows and cells are scaled from the last run's rows per fetched record;
+    without a previous run every record is assumed to become one row of
+    `columns` cells. Sheets calls are the report's per-tab read/write
+    requests times its tabs. With `spreadsheet`, the cell limit is checked
+    against the whole spreadsheet (see spreadsheet_cells); `replaced_tabs`
+    are the tabs the report rewrites, the others it writes are appended to.
+    """
+    print(f"\n========== Plan: {report} ==========")
+    warnings = []
+    for d in datasets:
+        print(f"[Company {d['company_id']}] {d['label']}: {d['count']} records, "
+              f"~{d['pages']} pages of {d['limit']}, {_size(d['bytes'])}"
+              + (f", ~{d['seconds']:.0f}s" if d["seconds"] is not None else ""))
+        if d["count"] >= ODOO_COUNT_LIMIT:
+            warnings.append(f"{d['label']} company {d['company_id']} matches {d['count']} records, "
+                            f"over the count_limit cap of {ODOO_COUNT_LIMIT}")
+
+    records = sum(d["count"] for d in datasets)
+    last = last_run(report)
+    if last and last.get("records"):
+        rows = math.ceil(last["rows"] * records / last["records"])
+        cells = math.ceil(last["cells"] * records / last["records"])
+    else:
+        rows, cells = records, records * columns
+
+    fetch_seconds = sum(d["seconds"] for d in datasets if d["seconds"] is not None)
+    # Everything that isn't fetching (flattening, grouping, Sheets) scaled like the rows
+    other_seconds = 0.0
+    if last and last.get("records"):
+        other_seconds = max(last["seconds"] - last["fetch_seconds"], 0) * records / last["records"]
+
+    reads, writes = tabs * reads_per_tab, tabs * writes_per_tab
+    known_bytes = [d["bytes"] for d in datasets if d["bytes"] is not None]
+    print(f"Odoo: {records} records in ~{sum(d['pages'] for d in datasets)} pages, "
+          f"{_size(sum(known_bytes)) if known_bytes else 'unknown size'}")
+    print(f"Sheets: ~{rows} rows / ~{cells} cells, {reads} read and {writes} write requests")
+    print(f"Expected time: ~{fetch_seconds + other_seconds:.0f}s"
+          + ("" if last else " (no previous run, fetch time only where known)"))
+
+    if spreadsheet is not None:
+        total, reports = spreadsheet_cells(spreadsheet, report, cells, replaced_tabs)
+        print(f"Spreadsheet: ~{total} cells after the run (plans of {', '.join(reports)} and the other tabs)")
+        if total > SHEETS_CELL_LIMIT:
+            warnings.append(f"~{total} cells in the spreadsheet exceeds the Sheets limit of {SHEETS_CELL_LIMIT} cells per spreadsheet")
+    elif cells > SHEETS_CELL_LIMIT:
+        warnings.append(f"~{cells} cells exceeds the Sheets limit of {SHEETS_CELL_LIMIT} cells per spreadsheet")
+    if reads > SHEETS_READS_PER_MINUTE:
+        warnings.append(f"{reads} read requests exceed the quota of {SHEETS_READS_PER_MINUTE} per minute")
+    if writes > SHEETS_WRITES_PER_MINUTE:
+        warnings.append(f"{writes} write requests exceed the quota of {SHEETS_WRITES_PER_MINUTE} per minute")
+
+    for warning in warnings:
+        print(f"⚠️ {warning}")
+    if not warnings:
+        print("✅ Within Odoo and Sheets limits")
+    return len(warnings)
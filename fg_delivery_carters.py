@@ -1,13 +1,31 @@
 import os
+import sys
 import json
+import argparse
 import base64
 import requests
-import pandas as pd
 import gspread
 from google.oauth2.service_account import Credentials
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
+from odoo_fetch import fetch_all_pages, odoo_post, login_uid
+from sheets_rate import RateLimitedHTTPClient
+from cost_plan import plan_dataset, print_plan
+from run_stats import record_run
+from upload_staging import stage_frame, mark_published, staged_frames
+from report_db import load_table
+from output_sinks import write_outputs
+from stage_profile import enable_profiling, profile_stage
+from odoo_spec import build_specification, report_unused_fields
+from functools import partial
+from hash_aggregate import PartialAggregate
+from page_pool import PagePool
+from id_snapshot import ID_DIFF_REFRESH, diff_fetch
+from sheet_publish import (
+    frame_fingerprint, is_unchanged, remember_upload, fit_worksheet, col_num_to_letter, upload_frame,
+    SHEETS_TAB_CELL_BUDGET, shard_frame, open_worksheet, remove_stale_shards
+)
 load_dotenv()
 
 # --------- Config from Environment ---------
@@ -18,13 +36,16 @@ ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
 GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1WFalOBdShdwWopazEohOlE4mbjKCIMynlx5R2mFBqR8"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
 
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
@@ -42,14 +63,26 @@ def odoo_login():
         },
         "id": 1
     }
-    resp = session.post(url, data=json.dumps(payload))
-    resp.raise_for_status()
+    resp = odoo_post(session, url, json.dumps(payload))
     return resp.json()['result']['uid']
 
-# --------- Fetch FG Delivery Carters Data ---------
-def fetch_fg_delivery_data(uid, company_id, batch_size=200):
-    all_records, offset = [], 0
-    
+# --------- Published Columns ---------
+# Odoo fields (relative to operation.details) behind each column that reaches the sheet
+FG_DELIVERY_COLUMN_FIELDS = {
+    "Action Date": ["action_date"],
+    "Order Date": ["date_order"],
+    "OA": ["oa_id.display_name"],
+    "Buyer ID/Brand Group": ["buyer_id.brand.display_name"],
+    "Customer": ["partner_id.display_name"],
+    "Item": ["fg_categ_type"],
+    "Slider Code": ["slidercodesfg"],
+    "Final Price": ["final_price"],
+    "Qty": ["qty"],
+    "Company": []
+}
+
+# --------- FG Delivery Carters Domain ---------
+def fg_delivery_domain():
     # Get date range: from 2025-04-01 to current date for the domain filter
     local_tz = pytz.timezone("Asia/Dhaka")
     now = datetime.now(local_tz)
@@ -62,14 +95,19 @@ def fetch_fg_delivery_data(uid, company_id, batch_size=200):
     # - state not done/closed
     # - buyer_id.brand in [183784, 180989]
     # - date range (from 2025-04-01 to current date)
-    domain = [
+    return [
         ["next_operation", "=", "Delivery"],
         ["state", "not in", ["done", "closed"]],
         ["buyer_id.brand", "in", [183784, 180989]],
         ["action_date", ">=", start_date],
         ["action_date", "<=", current_date]
     ]
-    
+
+# --------- Fetch FG Delivery Carters Data ---------
+def fetch_fg_delivery_data(uid, company_id, batch_size=200, on_page=None,
+                           extra_domain=(), specification=None, label="FG Delivery"):
+    domain = fg_delivery_domain() + list(extra_domain)
+
     # First, get the total count of records to verify
     count_payload = {
         "jsonrpc": "2.0",
@@ -91,68 +129,16 @@ def fetch_fg_delivery_data(uid, company_id, batch_size=200):
         },
         "id": 3
     }
-    count_resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/operation.details/search_count", data=json.dumps(count_payload))
-    count_resp.raise_for_status()
+    count_resp = odoo_post(session, f"{ODOO_URL}/web/dataset/call_kw/operation.details/search_count", json.dumps(count_payload))
     total_count = count_resp.json()['result']
-    print(f"[Company {company_id}] FG Delivery: Total records available: {total_count}")
+    print(f"[Company {company_id}] {label}: Total records available: {total_count}")
     
-    specification = {
-        "action_date": {},
-        "date_order": {},
-        "oa_id": {"fields": {"display_name": {}}},
-        "buyer_id": {"fields": {"brand": {"fields": {"display_name": {}}}}},
-        "partner_id": {"fields": {"display_name": {}}},
-        "fg_categ_type": {},
-        "slidercodesfg": {},
-        "final_price": {},
-        "qty": {}
-    }
+    specification = specification or build_specification(FG_DELIVERY_COLUMN_FIELDS)
 
-    while True:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "operation.details",
-                "method": "web_search_read",
-                "args": [],
-                "kwargs": {
-                    "domain": domain,
-                    "specification": specification,
-                    "offset": offset,
-                    "limit": batch_size,
-                    "context": {
-                        "lang": "en_US",
-                        "tz": "Asia/Dhaka",
-                        "uid": uid,
-                        "allowed_company_ids": [company_id],
-                        "bin_size": True,
-                        "current_company_id": company_id
-                    },
-                    "count_limit": 10001
-                }
-            },
-            "id": 2
-        }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/operation.details/web_search_read", data=json.dumps(payload))
-        resp.raise_for_status()
-        result = resp.json()['result']
-        records = result['records']
-        
-        # Debug information
-        print(f"Debug - Offset: {offset}, Batch size: {batch_size}, Records returned: {len(records)}")
-        
-        all_records.extend(records)
-        print(f"[Company {company_id}] FG Delivery: Fetched {len(records)} records, total so far: {len(all_records)}")
-        
-        if len(records) < batch_size:
-            print(f"Debug - Less records returned than batch size, stopping pagination")
-            break
-            
-        offset += batch_size
-
-    print(f"Company {company_id} FG Delivery total records fetched: {len(all_records)}")
-    return all_records
+    return fetch_all_pages(
+        session, ODOO_URL, uid, company_id, "operation.details", domain, specification,
+        label, batch_size, on_page
+    )
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -208,6 +194,21 @@ def flatten_fg_delivery_record(rec, company_name):
         "Company": company_name
     }
 
+# --------- Aggregate a Page of FG Delivery Records ---------
+# Group by all columns except Qty and sum the Qty
+FG_DELIVERY_GROUP_COLUMNS = [col for col in FG_DELIVERY_COLUMN_FIELDS if col != 'Qty']
+
+def aggregate_fg_delivery_page(records, company_name):
+    """Flatten one fetched page into per-group Qty totals (runs in a page worker when PAGE_WORKERS > 1)"""
+    report_unused_fields(
+        "Dispatch",
+        build_specification(FG_DELIVERY_COLUMN_FIELDS),
+        records,
+        lambda r: flatten_fg_delivery_record(r, company_name)
+    )
+    page_agg = PartialAggregate(FG_DELIVERY_GROUP_COLUMNS, {'Qty': 'sum'})
+    return page_agg.add_rows(flatten_fg_delivery_record(r, company_name) for r in records)
+
 # --------- Upload to Google Sheet ---------
 def paste_to_gsheet(df, sheet_name):
     worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
@@ -219,17 +220,20 @@ def paste_to_gsheet(df, sheet_name):
         local_tz = pytz.timezone("Asia/Dhaka")
         current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
         worksheet.update(range_name="B1", values=[[f"Last Updated: {current_timestamp}"]])
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, frame_fingerprint(df))
+        fit_worksheet(worksheet, 1, 2)
+        return
+
+    # Skip the clear/update cycle when the data matches the last upload
+    fingerprint = frame_fingerprint(df)
+    if is_unchanged(GOOGLE_SHEET_ID, sheet_name, fingerprint):
+        local_tz = pytz.timezone("Asia/Dhaka")
+        current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+        worksheet.update(range_name=f"{col_num_to_letter(len(df.columns) + 2)}1", values=[[f"Last Updated: {current_timestamp}"]])
+        fit_worksheet(worksheet, 1 + len(df), len(df.columns) + 2)
+        print(f"⏭️ {sheet_name} unchanged since last upload, only refreshed the timestamp.")
         return
 
-    # Helper function to convert column number to letter (1=A, 27=AA, etc.)
-    def col_num_to_letter(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(65 + (n % 26)) + result
-            n //= 26
-        return result
-    
     # Clear only range A:I instead of entire sheet
     worksheet.batch_clear(["A:I"])
     print(f"Cleared range A:I from sheet: {sheet_name}")
@@ -239,12 +243,9 @@ def paste_to_gsheet(df, sheet_name):
     end_col_letter = col_num_to_letter(len(header))
     worksheet.update(range_name=f"A1:{end_col_letter}1", values=[header])
     
-    # Prepare data for writing (convert DataFrame to list of lists)
-    values_to_write = df.values.tolist()
-    
-    if values_to_write:
+    if not df.empty:
         # Calculate required rows
-        required_rows = 1 + len(values_to_write)  # Header + data rows
+        required_rows = 1 + len(df)  # Header + data rows
         current_row_count = worksheet.row_count
         
         # Expand sheet if necessary
@@ -253,23 +254,65 @@ def paste_to_gsheet(df, sheet_name):
             worksheet.add_rows(rows_to_add)
             print(f"Added {rows_to_add} rows to sheet. New total: {required_rows}")
         
-        # Calculate the end column letter
-        end_col = col_num_to_letter(len(df.columns))
-        
         # Write data starting from row 2
-        range_to_update = f"A2:{end_col}{1 + len(values_to_write)}"
-        worksheet.update(range_name=range_to_update, values=values_to_write)
+        upload_frame(worksheet, df, 2)
         
         # Update timestamp (move one column to the right due to Company column)
         local_tz = pytz.timezone("Asia/Dhaka")
         current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
         worksheet.update(range_name=f"{col_num_to_letter(len(header) + 2)}1", values=[[f"Last Updated: {current_timestamp}"]])
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, fingerprint)
+        # Header + data rows, columns up to the timestamp
+        fit_worksheet(worksheet, required_rows, len(header) + 2)
         
-        print(f"Data pasted to Google Sheet ({sheet_name}) with {len(values_to_write)} rows.")
+        print(f"Data pasted to Google Sheet ({sheet_name}) with {len(df)} rows.")
+
+# --------- Summary ---------
+def summarize_dispatch(df):
+    """Qty per Action Date, Company, Customer and Item; what Sheets gets with the sheets-summary sink"""
+    if df.empty:
+        return df
+    return df.groupby(["Action Date", "Company", "Customer", "Item"], as_index=False)["Qty"].sum()
+
+# --------- Sheets Sink ---------
+def publish_tabs(tabs):
+    """
+    Paste each (sheet_name, df) with paste_to_gsheet; the Sheets sink of write_outputs.
+    Frames over SHEETS_TAB_CELL_BUDGET are split across numbered tabs.
+    """
+    for sheet_name, df in tabs:
+        # Two extra columns: the gap and the timestamp
+        shards = shard_frame(sheet_name, df, extra_columns=2)
+        if SHEETS_TAB_CELL_BUDGET:
+            spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
+            for shard_tab, _ in shards[1:]:
+                open_worksheet(spreadsheet, shard_tab)
+            remove_stale_shards(spreadsheet, sheet_name, len(shards))
+        for shard_tab, shard in shards:
+            paste_to_gsheet(shard, shard_tab)
 
 # --------- Main ---------
-if __name__ == "__main__":
-    uid = odoo_login()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch Carter's FG delivery data and upload it to Google Sheets")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only estimate this run's Odoo and Sheets cost (runs search_count, uploads nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish frames staged by a run whose upload failed, without fetching from Odoo")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    parser.add_argument("--full-refresh", action="store_true",
+                        help="With ID_DIFF_REFRESH=1, refetch every record instead of only new and changed ones")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling('Dispatch')
+
+    if args.resume_upload:
+        for sheet_tab, df in staged_frames("Dispatch"):
+            write_outputs("Dispatch", [(sheet_tab, df)], publish_tabs, summarize=summarize_dispatch)
+            mark_published("Dispatch", sheet_tab)
+        sys.exit(0)
+
+    uid = login_uid(odoo_login)
 
     # Define company mapping with company names
     companies = [
@@ -277,7 +320,18 @@ if __name__ == "__main__":
         {"id": 3, "name": "Metal Trims"}
     ]
 
-    all_flat_records = []
+    if args.plan:
+        datasets = [
+            plan_dataset(session, ODOO_URL, uid, company["id"], "operation.details", fg_delivery_domain(), "FG Delivery", 200)
+            for company in companies
+        ]
+        # One tab: 2 metadata reads; clear, header, add rows, data and timestamp writes
+        sys.exit(1 if print_plan("Dispatch", datasets, len(FG_DELIVERY_COLUMN_FIELDS), 1, 2, 5,
+                                  gc.open_by_key(GOOGLE_SHEET_ID), ["Dispatch"]) else 0)
+
+    # Group by all columns except Qty and sum the Qty, page by page as records arrive
+    pool = PagePool()
+    dispatch_agg = PartialAggregate(FG_DELIVERY_GROUP_COLUMNS, {'Qty': 'sum'})
 
     for company in companies:
         company_id = company["id"]
@@ -285,30 +339,45 @@ if __name__ == "__main__":
 
         print(f"\n========== Fetching FG Delivery Data for Company {company_id} ({company_name}) ==========")
 
-        # Fetch FG Delivery data
-        records = fetch_fg_delivery_data(uid, company_id)
-
-        # Flatten records with company name
-        for r in records:
-            all_flat_records.append(flatten_fg_delivery_record(r, company_name))
+        if ID_DIFF_REFRESH:
+            # Delivered operations leave the set, so diff the current ids against the last run's;
+            # the snapshot keeps one row per record and they are grouped here
+            rows = diff_fetch(
+                partial(fetch_fg_delivery_data, uid, company_id),
+                "Dispatch", company_id, "FG Delivery",
+                build_specification(FG_DELIVERY_COLUMN_FIELDS),
+                partial(flatten_fg_delivery_record, company_name=company_name),
+                list(FG_DELIVERY_COLUMN_FIELDS), full=args.full_refresh
+            )
+            dispatch_agg.add_rows(rows.to_dict("records"))
+        else:
+            # Fetch FG Delivery data
+            # Each page becomes a partial aggregate (in worker processes when PAGE_WORKERS > 1)
+            fetch_fg_delivery_data(
+                uid, company_id,
+                on_page=pool.on_page(partial(aggregate_fg_delivery_page, company_name=company_name))
+            )
 
         print(f"Data fetched successfully for Company {company_id} ({company_name})!")
 
-    # Create DataFrame from all records
-    df = pd.DataFrame(all_flat_records)
-
-    # Group by all columns except Qty and sum the Qty
-    if not df.empty:
-        # Define aggregation: sum Qty, keep first for other columns
-        agg_dict = {col: 'first' for col in df.columns if col not in ['Qty', 'Action Date']}
-        agg_dict['Qty'] = 'sum'
-        # Group by Action Date and other identifying columns
-        group_cols = [col for col in df.columns if col not in ['Qty']]
-        df = df.groupby(group_cols, as_index=False).agg(agg_dict)
-        # Reorder columns to match original order
-        df = df[list(all_flat_records[0].keys())]
+    # Merge the per-page partials, then create the grouped DataFrame in the original column order
+    with profile_stage("group"):
+        for page_agg in pool.collect():
+            dispatch_agg.merge(page_agg)
+        pool.close()
+        print(f"Grouped {dispatch_agg.row_count} records into {len(dispatch_agg)} rows")
+        df = dispatch_agg.to_frame(columns=list(FG_DELIVERY_COLUMN_FIELDS))
 
     # Paste to single sheet 'Dispatch'
-    paste_to_gsheet(df, "Dispatch")
+    # Staged first so a failed upload can be retried with --resume-upload
+    stage_frame("Dispatch", "Dispatch", df)
+    with profile_stage("upload"):
+        write_outputs("Dispatch", [("Dispatch", df)], publish_tabs, summarize=summarize_dispatch)
+    mark_published("Dispatch", "Dispatch")
+    load_table("dispatch", df)
+    record_run("Dispatch", len(df), df.size)
 
     print("\nAll companies' FG Delivery data processed successfully to 'Dispatch' sheet!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import sys
+import pandas as pd
+
+# --------- Aggregate Functions ---------
+# Each aggregation is (initial state from the first value, update(state, value), merge(state, state))
+def _number(value):
+    # Odoo returns False and the flatteners use "" for empty numbers; pandas sums treat them as 0
+    if value is None or value is False or value == "":
+        return 0
+    return value
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and value != value)
+
+AGGREGATIONS = {
+    "sum": (
+        lambda v: _number(v),
+        lambda state, v: state + _number(v),
+        lambda a, b: a + b
+    ),
+    # Like pandas "first": the first non-null value
+    "first": (
+        lambda v: v,
+        lambda state, v: v if _is_missing(state) else state,
+        lambda a, b: b if _is_missing(a) else a
+    ),
+    "count": (
+        lambda v: 0 if _is_missing(v) else 1,
+        lambda state, v: state if _is_missing(v) else state + 1,
+        lambda a, b: a + b
+    ),
+    "min": (
+        lambda v: v,
+        lambda state, v: v if v < state else state,
+        lambda a, b: b if b < a else a
+    ),
+    "max": (
+        lambda v: v,
+        lambda state, v: v if v > state else state,
+        lambda a, b: b if b > a else a
+    )
+}
+
+# --------- Partial Aggregate ---------
+class PartialAggregate:
+    """
+    Running per-key aggregates that can be fed page by page and merged.
+
+    Memory grows with the number of groups, not the number of rows: each
+    group keeps one small list of running values. Partials built for different
+    pages, companies or worker processes are combined with merge(), and
+    to_frame() gives the same result as
+    df.groupby(key_columns, as_index=False).agg(aggregations).
+
+    Rows with a null (None or NaN) key are left out of the groups, as groupby
+    drops them; they still count in row_count. Columns listed in `line_totals`
+    also get a plain running sum over every row fed in, independent of the
+    groups, to check the grouped totals against.
+    """
+
+    def __init__(self, key_columns, aggregations, line_totals=()):
+        self.key_columns = tuple(key_columns)
+        self.aggregations = dict(aggregations)
+        self.value_columns = tuple(self.aggregations)
+        self.groups = {}
+        self.row_count = 0
+        self.line_totals = {col: 0 for col in line_totals}
+
+    def __len__(self):
+        return len(self.groups)
+
+    def add_rows(self, rows):
+        """Fold flattened dict rows into the running aggregates"""
+        key_columns = self.key_columns
+        value_columns = self.value_columns
+        functions = [AGGREGATIONS[self.aggregations[col]] for col in value_columns]
+        groups = self.groups
+        line_totals = self.line_totals
+
+        for row in rows:
+            self.row_count += 1
+            for col in line_totals:
+                line_totals[col] += _number(row[col])
+            key = tuple(row[col] for col in key_columns)
+            state = groups.get(key)
+            if state is None:
+                # Like groupby's dropna: rows with a null key belong to no group (null
+                # keys are never stored, so they always end up here)
+                if any(_is_missing(v) for v in key):
+                    continue
+                # Keys are kept once per group; interning lets groups share repeated values
+                key = tuple(sys.intern(v) if v.__class__ is str else v for v in key)
+                groups[key] = [init(row[col]) for (init, _, _), col in zip(functions, value_columns)]
+            else:
+                for i, ((_, update, _), col) in enumerate(zip(functions, value_columns)):
+                    state[i] = update(state[i], row[col])
+        return self
+
+    def merge(self, other):
+        """Fold another partial with the same keys and aggregations into this one"""
+        if (other.key_columns != self.key_columns or other.aggregations != self.aggregations
+                or other.line_totals.keys() != self.line_totals.keys()):
+            raise ValueError("Cannot merge partial aggregates with different keys, aggregations or line totals")
+        functions = [AGGREGATIONS[self.aggregations[col]] for col in self.value_columns]
+        for key, other_state in other.groups.items():
+            state = self.groups.get(key)
+            if state is None:
+                self.groups[key] = list(other_state)
+            else:
+                for i, (_, _, merge) in enumerate(functions):
+                    state[i] = merge(state[i], other_state[i])
+        self.row_count += other.row_count
+        for col, total in other.line_totals.items():
+            self.line_totals[col] += total
+        return self
+
+    def total(self, column):
+        """Running sum of `column` over every row fed in (a column given in `line_totals`)"""
+        return self.line_totals[column]
+
+    def to_frame(self, columns=None, sort=True):
+        """
+        Build the grouped frame: key columns first, then the aggregated columns,
+        sorted by key like pandas groupby. `columns` reorders the result.
+        """
+        keys = list(self.groups)
+        if sort:
+            try:
+                keys.sort()
+            except TypeError:
+                # Mixed types in a key column (e.g. False and str) can't be compared directly
+                keys.sort(key=lambda k: tuple(str(v) for v in k))
+        records = [key + tuple(self.groups[key]) for key in keys]
+        df = pd.DataFrame.from_records(records, columns=list(self.key_columns + self.value_columns))
+        if columns is not None:
+            df = df[list(columns)]
+        return df
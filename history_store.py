@@ -0,0 +1,152 @@
+import os
+import sys
+import argparse
+import pandas as pd
+from dotenv import load_dotenv
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Root of the date-partitioned Parquet history (one folder per dataset)
+HISTORY_STORE_DIR = os.getenv("HISTORY_STORE_DIR", "history")
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "zstd")
+
+# Layout: <HISTORY_STORE_DIR>/<dataset>/date=YYYY-MM-DD/<part>.parquet
+
+# --------- Column Types ---------
+def to_columnar(df):
+    """
+    Give every column a single type so it can be stored as Parquet.
+
+    Odoo returns False for empty fields and the flatteners use "" for missing
+    numbers, so object columns can mix types. Columns whose non-empty values
+    are all numeric become numbers (empty -> NaN); the rest become strings.
+    """
+    df = df.copy()
+    for col in df.columns:
+        if not pd.api.types.is_object_dtype(df[col]):
+            continue
+        values = df[col].map(lambda v: None if v is None or v is False or v == "" else v)
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.notna().sum() == values.notna().sum():
+            df[col] = numeric
+        else:
+            df[col] = values.map(lambda v: "" if v is None else str(v))
+    return df
+
+# --------- Write ---------
+def partition_dir(dataset, date):
+    return os.path.join(HISTORY_STORE_DIR, dataset, f"date={date}")
+
+def write_partition(dataset, date, df, part="data"):
+    """
+    Store one day's frame as <dataset>/date=<date>/<part>.parquet.
+
+    Writing the same (dataset, date, part) again replaces it, so reruns on the
+    same day don't duplicate history. The file is written to a temporary name
+    first and renamed, so readers never see a half-written partition.
+    """
+    if df.empty:
+        print(f"Skip: {dataset} {date} {part} is empty, nothing stored.")
+        return None
+    folder = partition_dir(dataset, date)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{part}.parquet")
+    tmp_path = f"{path}.tmp"
+    to_columnar(df).to_parquet(tmp_path, index=False, compression=HISTORY_COMPRESSION)
+    os.replace(tmp_path, path)
+    print(f"🗄️ Stored {len(df)} rows in history: {path}")
+    return path
+
+# --------- Read ---------
+def list_partitions(dataset, start=None, end=None):
+    """Return the (date, folder) pairs of a dataset within [start, end], oldest first"""
+    root = os.path.join(HISTORY_STORE_DIR, dataset)
+    if not os.path.isdir(root):
+        return []
+    partitions = []
+    for name in sorted(os.listdir(root)):
+        if not name.startswith("date="):
+            continue
+        date = name[len("date="):]
+        if (start and date < start) or (end and date > end):
+            continue
+        partitions.append((date, os.path.join(root, name)))
+    return partitions
+
+def read_history(dataset, start=None, end=None, columns=None, filters=None, parts=None):
+    """
+    Read a dataset's history without touching the Google Sheet.
+
+    Only partitions dated within [start, end] (YYYY-MM-DD, inclusive) are opened,
+    only `columns` are decoded, and `filters` ({column: value or list of values})
+    is pushed down to the Parquet reader. `parts` limits which part files are
+    read (e.g. ["company_1"]). A "Date" column is added from the partition name
+    when the stored frame doesn't have one.
+    """
+    pyarrow_filters = None
+    if filters:
+        pyarrow_filters = [
+            (col, "in", list(value)) if isinstance(value, (list, tuple, set)) else (col, "==", value)
+            for col, value in filters.items()
+        ]
+
+    frames = []
+    for date, folder in list_partitions(dataset, start, end):
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(".parquet"):
+                continue
+            if parts and name[:-len(".parquet")] not in parts:
+                continue
+            frame = pd.read_parquet(os.path.join(folder, name), columns=columns, filters=pyarrow_filters)
+            if "Date" not in frame.columns and (columns is None or "Date" in columns):
+                frame.insert(0, "Date", date)
+            frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True)
+
+# --------- Retention ---------
+def remove_partition(dataset, date, part=None):
+    """Delete one part file of a partition (or the whole partition), and the folder once it is empty"""
+    folder = partition_dir(dataset, date)
+    names = [f"{part}.parquet"] if part else (os.listdir(folder) if os.path.isdir(folder) else [])
+    for name in names:
+        try:
+            os.remove(os.path.join(folder, name))
+        except FileNotFoundError:
+            pass
+    if os.path.isdir(folder) and not os.listdir(folder):
+        os.rmdir(folder)
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the local Parquet history store")
+    parser.add_argument("dataset", help="Dataset name, e.g. pend_pi_grouped")
+    parser.add_argument("--start", help="First date to read (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last date to read (YYYY-MM-DD)")
+    parser.add_argument("--columns", help="Comma-separated columns to read")
+    parser.add_argument("--part", action="append", help="Part file to read (repeatable), e.g. company_1")
+    parser.add_argument("--where", action="append", default=[], metavar="COLUMN=VALUE",
+                        help="Equality filter pushed down to the reader (repeatable)")
+    parser.add_argument("--csv", help="Write the result to this CSV file instead of printing it")
+    args = parser.parse_args()
+
+    where = {}
+    for condition in args.where:
+        column, _, value = condition.partition("=")
+        where.setdefault(column, []).append(value)
+
+    result = read_history(
+        args.dataset,
+        start=args.start,
+        end=args.end,
+        columns=args.columns.split(",") if args.columns else None,
+        filters=where or None,
+        parts=args.part
+    )
+    if args.csv:
+        result.to_csv(args.csv, index=False)
+        print(f"✅ Wrote {len(result)} rows to {args.csv}")
+    else:
+        result.to_csv(sys.stdout, index=False)
@@ -0,0 +1,126 @@
+import os
+import json
+import pickle
+import hashlib
+import pandas as pd
+from dotenv import load_dotenv
+from pipeline_state import state_path
+from stage_profile import profile_stage
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Set ID_DIFF_REFRESH=1 to refresh "currently pending" datasets incrementally:
+# fetch the ids matching the domain with their write_date, then full records
+# only for new or changed ids; ids that left the domain are dropped
+ID_DIFF_REFRESH = os.getenv("ID_DIFF_REFRESH", "") not in ("", "0", "false", "False")
+# Refetch everything on every N-th run, for changes that don't touch the
+# record's own write_date (a renamed customer or brand); 0 = never
+ID_DIFF_FULL_EVERY = int(os.getenv("ID_DIFF_FULL_EVERY", "7"))
+# Ids per detail fetch (they go into the domain as an "in" condition)
+ID_DIFF_CHUNK = int(os.getenv("ID_DIFF_CHUNK", "2000"))
+
+WRITE_DATE_COLUMN = "_write_date"
+
+# Layout: <PIPELINE_STATE_DIR>/id_snapshots/<report>/company<id>.pkl, holding
+# the flattened row of every id of the last run (indexed by id) with its write_date
+
+# Snapshots stay in memory between runs of a long-running process (refresh
+# daemon), keyed by path with the file's mtime so a change on disk is seen
+_loaded = {}
+
+# --------- Snapshots ---------
+def snapshot_path(report, company_id):
+    return state_path("id_snapshots", report.replace("'", "").replace(" ", "_"), f"company{company_id}.pkl")
+
+def load_snapshot(report, company_id):
+    path = snapshot_path(report, company_id)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+        if path in _loaded and _loaded[path][0] == mtime:
+            return _loaded[path][1]
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    _loaded[path] = (mtime, snapshot)
+    return snapshot
+
+def save_snapshot(report, company_id, snapshot):
+    path = snapshot_path(report, company_id)
+    with open(f"{path}.tmp", "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.tmp", path)
+    _loaded[path] = (os.stat(path).st_mtime_ns, snapshot)
+
+def _spec_key(specification):
+    return hashlib.sha1(json.dumps(specification, sort_keys=True).encode("utf-8")).hexdigest()
+
+def _rows(records, flatten, columns):
+    rows = pd.DataFrame([flatten(r) for r in records], columns=columns)
+    rows[WRITE_DATE_COLUMN] = [r.get("write_date") for r in records]
+    rows.index = pd.Index([r["id"] for r in records])
+    # Offset paging can return a record twice when records change between pages
+    return rows[~rows.index.duplicated()]
+
+# --------- Diff Refresh ---------
+def diff_fetch(fetch, report, company_id, label, specification, flatten, columns, full=False):
+    """
+    Flattened rows (one per record, in `columns`) of a dataset that describes
+    a current state, fetching only what changed since the last run.
+
+    `fetch(extra_domain=..., specification=..., label=...)` returns the
+    records of the report's domain plus `extra_domain`; `flatten(record)`
+    gives a record's row. The rows come back in the order Odoo returns the
+    ids, like a full fetch would.
+
+    The first run, a run whose fields changed, every ID_DIFF_FULL_EVERY-th
+    run and `full` fetch every record.
+    """
+    specification = {**specification, "write_date": {}}
+    snapshot = None if full else load_snapshot(report, company_id)
+    reason = None
+    if full:
+        reason = "requested"
+    elif snapshot is None:
+        reason = "no snapshot yet"
+    elif snapshot["specification"] != _spec_key(specification) or snapshot["columns"] != columns:
+        reason = "fields changed"
+    elif ID_DIFF_FULL_EVERY and snapshot["runs"] >= ID_DIFF_FULL_EVERY:
+        reason = f"every {ID_DIFF_FULL_EVERY} runs"
+
+    if reason is not None:
+        print(f"🔄 [Company {company_id}] {label}: full refresh ({reason})")
+        records = fetch(extra_domain=[], specification=specification, label=label)
+        with profile_stage("flatten", company_id):
+            rows = _rows(records, flatten, columns)
+        runs = 1
+    else:
+        current = fetch(extra_domain=[], specification={"write_date": {}}, label=f"{label} ids")
+        write_dates = pd.Series({r["id"]: r.get("write_date") for r in current}, dtype=object)
+        ids = write_dates.index
+        previous = snapshot["rows"]
+        known = previous[WRITE_DATE_COLUMN].reindex(ids)
+        # New ids compare as changed (NaN != anything)
+        fetch_ids = ids[(known != write_dates).to_numpy()]
+        new_count = int(known.isna().sum())
+        departed = previous.index.difference(ids)
+        print(f"🧮 [Company {company_id}] {label}: {len(ids)} ids, {new_count} new, "
+              f"{len(fetch_ids) - new_count} changed, {len(departed)} departed")
+
+        records = []
+        for start in range(0, len(fetch_ids), ID_DIFF_CHUNK):
+            chunk = [int(i) for i in fetch_ids[start:start + ID_DIFF_CHUNK]]
+            records.extend(fetch(extra_domain=[["id", "in", chunk]], specification=specification,
+                                 label=f"{label} changed"))
+        with profile_stage("flatten", company_id):
+            fresh = _rows(records, flatten, columns)
+        kept = previous.drop(index=previous.index.intersection(fetch_ids).union(departed))
+        rows = pd.concat([kept, fresh]) if len(fresh) else kept
+        # Ids that left the domain between the two fetches have no row and are dropped
+        rows = rows.loc[ids.intersection(rows.index, sort=False)]
+        runs = snapshot["runs"] + 1
+
+    save_snapshot(report, company_id, {
+        "specification": _spec_key(specification), "columns": columns, "runs": runs, "rows": rows
+    })
+    return rows[columns].reset_index(drop=True)
@@ -0,0 +1,342 @@
+import os
+import glob
+import json
+import atexit
+import pickle
+import shutil
+import hashlib
+from dotenv import load_dotenv
+from pipeline_state import load_state, state_lock, state_path, update_state
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Set ODOO_QUERY_CACHE=1 to share fetched Odoo results within a run: a query is
+# served from any cached result of the same model and company whose domain it
+# narrows, by filtering the cached records locally
+ODOO_QUERY_CACHE = os.getenv("ODOO_QUERY_CACHE", "") not in ("", "0", "false", "False")
+# Set by run_reports.py so every report of one run shares the cache; a script
+# run on its own only caches within its own process
+ODOO_CACHE_RUN = os.getenv("ODOO_CACHE_RUN") or f"pid{os.getpid()}"
+# Records handed to on_page per call when a query is served from the cache
+ODOO_CACHE_PAGE_SIZE = int(os.getenv("ODOO_CACHE_PAGE_SIZE", "1000"))
+# Reports of the current run, set by run_reports.py (comma-separated)
+ODOO_CACHE_REPORTS = set(filter(None, os.getenv("ODOO_CACHE_REPORTS", "").split(",")))
+
+# Supersets fetched once per run, with the fields of every query they served
+# last time, instead of the narrower queries inside them: (model, domain,
+# reports it feeds). A superset is only used when every report it feeds is
+# part of the run; for one report alone it is far larger than its own query.
+# PI-type sale orders feed both pi_bank (by PI date) and the PI tab of
+# Carter's Journey (by brand group and order date). The two bound different
+# fields, so the superset ORs their lower bounds; the upper bounds are the
+# current time and are applied locally.
+SHARED_QUERIES = [
+    ("sale.order", [
+        ["state", "=", "sale"], ["sales_type", "=", "sale"],
+        "|", ["pi_date", ">=", "2025-08-01"],
+        "&", ["brand_group", "in", [183784, 180989]], ["date_order", ">=", "2025-04-01 00:00:00"]
+    ], {"pi_bank", "Carter's Journey"}),
+]
+
+QUERY_DEMAND_STATE = "query_demand"
+LOCAL_OPERATORS = {"=", "!=", "in", "not in", "<", "<=", ">", ">="}
+
+# Layout: <PIPELINE_STATE_DIR>/query_cache/<run>/<key>.json (model, company,
+# domain, specification) and <key>.pkl (the records)
+
+def cache_dir():
+    return os.path.dirname(state_path("query_cache", ODOO_CACHE_RUN, "x"))
+
+def clear_run(run=None):
+    """Remove a run's cached results"""
+    shutil.rmtree(os.path.dirname(state_path("query_cache", run or ODOO_CACHE_RUN, "x")), ignore_errors=True)
+
+def start_run(run):
+    """Cache the following queries under a new run id (the refresh daemon makes every refresh a run)"""
+    global ODOO_CACHE_RUN
+    ODOO_CACHE_RUN = run
+
+if ODOO_QUERY_CACHE and not os.getenv("ODOO_CACHE_RUN"):
+    atexit.register(clear_run)
+
+# --------- Domain Normalization ---------
+def _freeze(value):
+    return tuple(_freeze(v) for v in value) if isinstance(value, list) else value
+
+def _leaf(term):
+    field, operator, value = term
+    if operator in ("in", "not in") and isinstance(value, (list, tuple)):
+        values = sorted(set(_freeze(v) for v in value), key=repr)
+        # A one-value "in" is the same condition as "="
+        if len(values) == 1:
+            return (field, "=" if operator == "in" else "!=", values[0])
+        return (field, operator, tuple(values))
+    return (field, operator, _freeze(value))
+
+def _parse(domain, i):
+    token = domain[i]
+    if token in ("&", "|"):
+        left, i = _parse(domain, i + 1)
+        right, i = _parse(domain, i)
+        return (token, left, right), i
+    if token == "!":
+        child, i = _parse(domain, i + 1)
+        return ("!", child), i
+    return _leaf(token), i + 1
+
+def _group(node, operator):
+    """The set of conditions joined by `operator` in a parsed tree ("&" or "|" nesting flattened)"""
+    if node[0] == operator and len(node) == 3:
+        return _group(node[1], operator) | _group(node[2], operator)
+    if node[0] in ("&", "|") and len(node) == 3:
+        return frozenset([(node[0], _group(node, node[0]))])
+    return frozenset([node])
+
+def normalize_domain(domain):
+    """
+    The domain as a set of ANDed conditions, so equivalent domains compare
+    equal whatever their order or "&" nesting. A nested OR (or AND inside an
+    OR) is kept as one ("|", {alternatives}) condition.
+    """
+    conditions, i = frozenset(), 0
+    while i < len(domain):
+        node, i = _parse(domain, i)
+        conditions |= _group(node, "&")
+    return conditions
+
+def canonical(condition):
+    """Text form of a condition that is the same in every process (sets sorted)"""
+    if condition[0] in ("&", "|"):
+        return f"{condition[0]}({','.join(sorted(map(canonical, condition[1])))})"
+    if condition[0] == "!":
+        return f"!({canonical(condition[1])})"
+    return repr(condition)
+
+# --------- Specifications ---------
+def spec_contains(big, small):
+    """True when fetching `big` returns every field of `small`, in the same shape"""
+    for name, sub in small.items():
+        if name not in big or bool(sub.get("fields")) != bool(big[name].get("fields")):
+            return False
+        if sub.get("fields") and not spec_contains(big[name]["fields"], sub["fields"]):
+            return False
+    return True
+
+def merge_specs(*specs):
+    merged = {}
+    for spec in specs:
+        for name, sub in spec.items():
+            if sub.get("fields"):
+                node = merged.setdefault(name, {})
+                node["fields"] = merge_specs(node.get("fields", {}), sub["fields"])
+            else:
+                merged.setdefault(name, {})
+    return merged
+
+def _has_path(spec, path):
+    node = spec
+    for part in path.split("."):
+        if part not in node:
+            return False
+        node = node[part].get("fields", {})
+    return True
+
+def _field_spec(path):
+    spec = {}
+    node = spec
+    for part in path.split(".")[:-1]:
+        node = node.setdefault(part, {}).setdefault("fields", {})
+    node[path.split(".")[-1]] = {}
+    return spec
+
+def _condition_fields(condition):
+    if condition[0] in ("&", "|"):
+        return [path for alternative in condition[1] for path in _condition_fields(alternative)]
+    if condition[0] == "!":
+        return _condition_fields(condition[1])
+    return [condition[0]]
+
+# --------- Local Filtering ---------
+class _NotLocal(Exception):
+    """A condition can't be evaluated on the fetched records (to-many path, field not returned)"""
+
+def _local(condition, specification=None):
+    """True when the condition can be checked on fetched records (on fields of `specification`, if given)"""
+    if condition[0] in ("&", "|"):
+        return all(_local(c, specification) for c in condition[1])
+    if condition[0] == "!":
+        return _local(condition[1], specification)
+    return condition[1] in LOCAL_OPERATORS and (specification is None or _has_path(specification, condition[0]))
+
+def _value(record, path):
+    value = record
+    for part in path.split("."):
+        if isinstance(value, dict):
+            if part not in value:
+                raise _NotLocal(path)
+            value = value[part]
+        elif isinstance(value, list):
+            raise _NotLocal(path)
+        else:
+            return False
+    if isinstance(value, list):
+        raise _NotLocal(path)
+    # Many-to-one fields come back as {"id": ..., ...} or as the id
+    return value.get("id", False) if isinstance(value, dict) else value
+
+def _matches(record, condition):
+    if condition[0] == "|":
+        return any(_matches(record, c) for c in condition[1])
+    if condition[0] == "&":
+        return all(_matches(record, c) for c in condition[1])
+    if condition[0] == "!":
+        return not _matches(record, condition[1])
+    field, operator, target = condition
+    value = _value(record, field)
+    # Like Odoo: empty values fail comparisons and pass != / not in
+    empty = value is False or value is None
+    if operator == "=":
+        return (empty and target is False) or (not empty and value == target)
+    if operator == "!=":
+        return not ((empty and target is False) or (not empty and value == target))
+    if operator == "in":
+        return (empty and False in target) or (not empty and value in target)
+    if operator == "not in":
+        return not ((empty and False in target) or (not empty and value in target))
+    if empty:
+        return False
+    if operator == "<":
+        return value < target
+    if operator == "<=":
+        return value <= target
+    if operator == ">":
+        return value > target
+    return value >= target
+
+def filter_records(records, conditions):
+    return [r for r in records if all(_matches(r, c) for c in conditions)]
+
+# --------- Cache Entries ---------
+def _key(model, company_id, conditions, specification):
+    text = json.dumps([model, company_id, sorted(map(canonical, conditions)), specification], sort_keys=True)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+def _entries(model, company_id):
+    for path in glob.glob(os.path.join(cache_dir(), "*.json")):
+        with open(path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["model"] == model and meta["company_id"] == company_id:
+            yield meta, path[:-len(".json")] + ".pkl"
+
+def _implied(condition, conditions):
+    """True when every record matching all of `conditions` matches `condition` (an OR needs one alternative implied)"""
+    if condition in conditions:
+        return True
+    if condition[0] == "|":
+        return any(_implied(c, conditions) for c in condition[1])
+    if condition[0] == "&":
+        return all(_implied(c, conditions) for c in condition[1])
+    return False
+
+def _covers(cached, conditions):
+    """True when a cached domain's records include every record of the query"""
+    return all(_implied(c, conditions) for c in cached)
+
+def _lookup(model, company_id, conditions, specification):
+    """(records, cached record count) answering the query from a cached superset, or None"""
+    for meta, records_path in _entries(model, company_id):
+        cached = normalize_domain(meta["domain"])
+        extra = conditions - cached
+        if not _covers(cached, conditions) or not spec_contains(meta["specification"], specification):
+            continue
+        if not all(_local(c, meta["specification"]) for c in extra):
+            continue
+        with open(records_path, "rb") as f:
+            records = pickle.load(f)
+        try:
+            return filter_records(records, extra), len(records)
+        except _NotLocal:
+            continue
+    return None
+
+def _fetched(model, company_id, domain):
+    """True when a query with this domain (whatever its fields) is cached this run"""
+    conditions = normalize_domain(domain)
+    return any(normalize_domain(meta["domain"]) == conditions for meta, _ in _entries(model, company_id))
+
+def _store(model, company_id, domain, specification, records):
+    key = _key(model, company_id, normalize_domain(domain), specification)
+    path = os.path.join(cache_dir(), key)
+    with open(f"{path}.pkl.tmp", "wb") as f:
+        pickle.dump(records, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.pkl.tmp", f"{path}.pkl")
+    # The metadata goes last: an entry is only visible once its records are complete
+    with open(f"{path}.json.tmp", "w", encoding="utf-8") as f:
+        json.dump({"model": model, "company_id": company_id, "domain": domain, "specification": specification}, f)
+    os.replace(f"{path}.json.tmp", f"{path}.json")
+
+# --------- Query Planning ---------
+def _shared_query(model, conditions, specification, label):
+    """(domain, specification) of the shared superset containing this query, or None"""
+    for shared_model, shared_domain, reports in SHARED_QUERIES:
+        if shared_model != model or not reports <= ODOO_CACHE_REPORTS:
+            continue
+        shared = normalize_domain(shared_domain)
+        if not _covers(shared, conditions) or not all(_local(c) for c in conditions - shared):
+            continue
+        # The fields the query is filtered on count as demand too, so the next superset can filter for it
+        filter_specs = [_field_spec(p) for c in conditions - shared for p in _condition_fields(c)]
+        name = f"{model}:{json.dumps(shared_domain)}"
+        update_state(QUERY_DEMAND_STATE, name, {
+            **load_state(QUERY_DEMAND_STATE).get(name, {}), label: merge_specs(specification, *filter_specs)
+        })
+        # Fields of every query this superset served in earlier runs, so one fetch feeds them all
+        demand = load_state(QUERY_DEMAND_STATE).get(name, {}).values()
+        return shared_domain, merge_specs(specification, *demand, *filter_specs)
+    return None
+
+def _deliver(records, on_page):
+    if on_page is None:
+        return records
+    for start in range(0, len(records), ODOO_CACHE_PAGE_SIZE):
+        page = records[start:start + ODOO_CACHE_PAGE_SIZE]
+        # A PagePool with workers expects the undecoded response body
+        on_page(json.dumps({"result": {"records": page}}).encode("utf-8") if getattr(on_page, "raw", False) else page)
+    return []
+
+def cached_fetch(fetch, model, company_id, domain, specification, label, on_page=None):
+    """
+    Answer a web_search_read from the run's cache, fetching only on a miss.
+
+    `fetch(domain, specification)` returns all records of a query. A query
+    inside one of SHARED_QUERIES, when all of its reports run, fetches the
+    superset instead, with the fields every query it served has asked for,
+    and filters it locally. The fetch of an entry holds a lock, so reports
+    running in parallel wait for the first one instead of fetching the same
+    query twice. A superset is fetched at most once per run and company: a
+    query it came back without the fields of (the first run, when the other
+    reports' fields aren't known yet) fetches only itself.
+    """
+    conditions = normalize_domain(domain)
+    served = _lookup(model, company_id, conditions, specification)
+    if served is None:
+        shared_query = _shared_query(model, conditions, specification, label)
+        fetch_domain, fetch_spec = shared_query or (domain, specification)
+        # A superset's lock doesn't depend on the fields asked for, so every report waits on the same one
+        lock_spec = {} if shared_query else fetch_spec
+        with state_lock(os.path.join("query_cache", ODOO_CACHE_RUN, _key(model, company_id, normalize_domain(fetch_domain), lock_spec))):
+            served = _lookup(model, company_id, conditions, specification)
+            if served is None and shared_query and _fetched(model, company_id, fetch_domain):
+                fetch_domain, fetch_spec = domain, specification
+            if served is None:
+                _store(model, company_id, fetch_domain, fetch_spec, fetch(fetch_domain, fetch_spec))
+                served = _lookup(model, company_id, conditions, specification)
+        if served is None:
+            # The superset came back without a field the rest of the domain needs: fetch the query itself
+            records = fetch(domain, specification)
+            _store(model, company_id, domain, specification, records)
+            served = records, len(records)
+    records, cached_count = served
+    print(f"🗃️ [Company {company_id}] {label}: {len(records)} records from the query cache "
+          f"(filtered from {cached_count})")
+    return _deliver(records, on_page)
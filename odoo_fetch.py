@@ -0,0 +1,373 @@
+import os
+import json
+import time
+import queue
+import threading
+import requests
+from dotenv import load_dotenv
+from pipeline_state import load_state, update_state
+from run_stats import count_fetch, count_hedge
+from stage_profile import profile_stage
+from odoo_cache import ODOO_QUERY_CACHE, cached_fetch
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Bounds and targets for the adaptive page size of web_search_read
+ODOO_PAGE_MIN = int(os.getenv("ODOO_PAGE_MIN", "100"))
+ODOO_PAGE_MAX = int(os.getenv("ODOO_PAGE_MAX", "5000"))
+ODOO_PAGE_TARGET_SECONDS = float(os.getenv("ODOO_PAGE_TARGET_SECONDS", "5"))
+ODOO_PAGE_TARGET_BYTES = int(os.getenv("ODOO_PAGE_TARGET_BYTES", str(4 * 1024 * 1024)))
+# Set ODOO_ADAPTIVE_PAGING=0 to always use the report's fixed batch size
+ODOO_ADAPTIVE_PAGING = os.getenv("ODOO_ADAPTIVE_PAGING", "1") not in ("0", "false", "False")
+# Seconds to wait for a connection and for a response, so a stuck Odoo worker
+# fails the request instead of stalling the run; a timed-out request is
+# retried ODOO_TIMEOUT_RETRIES times
+ODOO_CONNECT_TIMEOUT = float(os.getenv("ODOO_CONNECT_TIMEOUT", "10"))
+ODOO_READ_TIMEOUT = float(os.getenv("ODOO_READ_TIMEOUT", "300"))
+ODOO_TIMEOUT = (ODOO_CONNECT_TIMEOUT, ODOO_READ_TIMEOUT)
+ODOO_TIMEOUT_RETRIES = int(os.getenv("ODOO_TIMEOUT_RETRIES", "1"))
+# Set ODOO_HEDGE=1 to send a duplicate page request once a page has taken longer
+# than this percentile of the page latencies seen so far, keeping whichever
+# answer arrives first. No hedging until ODOO_HEDGE_MIN_SAMPLES pages were seen.
+ODOO_HEDGE = os.getenv("ODOO_HEDGE", "") not in ("", "0", "false", "False")
+ODOO_HEDGE_PERCENTILE = float(os.getenv("ODOO_HEDGE_PERCENTILE", "95"))
+ODOO_HEDGE_MIN_SAMPLES = int(os.getenv("ODOO_HEDGE_MIN_SAMPLES", "5"))
+# Never hedge a page sooner than this, so ordinary jitter on fast pages doesn't double the load
+ODOO_HEDGE_MIN_SECONDS = float(os.getenv("ODOO_HEDGE_MIN_SECONDS", "2"))
+
+PAGE_STATE = "page_sizes"
+# Per-record page latencies kept per pager for the hedging percentile
+LATENCY_SAMPLES = 50
+
+# --------- Request Context ---------
+def odoo_context(uid, company_id):
+    return {
+        "lang": "en_US",
+        "tz": "Asia/Dhaka",
+        "uid": uid,
+        "allowed_company_ids": [company_id],
+        "bin_size": True,
+        "current_company_id": company_id
+    }
+
+# --------- Login Reuse ---------
+_reuse_logins = False
+_logins = {}
+
+def reuse_logins():
+    """Keep each report's Odoo uid (and the session cookie behind it) for the rest of the process"""
+    global _reuse_logins
+    _reuse_logins = True
+
+def login_uid(login):
+    """The uid from the report's login(); after reuse_logins() only the first call authenticates"""
+    if not _reuse_logins:
+        return login()
+    if login not in _logins:
+        _logins[login] = login()
+    return _logins[login]
+
+def forget_logins():
+    """Authenticate again on the next login_uid (a failed run may mean the session expired)"""
+    _logins.clear()
+
+# --------- Adaptive Page Size ---------
+class AdaptivePager:
+    """
+    Pick the `limit` of the next web_search_read page from the pages seen so far.
+
+    Each page's latency and response size are turned into per-record costs
+    (smoothed across pages), and the next limit is the record count that would
+    hit both the latency and the size target. A page can at most double or
+    halve the limit, and the limit always stays within [min_limit, max_limit].
+    The settled limit is stored per key so the next run starts from it.
+    """
+
+    SMOOTHING = 0.5
+
+    def __init__(self, key, initial_limit, min_limit=None, max_limit=None,
+                 target_seconds=None, target_bytes=None, adaptive=None):
+        self.key = key
+        self.min_limit = min_limit or ODOO_PAGE_MIN
+        self.max_limit = max_limit or ODOO_PAGE_MAX
+        self.target_seconds = target_seconds or ODOO_PAGE_TARGET_SECONDS
+        self.target_bytes = target_bytes or ODOO_PAGE_TARGET_BYTES
+        self.adaptive = ODOO_ADAPTIVE_PAGING if adaptive is None else adaptive
+
+        saved = load_state(PAGE_STATE).get(key, {}) if self.adaptive else {}
+        self.seconds_per_record = saved.get("seconds_per_record")
+        self.bytes_per_record = saved.get("bytes_per_record")
+        self.limit = self._clamp(saved.get("limit", initial_limit)) if self.adaptive else initial_limit
+        self.pages = 0
+        # Kept even when adaptive paging is off: hedging uses them
+        self.latency_samples = load_state(PAGE_STATE).get(key, {}).get("latency_samples", [])
+
+    def _clamp(self, limit):
+        return max(self.min_limit, min(self.max_limit, int(limit)))
+
+    def _smooth(self, previous, current):
+        if previous is None:
+            return current
+        return self.SMOOTHING * current + (1 - self.SMOOTHING) * previous
+
+    def observe(self, record_count, seconds, response_bytes):
+        """Record one page and return the limit to use for the next page"""
+        self.pages += 1
+        if record_count:
+            self.latency_samples = (self.latency_samples + [seconds / record_count])[-LATENCY_SAMPLES:]
+        if not self.adaptive or record_count == 0:
+            return self.limit
+
+        self.seconds_per_record = self._smooth(self.seconds_per_record, seconds / record_count)
+        self.bytes_per_record = self._smooth(self.bytes_per_record, response_bytes / record_count)
+
+        ideal = min(
+            self.target_seconds / max(self.seconds_per_record, 1e-9),
+            self.target_bytes / max(self.bytes_per_record, 1e-9)
+        )
+        # Move toward the ideal gradually so one slow page can't swing the size wildly
+        ideal = max(self.limit / 2, min(self.limit * 2, ideal))
+        self.limit = self._clamp(ideal)
+        return self.limit
+
+    def hedge_after(self, limit):
+        """
+        Seconds after which a page of `limit` records gets a duplicate request:
+        the ODOO_HEDGE_PERCENTILE of the per-record latencies seen, times the
+        limit (at least ODOO_HEDGE_MIN_SECONDS). None when hedging is off or
+        too few pages were seen.
+        """
+        if not ODOO_HEDGE or len(self.latency_samples) < ODOO_HEDGE_MIN_SAMPLES:
+            return None
+        samples = sorted(self.latency_samples)
+        index = min(len(samples) - 1, int(len(samples) * ODOO_HEDGE_PERCENTILE / 100))
+        return max(samples[index] * limit, ODOO_HEDGE_MIN_SECONDS)
+
+    def save(self):
+        if self.pages == 0:
+            return
+        saved = {**load_state(PAGE_STATE).get(self.key, {}), "latency_samples": self.latency_samples}
+        if self.adaptive:
+            saved.update(
+                limit=self.limit,
+                seconds_per_record=self.seconds_per_record,
+                bytes_per_record=self.bytes_per_record
+            )
+        update_state(PAGE_STATE, self.key, saved)
+
+# --------- Timeouts and Hedged Requests ---------
+_idle_sessions = {}
+_sessions_lock = threading.Lock()
+
+def odoo_post(session, url, data, hedged=None):
+    """
+    POST to Odoo with ODOO_TIMEOUT, retrying a timed-out request
+    ODOO_TIMEOUT_RETRIES times; not once `hedged` (an Event) is set, since
+    the duplicate request already stands in for the retry.
+    """
+    for attempt in range(ODOO_TIMEOUT_RETRIES + 1):
+        try:
+            resp = session.post(url, data=data, timeout=ODOO_TIMEOUT)
+            resp.raise_for_status()
+            return resp
+        except requests.Timeout:
+            if attempt == ODOO_TIMEOUT_RETRIES or (hedged is not None and hedged.is_set()):
+                raise
+            print(f"⏳ Odoo request timed out, retrying ({attempt + 1}/{ODOO_TIMEOUT_RETRIES})")
+
+def _borrow_session(session):
+    """An idle Session logged in as `session` (same headers and cookies), or a new one"""
+    with _sessions_lock:
+        idle = _idle_sessions.setdefault(id(session), [])
+        borrowed = idle.pop() if idle else requests.Session()
+    borrowed.headers.update(session.headers)
+    borrowed.cookies.update(session.cookies)
+    return borrowed
+
+def _attempt(name, session, url, data, hedged, answers):
+    """One request of a hedged page, on its own Session; (name, response, error) goes to `answers`"""
+    borrowed = None
+    try:
+        borrowed = _borrow_session(session)
+        answers.put((name, odoo_post(borrowed, url, data, hedged), None))
+    except Exception as exc:
+        answers.put((name, None, exc))
+    finally:
+        # An abandoned attempt keeps its Session until it finishes, so no two requests share one
+        if borrowed is not None:
+            with _sessions_lock:
+                _idle_sessions[id(session)].append(borrowed)
+
+def hedged_post(session, url, data, hedge_after):
+    """
+    odoo_post, plus a duplicate request once the first has taken `hedge_after`
+    seconds; the first successful answer wins. Both requests run on daemon
+    threads, each on a Session of its own, so the slower one is simply
+    abandoned: it can't delay the next page or the end of the process, and
+    its timeouts are no longer retried. Without `hedge_after` this is
+    odoo_post on `session`.
+    """
+    if hedge_after is None:
+        return odoo_post(session, url, data)
+    answers, hedged = queue.Queue(), threading.Event()
+
+    def start(name):
+        threading.Thread(target=_attempt, args=(name, session, url, data, hedged, answers),
+                         name=f"odoo-{name}", daemon=True).start()
+
+    start("primary")
+    try:
+        _, resp, error = answers.get(timeout=hedge_after)
+    except queue.Empty:
+        print(f"⚡ Page still pending after {hedge_after:.1f}s (p{ODOO_HEDGE_PERCENTILE:g}), sending a duplicate request")
+        hedged.set()
+        start("duplicate")
+        error = None
+        for _ in range(2):
+            name, resp, failure = answers.get()
+            if failure is None:
+                count_hedge(won=name == "duplicate")
+                return resp
+            error = error or failure
+    if error is not None:
+        raise error
+    return resp
+
+# --------- Record Count ---------
+def search_count(session, odoo_url, uid, company_id, model, domain):
+    """Number of records matching `domain` (not capped by count_limit)"""
+    payload = {
+        "jsonrpc": "2.0",
+        "method": "call",
+        "params": {
+            "model": model,
+            "method": "search_count",
+            "args": [domain],
+            "kwargs": {"context": odoo_context(uid, company_id)}
+        },
+        "id": 3
+    }
+    resp = odoo_post(session, f"{odoo_url}/web/dataset/call_kw/{model}/search_count", json.dumps(payload))
+    return resp.json()['result']
+
+# --------- Paged web_search_read ---------
+def fetch_all_pages(session, odoo_url, uid, company_id, model, domain, specification,
+                    label, batch_size=1000, on_page=None):
+    """
+    Fetch every record matching `domain`, sizing each page with an AdaptivePager.
+
+    Returns the list of records. When `on_page` is given, each page's records
+    are handed to it as soon as they are decoded and are not kept, so callers
+    can flatten page by page; the returned list is then empty.
+
+    If `on_page.raw` is set (see page_pool.PagePool), pages are passed as the
+    undecoded response body so decoding can happen elsewhere; on_page then
+    returns a future whose result starts with the page's record count.
+
+    With ODOO_QUERY_CACHE=1 the query goes through the run's query cache (see
+    odoo_cache.py); pages are then decoded here and handed on once complete.
+    """
+    if ODOO_QUERY_CACHE:
+        def fetch(fetch_domain, fetch_specification):
+            return _fetch_pages(session, odoo_url, uid, company_id, model, fetch_domain, fetch_specification,
+                                label, batch_size)
+        return cached_fetch(fetch, model, company_id, domain, specification, label, on_page)
+    return _fetch_pages(session, odoo_url, uid, company_id, model, domain, specification, label, batch_size, on_page)
+
+def _fetch_pages(session, odoo_url, uid, company_id, model, domain, specification,
+                 label, batch_size=1000, on_page=None):
+    pager = AdaptivePager(f"{model}:{label}", batch_size)
+    all_records, total = [], 0
+
+    def post_page(offset, limit):
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "call",
+            "params": {
+                "model": model,
+                "method": "web_search_read",
+                "args": [],
+                "kwargs": {
+                    "domain": domain,
+                    "specification": specification,
+                    "offset": offset,
+                    "limit": limit,
+                    "context": odoo_context(uid, company_id),
+                    "count_limit": 10001
+                }
+            },
+            "id": 2
+        }
+        with profile_stage("fetch", company_id):
+            return hedged_post(session, f"{odoo_url}/web/dataset/call_kw/{model}/web_search_read",
+                               json.dumps(payload), pager.hedge_after(limit))
+
+    def record_page(record_count, limit, elapsed, response_bytes):
+        """Count and log a page; False when it was the last one"""
+        nonlocal total
+        total += record_count
+        count_fetch(record_count, response_bytes, elapsed)
+        print(f"[Company {company_id}] {label}: Fetched {record_count} records "
+              f"(limit {limit}, {elapsed:.1f}s, {response_bytes / 1024:.0f} KiB), total so far: {total}")
+        # Only full pages are observed: a short last page is dominated by fixed overhead
+        if record_count < limit:
+            return False
+        pager.observe(record_count, elapsed, response_bytes)
+        return True
+
+    if getattr(on_page, "raw", False):
+        _fetch_raw_pages(session, odoo_url, uid, company_id, model, domain, pager, post_page, record_page, on_page)
+    else:
+        offset = 0
+        while True:
+            limit = pager.limit
+            started = time.monotonic()
+            resp = post_page(offset, limit)
+            with profile_stage("decode", company_id):
+                records = resp.json()['result']['records']
+            elapsed = time.monotonic() - started
+            if on_page is None:
+                all_records.extend(records)
+            else:
+                with profile_stage("flatten", company_id):
+                    on_page(records)
+            if not record_page(len(records), limit, elapsed, len(resp.content)):
+                break
+            offset += limit
+
+    pager.save()
+    print(f"✅ Company {company_id} {label} total records fetched: {total}")
+    return all_records
+
+def _fetch_raw_pages(session, odoo_url, uid, company_id, model, domain, pager, post_page, record_page, on_page):
+    """
+    Page loop for a PagePool with workers: each body goes to a worker undecoded
+    and its record count comes back with the worker's result. The next page is
+    requested while the worker decodes the previous one, and is only handed on
+    once that page proved full; a short page ends the fetch. The search_count
+    made first only saves the request past the end when the set didn't change.
+    """
+    expected = search_count(session, odoo_url, uid, company_id, model, domain)
+    offset, previous = 0, None
+    while True:
+        resp = None
+        # The first page is always requested, even when search_count found nothing
+        if offset < expected or offset == 0:
+            limit = pager.limit
+            started = time.monotonic()
+            resp = post_page(offset, limit)
+            elapsed = time.monotonic() - started
+        if previous is not None:
+            previous_limit, previous_elapsed, previous_bytes, counted = previous
+            with profile_stage("flatten", company_id):
+                record_count = counted.result()[0]
+            if not record_page(record_count, previous_limit, previous_elapsed, previous_bytes):
+                # A page requested past a short one is past the end: dropped
+                break
+            if resp is None:
+                # The last page search_count promised was full: records were added since
+                expected, previous = float("inf"), None
+                continue
+        with profile_stage("flatten", company_id):
+            previous = (limit, elapsed, len(resp.content), on_page(resp.content))
+        offset += limit
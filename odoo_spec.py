@@ -0,0 +1,125 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Set ODOO_SPEC_REPORT=1 to print the specification fields the flatteners never read
+ODOO_SPEC_REPORT = os.getenv("ODOO_SPEC_REPORT", "") not in ("", "0", "false", "False")
+SPEC_REPORT_SAMPLE_SIZE = int(os.getenv("ODOO_SPEC_REPORT_SAMPLE", "50"))
+
+_reported = set()
+
+# --------- Build Specification From Published Columns ---------
+def build_specification(column_fields, columns=None):
+    """
+    Build a web_search_read specification from the Odoo fields behind each column.
+
+    column_fields maps a published column to the dotted field paths it is built
+    from, e.g. "Brand Group" -> ["order_line.order_id.buyer_name.brand.display_name"].
+    Only the columns listed in `columns` (default: all of them) are requested.
+    """
+    if columns is None:
+        columns = list(column_fields)
+
+    specification = {}
+    for column in columns:
+        for path in column_fields.get(column, []):
+            parts = path.split(".")
+            node = specification
+            for part in parts[:-1]:
+                node = node.setdefault(part, {}).setdefault("fields", {})
+            node.setdefault(parts[-1], {})
+    return specification
+
+def specification_paths(specification, prefix=""):
+    """List the leaf field paths of a specification as dotted strings"""
+    paths = []
+    for name, sub in specification.items():
+        path = f"{prefix}{name}"
+        nested = sub.get("fields") if isinstance(sub, dict) else None
+        if nested:
+            paths.extend(specification_paths(nested, f"{path}."))
+        else:
+            paths.append(path)
+    return paths
+
+# --------- Field Usage Tracking ---------
+class _TrackedDict(dict):
+    """dict that records which keys a flattener reads"""
+
+    def __init__(self, data, path, seen, seen_empty):
+        super().__init__()
+        self._path = path
+        self._seen = seen
+        self._seen_empty = seen_empty
+        for key, value in data.items():
+            super().__setitem__(key, _track(value, self._key_path(key), seen, seen_empty))
+
+    def _key_path(self, key):
+        return f"{self._path}.{key}" if self._path else key
+
+    def _mark(self, key):
+        path = self._key_path(key)
+        self._seen.add(path)
+        # An empty relation (False/None) means its sub-fields could not have been read
+        if key in self and not super().__getitem__(key):
+            self._seen_empty.add(path)
+
+    def __getitem__(self, key):
+        self._mark(key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self._mark(key)
+        return super().get(key, default)
+
+    def values(self):
+        for key in self:
+            self._mark(key)
+        return super().values()
+
+    def items(self):
+        for key in self:
+            self._mark(key)
+        return super().items()
+
+def _track(value, path, seen, seen_empty):
+    if isinstance(value, dict):
+        return _TrackedDict(value, path, seen, seen_empty)
+    if isinstance(value, list):
+        return [_track(v, path, seen, seen_empty) for v in value]
+    return value
+
+def find_unused_fields(specification, records, flatten):
+    """
+    Run `flatten` over `records` and return the specification paths it never read.
+
+    A path also counts as read when one of its parent relations was read but empty
+    in every sampled record, since its sub-fields could not have been reached.
+    """
+    seen, seen_empty = set(), set()
+    for rec in records:
+        flatten(_track(rec, "", seen, seen_empty))
+
+    unused = []
+    for path in specification_paths(specification):
+        if path in seen:
+            continue
+        parts = path.split(".")
+        if any(".".join(parts[:i]) in seen_empty for i in range(1, len(parts))):
+            continue
+        unused.append(path)
+    return unused
+
+def report_unused_fields(report_name, specification, records, flatten):
+    """Print fields that are fetched but never published (enabled by ODOO_SPEC_REPORT)"""
+    if not ODOO_SPEC_REPORT or not records or report_name in _reported:
+        return []
+    # Reports are run per page, so only the first page of each report is sampled
+    _reported.add(report_name)
+    unused = find_unused_fields(specification, records[:SPEC_REPORT_SAMPLE_SIZE], flatten)
+    if unused:
+        print(f"⚠️ [{report_name}] Specification fields never read by the flattener: {', '.join(unused)}")
+    else:
+        print(f"✅ [{report_name}] Every specification field is read by the flattener")
+    return unused
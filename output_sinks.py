@@ -0,0 +1,111 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from history_store import to_columnar
+from report_db import load_table
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Which sinks each report writes to, e.g.
+#   OUTPUT_SINKS="default=sheets;Dispatch=sheets-summary,parquet;Carter's Journey=sheets-summary,parquet"
+# Sinks: sheets, sheets-summary (the report's summary frame only), parquet, csv, sqlite
+OUTPUT_SINKS = os.getenv("OUTPUT_SINKS", "")
+# Folder for the Parquet and CSV sinks: <OUTPUT_DIR>/<report>/<tab>.parquet|.csv
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "output")
+
+def _safe_name(name):
+    return re.sub(r"[^0-9A-Za-z]+", "_", name).strip("_").lower()
+
+# --------- Sinks ---------
+# Each sink takes the report name and a list of (tab, df) and writes every tab.
+
+class SheetsSink:
+    """Google Sheets through the report's own publish function (its layout, hashing and timestamp)"""
+
+    def __init__(self, publish, summarize=None):
+        self.publish = publish
+        self.summarize = summarize
+        self.name = "sheets-summary" if summarize else "sheets"
+
+    def write(self, report, tabs):
+        if self.summarize:
+            tabs = [(tab, self.summarize(df)) for tab, df in tabs]
+        self.publish(tabs)
+
+class FileSink:
+    """One local file per tab, written to a temporary name and renamed"""
+
+    def __init__(self, kind, folder=None):
+        self.name = kind
+        self.folder = folder or OUTPUT_DIR
+
+    def write(self, report, tabs):
+        folder = os.path.join(self.folder, _safe_name(report))
+        os.makedirs(folder, exist_ok=True)
+        for tab, df in tabs:
+            path = os.path.join(folder, f"{_safe_name(tab)}.{self.name}")
+            tmp_path = f"{path}.tmp"
+            if self.name == "parquet":
+                to_columnar(df).to_parquet(tmp_path, index=False)
+            else:
+                df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+            print(f"💾 Wrote {len(df)} rows to {path}")
+
+class SqliteSink:
+    """One table per tab in the local report database (see report_db.py)"""
+
+    name = "sqlite"
+
+    def write(self, report, tabs):
+        for tab, df in tabs:
+            load_table(f"{_safe_name(report)}__{_safe_name(tab)}", df)
+
+# --------- Per-Report Selection ---------
+def configured_sinks(report):
+    """Sink names configured for `report` in OUTPUT_SINKS (falls back to default=, then sheets)"""
+    config = {}
+    for entry in filter(None, (part.strip() for part in OUTPUT_SINKS.split(";"))):
+        name, _, sinks = entry.partition("=")
+        config[name.strip()] = [sink.strip() for sink in sinks.split(",") if sink.strip()]
+    return config.get(report) or config.get("default") or ["sheets"]
+
+def build_sinks(report, publish, summarize=None):
+    """Create the configured sinks; `publish(tabs)` is the report's Sheets upload"""
+    sinks = []
+    for name in configured_sinks(report):
+        if name == "sheets":
+            sinks.append(SheetsSink(publish))
+        elif name == "sheets-summary":
+            if summarize is None:
+                raise ValueError(f"{report} has no summary frame for the sheets-summary sink")
+            sinks.append(SheetsSink(publish, summarize))
+        elif name in ("parquet", "csv"):
+            sinks.append(FileSink(name))
+        elif name == "sqlite":
+            sinks.append(SqliteSink())
+        else:
+            raise ValueError(f"Unknown output sink for {report}: {name}")
+    return sinks
+
+def write_outputs(report, tabs, publish, summarize=None):
+    """
+    Write the report's tabs to every configured sink at once.
+
+    Sinks run in parallel threads (uploads wait on the network, Parquet
+    encoding releases the GIL). Every sink is attempted; the first failure is
+    raised after the others finished, so the run still fails and the staged
+    frames stay for --resume-upload.
+    """
+    sinks = build_sinks(report, publish, summarize)
+    if len(sinks) == 1:
+        sinks[0].write(report, tabs)
+        return
+    with ThreadPoolExecutor(max_workers=len(sinks)) as executor:
+        futures = [(sink, executor.submit(sink.write, report, tabs)) for sink in sinks]
+    errors = [(sink, future.exception()) for sink, future in futures if future.exception()]
+    for sink, error in errors:
+        print(f"❌ {report} {sink.name} sink failed: {error}")
+    if errors:
+        raise errors[0][1]
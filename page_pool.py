@@ -0,0 +1,112 @@
+import os
+import json
+import importlib.util
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Number of worker processes that decode, flatten and aggregate fetched pages.
+# 0 or 1 keeps everything in the main process.
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", "0"))
+
+# --------- Handler References ---------
+def _handler_ref(handler):
+    """
+    (script path, function name, args, keywords) naming a handler or a
+    functools.partial of one. Workers load the handler from its file: the
+    report scripts aren't importable by name (and the refresh daemon loads
+    them under names of its own).
+    """
+    func, args, keywords = (handler.func, handler.args, handler.keywords) if isinstance(handler, partial) else (handler, (), {})
+    return func.__globals__["__file__"], func.__name__, args, keywords
+
+_handler_modules = {}
+
+def _resolve(ref):
+    path, name, args, keywords = ref
+    if path not in _handler_modules:
+        spec = importlib.util.spec_from_file_location(f"_page_handlers{len(_handler_modules)}", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _handler_modules[path] = module
+    return partial(getattr(_handler_modules[path], name), *args, **keywords)
+
+# --------- Worker Side ---------
+def _decode_and_handle(content, ref):
+    """
+    Runs in a worker: decode the raw web_search_read response and hand its
+    records to the handler `ref` names. Returns (record count, handler result).
+    """
+    records = json.loads(content)['result']['records']
+    return len(records), _resolve(ref)(records)
+
+# --------- Page Pool ---------
+class PagePool:
+    """
+    Run a per-page handler either inline or in a pool of worker processes.
+
+    Usage:
+        pool = PagePool()
+        fetch_x(..., on_page=pool.on_page(partial(handler, company_id=1), tag=1))
+        for result in pool.collect(1): ...
+
+    With workers, fetch_all_pages passes the raw response bytes instead of
+    decoded records, so JSON decoding happens in the workers too; on_page then
+    returns a future of (record count, handler result), which tells
+    fetch_all_pages how many records the page really held. Handlers must
+    be module-level functions (or functools.partial of one) so they can be sent
+    to the workers, and should return something small and compact (a
+    PartialAggregate, or column lists from compact_rows.to_columns) rather than
+    a list of dicts. collect(tag) returns the handler results of the pages
+    submitted under `tag`, in page order, so several datasets can be fetched
+    back to back while workers are still busy with earlier pages.
+    """
+
+    def __init__(self, workers=None):
+        self.workers = PAGE_WORKERS if workers is None else workers
+        self.executor = None
+        if self.workers > 1:
+            # Not fork: the process already runs threads (hedged requests, the
+            # refresh daemon's health server), and a forked child can inherit a
+            # lock some thread held at that moment, deadlocking the worker
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        self.results = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def on_page(self, handler, tag=None):
+        """Return an on_page callback for fetch_all_pages that runs `handler` on each page"""
+        results = self.results.setdefault(tag, [])
+        if self.executor is None:
+            def handle(records):
+                results.append(handler(records))
+        else:
+            ref = _handler_ref(handler)
+            def handle(content):
+                future = self.executor.submit(_decode_and_handle, content, ref)
+                results.append(future)
+                return future
+            # Tells fetch_all_pages to pass the undecoded response body
+            handle.raw = True
+        return handle
+
+    def collect(self, tag=None):
+        """Wait for the pages submitted under `tag` and return their handler results"""
+        results = self.results.pop(tag, [])
+        if self.executor is not None:
+            results = [future.result()[1] for future in results]
+        return results
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
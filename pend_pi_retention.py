@@ -0,0 +1,311 @@
+import os
+import sys
+import json
+import base64
+import argparse
+from datetime import datetime, timedelta
+import pytz
+import pandas as pd
+import gspread
+from gspread.utils import ValueRenderOption
+from google.oauth2.service_account import Credentials
+from dotenv import load_dotenv
+from sheets_rate import RateLimitedHTTPClient
+from sheet_publish import frame_requests, publish_batch
+from upload_staging import stage_frame, mark_published, staged_frames
+from run_stats import record_run
+from stage_profile import enable_profiling, profile_stage
+from history_store import list_partitions, partition_dir, read_history, write_partition, remove_partition
+from pipeline_state import load_state, update_state
+from pending_rollups import period_start, prune_rollup
+load_dotenv()
+
+# --------- Config from Environment ---------
+GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
+GOOGLE_SHEET_ID = "1Qc0Y3KjhCZx20zkgfrMfHl4FuvDfS5b1vqkAutrj4KI"
+
+# Days of daily rows kept; older days are rolled into weeks
+PEND_PI_DAILY_DAYS = int(os.getenv("PEND_PI_DAILY_DAYS", "60"))
+# Days of weekly rows kept; older weeks (and days) are rolled into months
+PEND_PI_WEEKLY_DAYS = int(os.getenv("PEND_PI_WEEKLY_DAYS", "180"))
+# Months of monthly rows kept; 0 = keep every month
+PEND_PI_KEEP_MONTHS = int(os.getenv("PEND_PI_KEEP_MONTHS", "0"))
+
+REPORT = "pend_pi_retention"
+# Append-only tabs and the history part holding the same company
+PEND_PI_TABS = {"pend_pi_zip": "company_1", "pend_pi_mt": "company_3"}
+PEND_PI_MEASURES = ["Total", "Subtotal", "Quantity", "Quantity To Invoice"]
+GRAIN_COLUMN = "Grain"
+DAYS_COLUMN = "Days"
+# History partitions compacted into written targets but not yet removed, per part
+REMOVAL_STATE = "pend_pi_retention"
+
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
+
+# --------- Retention Windows ---------
+def _shift(date, days):
+    return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+def retention_period(date, grain):
+    """
+    First day of the period containing `date`. Weeks are cut at month starts
+    (a week running from the 29th to the 4th is two periods), so every weekly
+    row later rolls into exactly one month.
+    """
+    if grain == "weekly":
+        return max(period_start(date, "weekly"), period_start(date, "monthly"))
+    return period_start(date, grain)
+
+def retention_cutoffs(today):
+    """
+    (daily, weekly, monthly) cutoff dates for `today`.
+
+    Rows dated before `daily` are rolled into weeks and before `weekly` into
+    months; monthly rows before `monthly` are dropped (None keeps them all).
+    The cutoffs fall on period starts, so every period is compacted
+    whole in a single run, and they stay clear of the current week and month
+    that update_rollups still rebuilds from daily rows.
+    """
+    daily_days = max(PEND_PI_DAILY_DAYS, 7)
+    weekly_days = max(PEND_PI_WEEKLY_DAYS, daily_days + 7)
+    daily = retention_period(_shift(today, -daily_days), "weekly")
+    weekly = period_start(_shift(today, -weekly_days), "monthly")
+    monthly = None
+    if PEND_PI_KEEP_MONTHS:
+        year, month = divmod(int(today[:4]) * 12 + int(today[5:7]) - 1 - PEND_PI_KEEP_MONTHS, 12)
+        monthly = f"{year:04d}-{month + 1:02d}-01"
+    return daily, weekly, monthly
+
+def date_text(value):
+    """YYYY-MM-DD for a Date cell (text as written, or a serial number if Sheets parsed it)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (datetime(1899, 12, 30) + timedelta(days=value)).strftime("%Y-%m-%d")
+    return str(value)[:10]
+
+def _target_grain(date, grain, cutoffs):
+    daily_cutoff, weekly_cutoff, _ = cutoffs
+    if grain == "monthly" or date < weekly_cutoff:
+        return "monthly"
+    if grain == "weekly" or date < daily_cutoff:
+        return "weekly"
+    return "daily"
+
+# --------- Compaction ---------
+def compact_frame(df, cutoffs):
+    """
+    Roll the rows of a pend_pi frame that fell out of the daily or weekly
+    window into weekly or monthly rows, and drop expired monthly rows.
+
+    Compacted rows have the period start in Date, the grain in Grain (blank
+    for daily rows) and the number of daily snapshots in the period in Days.
+    Their measures are the average daily pending over the period, so they
+    stay comparable with daily rows and Total * Days gives back the summed
+    snapshots. Every other column is a dimension. Returns `df` itself when no
+    row crossed a cutoff since the last compaction.
+    """
+    original, df = df, df.copy()
+    for column in (GRAIN_COLUMN, DAYS_COLUMN):
+        if column not in df.columns:
+            df[column] = ""
+    df["Date"] = df["Date"].map(date_text)
+    grains = df[GRAIN_COLUMN].map(lambda g: g if isinstance(g, str) and g else "daily")
+    targets = pd.Series([_target_grain(d, g, cutoffs) for d, g in zip(df["Date"], grains)], index=df.index)
+    periods = pd.Series([retention_period(d, t) for d, t in zip(df["Date"], targets)], index=df.index)
+
+    expired = (targets == "monthly") & (periods < cutoffs[2]) if cutoffs[2] else pd.Series(False, index=df.index)
+    moving = (targets != grains) & ~expired
+    if not moving.any() and not expired.any():
+        return original
+
+    # Rows already at the grain and period that moving rows land in are merged with them
+    touched = set(zip(targets[moving], periods[moving]))
+    merged = moving | (~expired & pd.Series([key in touched for key in zip(targets, periods)], index=df.index))
+
+    rows = df[merged].copy()
+    rows["_target"], rows["_period"], rows["_grain"] = targets[merged], periods[merged], grains[merged]
+    rows["_days"] = pd.to_numeric(rows[DAYS_COLUMN].where(rows["_grain"] != "daily", 1), errors="coerce").fillna(1)
+    dimensions = [c for c in df.columns if c not in ["Date", GRAIN_COLUMN, DAYS_COLUMN] + PEND_PI_MEASURES]
+    for measure in PEND_PI_MEASURES:
+        rows[measure] = pd.to_numeric(rows[measure], errors="coerce").fillna(0) * rows["_days"]
+
+    # Days of a period = the days of each distinct source (a day, or a compacted week) it absorbs
+    period_days = (
+        rows.drop_duplicates(["_target", "_period", "_grain", "Date"])
+        .groupby(["_target", "_period"])["_days"].sum()
+        .rename(DAYS_COLUMN)
+    )
+    compacted = (
+        rows.groupby(["_target", "_period"] + dimensions, dropna=False, sort=False)[PEND_PI_MEASURES].sum()
+        .reset_index()
+        .merge(period_days.reset_index(), on=["_target", "_period"])
+    )
+    for measure in PEND_PI_MEASURES:
+        compacted[measure] = compacted[measure] / compacted[DAYS_COLUMN]
+    compacted = compacted.rename(columns={"_target": GRAIN_COLUMN, "_period": "Date"})
+    compacted[DAYS_COLUMN] = compacted[DAYS_COLUMN].astype(int)
+
+    kept = df[~merged & ~expired]
+    result = pd.concat([compacted[df.columns], kept], ignore_index=True)
+    return result.sort_values("Date", kind="stable").reset_index(drop=True)
+
+# --------- Sheet Tabs ---------
+def read_tab(worksheet):
+    """The tab as a frame with unformatted values; unnamed columns (older, wider snapshots) get placeholder names"""
+    values = worksheet.get_all_values(value_render_option=ValueRenderOption.unformatted)
+    if not values or "Date" not in values[0]:
+        return None
+    columns = [name or f"_column_{i}" for i, name in enumerate(values[0])]
+    rows = [row for row in values[1:] if any(str(cell).strip() for cell in row)]
+    return pd.DataFrame(rows, columns=columns)
+
+def tab_header(df):
+    """Header to write back, with the placeholder names of unnamed columns left empty"""
+    return ["" if name.startswith("_column_") else name for name in df.columns]
+
+def publish_compacted(spreadsheet, tabs):
+    """Replace every compacted tab in one batchUpdate (resized to the rows kept)"""
+    requests = []
+    for tab, df in tabs:
+        # Blank cells were read as "" and go back empty
+        blanked = df.mask(df == "")
+        requests.extend(frame_requests(spreadsheet.worksheet(tab), blanked, len(df.columns), header=tab_header(df)))
+    publish_batch(spreadsheet, requests)
+
+# --------- Exported History ---------
+def _part_dates(dataset, part, start=None, end=None):
+    return [
+        date for date, folder in list_partitions(dataset, start, end)
+        if os.path.exists(os.path.join(folder, f"{part}.parquet"))
+    ]
+
+def _target_exists(dataset, period, part):
+    return os.path.exists(os.path.join(partition_dir(dataset, period), f"{part}.parquet"))
+
+def compact_history(part, cutoffs, dry_run=False):
+    """
+    Apply the same windows to one company's history (`part`, e.g. company_1).
+
+    Daily pend_pi_grouped partitions before the daily cutoff and weekly ones
+    before the weekly cutoff are compacted into pend_pi_grouped_weekly and
+    pend_pi_grouped_monthly (one partition per period) and then removed.
+    pend_pi_detail partitions before the daily cutoff are removed, as their
+    grouped form is kept. A target partition that already exists (a snapshot
+    stored late, or windows changed since) is merged with its new sources,
+    like rows already compacted in the tab. The sources are recorded in
+    REMOVAL_STATE before the targets are written, so a run interrupted in
+    between only finishes their removal next time instead of merging them twice.
+    """
+    daily_cutoff, weekly_cutoff, monthly_cutoff = cutoffs
+    leftover = load_state(REMOVAL_STATE).get(part, [])
+    if leftover and not dry_run:
+        print(f"🗑️ {part}: removing {len(leftover)} partitions already compacted by an interrupted run")
+        for dataset, date in leftover:
+            remove_partition(dataset, date, part)
+        update_state(REMOVAL_STATE, part, [])
+
+    sources = [("pend_pi_grouped", date) for date in _part_dates("pend_pi_grouped", part, end=_shift(daily_cutoff, -1))]
+    sources += [("pend_pi_grouped_weekly", date) for date in _part_dates("pend_pi_grouped_weekly", part, end=_shift(weekly_cutoff, -1))]
+    expired = [("pend_pi_grouped_monthly", date) for date in _part_dates("pend_pi_grouped_monthly", part, end=_shift(monthly_cutoff, -1))] if monthly_cutoff else []
+    details = [("pend_pi_detail", date) for date in _part_dates("pend_pi_detail", part, end=_shift(daily_cutoff, -1))]
+    print(f"🗄️ {part}: {len(sources)} history partitions to compact, {len(details)} detail and {len(expired)} monthly partitions to remove")
+    if dry_run:
+        return
+
+    if sources:
+        frames = [read_history(dataset, start=date, end=date, parts=[part]) for dataset, date in sources]
+        compacted = compact_frame(pd.concat(frames, ignore_index=True), cutoffs)
+        # Targets already written are read back and compacted again with the sources, which merges
+        # their rows with the new ones (weighted by Days)
+        existing = [
+            (f"pend_pi_grouped_{grain}", period)
+            for grain, period in compacted[[GRAIN_COLUMN, "Date"]].drop_duplicates().itertuples(index=False)
+            if grain in ("weekly", "monthly") and _target_exists(f"pend_pi_grouped_{grain}", period, part)
+        ]
+        if existing:
+            print(f"🔀 {part}: merging into {len(existing)} existing compacted partitions")
+            frames += [read_history(dataset, start=date, end=date, parts=[part]) for dataset, date in existing]
+            compacted = compact_frame(pd.concat(frames, ignore_index=True), cutoffs)
+        update_state(REMOVAL_STATE, part, [list(source) for source in sources])
+        for (grain, period), rows in compacted.groupby([GRAIN_COLUMN, "Date"], sort=True):
+            # Days comes back as float when merged with targets read from Parquet
+            rows = rows.astype({DAYS_COLUMN: int}).reset_index(drop=True)
+            write_partition(f"pend_pi_grouped_{grain}", period, rows, part=part)
+    # Sources go only after every target is written
+    for dataset, date in sources + details + expired:
+        remove_partition(dataset, date, part)
+    update_state(REMOVAL_STATE, part, [])
+
+# --------- Main ---------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Roll old pend_pi rows into weekly and monthly rows, in the sheet and the history")
+    parser.add_argument("--plan", action="store_true", help="Only show what would be compacted (writes nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish compacted tabs staged by a run whose upload failed")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling(REPORT)
+
+    spreadsheet = gc.open_by_key(GOOGLE_SHEET_ID)
+    if args.resume_upload:
+        staged = staged_frames(REPORT)
+        if staged:
+            publish_compacted(spreadsheet, staged)
+        for tab, _ in staged:
+            mark_published(REPORT, tab)
+        sys.exit(0)
+
+    today = datetime.now(pytz.timezone("Asia/Dhaka")).strftime("%Y-%m-%d")
+    cutoffs = retention_cutoffs(today)
+    print(f"📅 Daily rows from {cutoffs[0]}, weekly rows from {cutoffs[1]}, "
+          f"monthly rows {'from ' + cutoffs[2] if cutoffs[2] else 'kept'}")
+
+    # Runs after pend_pi (see run_reports.py), so nothing appends to the tabs meanwhile
+    compacted_tabs = []
+    for tab in PEND_PI_TABS:
+        df = read_tab(spreadsheet.worksheet(tab))
+        if df is None:
+            print(f"Skip: {tab} has no Date header, nothing to compact.")
+            continue
+        with profile_stage("group"):
+            compacted = compact_frame(df, cutoffs)
+        if compacted is df:
+            print(f"✅ {tab}: nothing to compact ({len(df)} rows)")
+            continue
+        print(f"🧹 {tab}: {len(df)} rows -> {len(compacted)} rows")
+        compacted_tabs.append((tab, compacted))
+
+    if not args.plan:
+        # Staged first so a failed upload can be retried with --resume-upload
+        for tab, df in compacted_tabs:
+            stage_frame(REPORT, tab, df)
+        if compacted_tabs:
+            with profile_stage("upload"):
+                publish_compacted(spreadsheet, compacted_tabs)
+        for tab, _ in compacted_tabs:
+            mark_published(REPORT, tab)
+
+    for part in PEND_PI_TABS.values():
+        compact_history(part, cutoffs, dry_run=args.plan)
+    if not args.plan:
+        # The current week and month are rebuilt from daily rollup rows, which start after the weekly cutoff
+        prune_rollup("daily", cutoffs[1])
+        prune_rollup("weekly", cutoffs[1])
+        if cutoffs[2]:
+            prune_rollup("monthly", cutoffs[2])
+        record_run(REPORT, sum(len(df) for _, df in compacted_tabs), sum(df.size for _, df in compacted_tabs))
+
+    print("\n✅ Pending PI retention finished.")
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import os
+import sys
 import json
+import argparse
 import base64
 import requests
 import pandas as pd
@@ -9,6 +11,20 @@ from gspread_dataframe import set_with_dataframe
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
+from odoo_fetch import fetch_all_pages, odoo_post, login_uid
+from sheets_rate import RateLimitedHTTPClient
+from cost_plan import plan_dataset, print_plan
+from run_stats import record_run
+from sheet_publish import fit_worksheet, col_num_to_letter, upload_frame
+from upload_staging import stage_frame, mark_published, staged_frames
+from report_db import load_table
+from output_sinks import write_outputs
+from stage_profile import enable_profiling, profile_stage
+from odoo_spec import build_specification, report_unused_fields
+from compact_rows import EncodedRows, new_row_store, to_columns
+from page_pool import PagePool
+from history_store import write_partition
+from pending_rollups import update_rollups
 load_dotenv()
 # --------- Config from Environment ---------
 ODOO_URL = os.getenv("ODOO_URL")
@@ -18,13 +34,16 @@ ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
 GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1Qc0Y3KjhCZx20zkgfrMfHl4FuvDfS5b1vqkAutrj4KI"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
 
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
@@ -42,14 +61,31 @@ def odoo_login():
         },
         "id": 1
     }
-    resp = session.post(url, data=json.dumps(payload))
-    resp.raise_for_status()
+    resp = odoo_post(session, url, json.dumps(payload))
     return resp.json()['result']['uid']
 
-# --------- Fetch Regular Sale Orders Data ---------
-def fetch_regular_sale_data(uid, company_id, batch_size=1000):
-    all_records, offset = [], 0
-    domain = [
+# --------- Published Columns ---------
+# Odoo fields (relative to sale.order) behind each column that reaches the sheet.
+# The fetch specification is built from this map, so only published fields are requested.
+REGULAR_SALE_COLUMN_FIELDS = {
+    "Date": [],
+    "FG Category": ["order_line.product_template_id.fg_categ_type.display_name"],
+    # Orders without lines fall back to the order-level customer
+    "Customer": ["order_line.order_partner_id.display_name", "partner_id.display_name"],
+    "Total": ["order_line.price_total"],
+    "Subtotal": ["order_line.price_subtotal"],
+    "Quantity": ["order_line.product_uom_qty"],
+    "Quantity To Invoice": ["order_line.qty_to_invoice"],
+    "Buyer": ["order_line.order_id.buyer_name.display_name"],
+    "Brand Group": ["order_line.order_id.buyer_name.brand.display_name"],
+    "Slider Code (SFG)": ["order_line.slidercodesfg"]
+}
+REGULAR_SALE_GROUP_COLUMNS = ['Date', 'FG Category', 'Customer', 'Buyer', 'Brand Group', 'Slider Code (SFG)']
+REGULAR_SALE_SUM_COLUMNS = ['Total', 'Subtotal', 'Quantity', 'Quantity To Invoice']
+
+# --------- Regular Sale Orders Domain ---------
+def regular_sale_domain(company_id):
+    return [
         "&", "&", "&", "&", "&",
         ["company_id", "=", company_id],
         ["sales_type", "=", "sale"],
@@ -58,69 +94,16 @@ def fetch_regular_sale_data(uid, company_id, batch_size=1000):
         ["pi_type", "=", "regular"],
         ["state", "!=", "cancel"]
     ]
-    
-    specification = {
-        "name": {},
-        "create_date": {},
-        "partner_id": {"fields": {"display_name": {}}},
-        "order_line": {
-            "fields": {
-                "product_template_id": {
-                    "fields": {
-                        "fg_categ_type": {"fields": {"display_name": {}}},
-                        "display_name": {}
-                    }
-                },
-                "order_partner_id": {"fields": {"display_name": {}}},
-                "create_date": {},
-                "order_id": {"fields": {"display_name": {}, "buyer_name": {"fields": {"display_name": {}, "brand": {"fields": {"display_name": {}}}}}, "brand_group": {}}},
-                "price_total": {},
-                "price_subtotal": {},
-                "product_uom_qty": {},
-                "qty_to_invoice": {},
-                "slidercodesfg": {}
-            }
-        }
-    }
 
-    while True:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "sale.order",
-                "method": "web_search_read",
-                "args": [],
-                "kwargs": {
-                    "domain": domain,
-                    "specification": specification,
-                    "offset": offset,
-                    "limit": batch_size,
-                    "context": {
-                        "lang": "en_US",
-                        "tz": "Asia/Dhaka",
-                        "uid": uid,
-                        "allowed_company_ids": [company_id],
-                        "bin_size": True,
-                        "current_company_id": company_id
-                    },
-                    "count_limit": 10001
-                }
-            },
-            "id": 2
-        }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read", data=json.dumps(payload))
-        resp.raise_for_status()
-        result = resp.json()['result']
-        records = result['records']
-        all_records.extend(records)
-        print(f"[Company {company_id}] Regular Sale: Fetched {len(records)} records, total so far: {len(all_records)}")
-        if len(records) < batch_size:
-            break
-        offset += batch_size
+# --------- Fetch Regular Sale Orders Data ---------
+def fetch_regular_sale_data(uid, company_id, batch_size=1000, on_page=None):
+    domain = regular_sale_domain(company_id)
+    specification = build_specification(REGULAR_SALE_COLUMN_FIELDS)
 
-    print(f"✅ Company {company_id} regular sale total records fetched: {len(all_records)}")
-    return all_records
+    return fetch_all_pages(
+        session, ODOO_URL, uid, company_id, "sale.order", domain, specification,
+        "Regular Sale", batch_size, on_page
+    )
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -168,8 +151,6 @@ def flatten_regular_sale_record(rec):
             "Date": current_date,
             "FG Category": "",
             "Customer": safe_get(rec.get("partner_id"), "display_name"),
-            "Created on": rec.get("create_date", ""),
-            "Order Reference": rec.get("name", ""),
             "Total": "",
             "Subtotal": "",
             "Quantity": "",
@@ -187,8 +168,6 @@ def flatten_regular_sale_record(rec):
             "Date": current_date,
             "FG Category": safe_get(fg_categ, "display_name"),
             "Customer": safe_get(line.get("order_partner_id"), "display_name"),
-            "Created on": line.get("create_date", ""),
-            "Order Reference": safe_get(line.get("order_id"), "display_name"),
             "Total": line.get("price_total", ""),
             "Subtotal": line.get("price_subtotal", ""),
             "Quantity": line.get("product_uom_qty", ""),
@@ -200,10 +179,43 @@ def flatten_regular_sale_record(rec):
     
     return flattened_rows
 
+# --------- Flatten a Page of Regular Sale Records ---------
+def flatten_regular_sale_page(records):
+    """Flatten one fetched page into column lists (runs in a page worker when PAGE_WORKERS > 1)"""
+    report_unused_fields(
+        "pend_pi",
+        build_specification(REGULAR_SALE_COLUMN_FIELDS),
+        records,
+        flatten_regular_sale_record
+    )
+    return to_columns(
+        (row for r in records for row in flatten_regular_sale_record(r)),
+        list(REGULAR_SALE_COLUMN_FIELDS),
+        REGULAR_SALE_GROUP_COLUMNS
+    )
+
+# --------- Group Regular Sale Rows ---------
+def group_regular_sale_data(df, flat_records=None):
+    """
+    Group by Date, FG Category, Customer, Buyer, Brand Group, Slider Code (SFG) and sum the amounts.
+    When the rows are dimension-encoded (flat_records is an EncodedRows) they are grouped on the codes.
+    """
+    if df.empty:
+        return df
+    if isinstance(flat_records, EncodedRows):
+        grouped_df = flat_records.group_sum(REGULAR_SALE_GROUP_COLUMNS, REGULAR_SALE_SUM_COLUMNS)
+    else:
+        grouped_df = df.groupby(REGULAR_SALE_GROUP_COLUMNS).agg(
+            {col: 'sum' for col in REGULAR_SALE_SUM_COLUMNS}
+        ).reset_index()
+
+    print(f"📊 Grouped {len(df)} records into {len(grouped_df)} summary rows")
+    return grouped_df
+
 # --------- Upload to Google Sheet ---------
-def paste_to_gsheet(df, sheet_name):
+def paste_to_gsheet(grouped_df, sheet_name):
     worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
-    if df.empty:
+    if grouped_df.empty:
         print(f"Skip: {sheet_name} DataFrame is empty, not pasting.")
         return
 
@@ -211,25 +223,6 @@ def paste_to_gsheet(df, sheet_name):
     local_tz = pytz.timezone("Asia/Dhaka")
     current_date = datetime.now(local_tz).strftime("%Y-%m-%d")
     
-    # Helper function to convert column number to letter (1=A, 27=AA, etc.)
-    def col_num_to_letter(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(65 + (n % 26)) + result
-            n //= 26
-        return result
-    
-    # Group by Date, FG Category, Customer, Buyer, Brand Group, Slider Code (SFG) and aggregate
-    grouped_df = df.groupby(['Date', 'FG Category', 'Customer', 'Buyer', 'Brand Group', 'Slider Code (SFG)']).agg({
-        'Total': 'sum',
-        'Subtotal': 'sum',
-        'Quantity': 'sum',
-        'Quantity To Invoice': 'sum'
-    }).reset_index()
-    
-    print(f"📊 Grouped {len(df)} records into {len(grouped_df)} summary rows")
-    
     # Get all existing data from sheet
     existing_data = worksheet.get_all_values()
     
@@ -255,12 +248,9 @@ def paste_to_gsheet(df, sheet_name):
         worksheet.update(range_name=f"A1:{end_col_letter}1", values=[header])
         start_row = 2
     
-    # Prepare data for writing (convert DataFrame to list of lists)
-    values_to_write = grouped_df.values.tolist()
-    
-    if values_to_write:
+    if not grouped_df.empty:
         # Calculate required rows
-        required_rows = start_row + len(values_to_write)
+        required_rows = start_row + len(grouped_df)
         current_row_count = worksheet.row_count
         
         # Expand sheet if necessary
@@ -269,31 +259,91 @@ def paste_to_gsheet(df, sheet_name):
             worksheet.add_rows(rows_to_add)
             print(f"📊 Added {rows_to_add} rows to sheet. New total: {required_rows}")
         
-        # Calculate the end column letter
-        end_col = col_num_to_letter(len(grouped_df.columns))
-        
         # Write data starting from the calculated row
-        range_to_update = f"A{start_row}:{end_col}{start_row + len(values_to_write) - 1}"
-        worksheet.update(range_name=range_to_update, values=values_to_write)
+        upload_frame(worksheet, grouped_df, start_row)
+        # Drop the empty grid below the appended rows; columns are kept because
+        # older snapshots further up may be wider than today's frame
+        fit_worksheet(worksheet, start_row + len(grouped_df) - 1, worksheet.col_count)
         
         print(f"✅ Data appended to Google Sheet ({sheet_name}) starting at row {start_row}.")
 
+# --------- Sheets Sink ---------
+def publish_tabs(tabs):
+    """Paste each (sheet_name, df) with paste_to_gsheet; the Sheets sink of write_outputs"""
+    for sheet_name, df in tabs:
+        paste_to_gsheet(df, sheet_name)
+
 # --------- Main ---------
-if __name__ == "__main__":
-    uid = odoo_login()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch pending regular sale PIs and append them to Google Sheets")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only estimate this run's Odoo and Sheets cost (runs search_count, uploads nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish frames staged by a run whose upload failed, without fetching from Odoo")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling('pend_pi')
+
+    if args.resume_upload:
+        # History and rollups were already written by the failed run; only the upload is repeated
+        for sheet_tab, df in staged_frames("pend_pi"):
+            write_outputs("pend_pi", [(sheet_tab, df)], publish_tabs)
+            mark_published("pend_pi", sheet_tab)
+        sys.exit(0)
+
+    uid = login_uid(odoo_login)
     
     # Regular Sale data - Company ID mapping to Sheet Tab names
     regular_sale_map = [(1, "pend_pi_zip"), (3, "pend_pi_mt")]
 
+    if args.plan:
+        datasets = [
+            plan_dataset(session, ODOO_URL, uid, company_id, "sale.order", regular_sale_domain(company_id), "Regular Sale", 1000)
+            for company_id, _ in regular_sale_map
+        ]
+        # Per tab: 3 reads (metadata and existing values); header, add rows and data writes
+        sys.exit(1 if print_plan("pend_pi", datasets, len(REGULAR_SALE_COLUMN_FIELDS), len(regular_sale_map), 3, 3,
+                                  gc.open_by_key(GOOGLE_SHEET_ID)) else 0)
+
     # Fetch Regular Sale data
     print("\n========== Fetching Regular Sale Data ==========")
+    pool = PagePool()
+    # Fetch both companies first; pages are flattened as they arrive (each order
+    # line becomes a row, in worker processes when PAGE_WORKERS > 1)
+    for company_id, sheet_tab in regular_sale_map:
+        fetch_regular_sale_data(uid, company_id, on_page=pool.on_page(flatten_regular_sale_page, tag=company_id))
+
+    uploaded_rows, uploaded_cells, detail_frames, grouped_frames = 0, 0, [], []
     for company_id, sheet_tab in regular_sale_map:
-        records = fetch_regular_sale_data(uid, company_id)
-        # Flatten records (each order line becomes a row)
-        flat_records = []
-        for r in records:
-            flat_records.extend(flatten_regular_sale_record(r))
-        df = pd.DataFrame(flat_records)
-        paste_to_gsheet(df, sheet_tab)
+        with profile_stage("group", company_id):
+            flat_records = new_row_store(REGULAR_SALE_COLUMN_FIELDS, REGULAR_SALE_GROUP_COLUMNS)
+            for columns in pool.collect(company_id):
+                flat_records.extend_columns(columns)
+            df = flat_records.to_frame()
+            grouped_df = group_regular_sale_data(df, flat_records)
+
+        # Keep the day's detailed and grouped frames in the local history store
+        snapshot_date = datetime.now(pytz.timezone("Asia/Dhaka")).strftime("%Y-%m-%d")
+        write_partition("pend_pi_detail", snapshot_date, df, part=f"company_{company_id}")
+        write_partition("pend_pi_grouped", snapshot_date, grouped_df, part=f"company_{company_id}")
+        update_rollups(grouped_df, "Zipper" if company_id == 1 else "Metal Trims", snapshot_date)
+        detail_frames.append(df.assign(Company="Zipper" if company_id == 1 else "Metal Trims"))
+        grouped_frames.append(grouped_df.assign(Company="Zipper" if company_id == 1 else "Metal Trims"))
+
+        # Staged first so a failed upload can be retried with --resume-upload
+        stage_frame("pend_pi", sheet_tab, grouped_df)
+        with profile_stage("upload", company_id):
+            write_outputs("pend_pi", [(sheet_tab, grouped_df)], publish_tabs)
+        mark_published("pend_pi", sheet_tab)
+        uploaded_rows, uploaded_cells = uploaded_rows + len(grouped_df), uploaded_cells + grouped_df.size
+    pool.close()
+    load_table("pend_pi_detail", pd.concat(detail_frames, ignore_index=True))
+    load_table("pend_pi", pd.concat(grouped_frames, ignore_index=True))
+    record_run("pend_pi", uploaded_rows, uploaded_cells)
     
     print("\n✅ All regular sale data fetched and uploaded successfully!")
+
+if __name__ == "__main__":
+    main()
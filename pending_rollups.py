@@ -0,0 +1,181 @@
+import os
+import argparse
+import pandas as pd
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from history_store import HISTORY_STORE_DIR, to_columnar
+load_dotenv()
+
+# --------- Rollup Definition ---------
+ROLLUP_DIMENSIONS = ["Company", "FG Category", "Buyer", "Brand Group"]
+ROLLUP_MEASURES = ["Total", "Subtotal", "Quantity", "Quantity To Invoice"]
+ROLLUP_GRAINS = ["daily", "weekly", "monthly"]
+
+# Layout: <HISTORY_STORE_DIR>/rollups/pend_pi_<grain>/<partition>.parquet,
+# partitioned by month (YYYY-MM) for daily and weekly rows and by year (YYYY)
+# for monthly rows, so an update only reads and rewrites the current partitions.
+# Each table has Period (first day of the day/week/month), the dimensions, the
+# summed measures and Days (number of daily snapshots summed into the row).
+# Pending PI is a snapshot, so Total / Days is the average pending over the period.
+
+ROLLUP_COLUMNS = ["Period"] + ROLLUP_DIMENSIONS + ROLLUP_MEASURES + ["Days"]
+
+def rollup_dir(grain):
+    return os.path.join(HISTORY_STORE_DIR, "rollups", f"pend_pi_{grain}")
+
+def partition_key(period, grain):
+    """Partition holding the rows of `period`: YYYY for monthly rows, YYYY-MM otherwise"""
+    return period[:4] if grain == "monthly" else period[:7]
+
+def period_start(date, grain):
+    """First day (YYYY-MM-DD) of the daily/weekly/monthly period containing `date`"""
+    day = datetime.strptime(date, "%Y-%m-%d")
+    if grain == "weekly":
+        day -= timedelta(days=day.weekday())
+    elif grain == "monthly":
+        day = day.replace(day=1)
+    return day.strftime("%Y-%m-%d")
+
+def next_period(period, grain):
+    """First day of the period after `period` (itself a period start)"""
+    day = datetime.strptime(period, "%Y-%m-%d")
+    if grain == "monthly":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1).strftime("%Y-%m-%d")
+    return (day + timedelta(days=7 if grain == "weekly" else 1)).strftime("%Y-%m-%d")
+
+# --------- Storage ---------
+def _empty_rollup():
+    return pd.DataFrame(columns=ROLLUP_COLUMNS)
+
+def rollup_partitions(grain, start=None, end=None):
+    """(key, path) of the partitions that can hold periods within [start, end], oldest first"""
+    folder = rollup_dir(grain)
+    if not os.path.isdir(folder):
+        return []
+    partitions = []
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith(".parquet"):
+            continue
+        key = name[:-len(".parquet")]
+        if (start and key < partition_key(start, grain)) or (end and key > partition_key(end, grain)):
+            continue
+        partitions.append((key, os.path.join(folder, name)))
+    return partitions
+
+def load_rollup(grain, start=None, end=None):
+    """Rows of a rollup, reading only the partitions that can hold periods within [start, end]"""
+    frames = [pd.read_parquet(path) for _, path in rollup_partitions(grain, start, end)]
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else _empty_rollup()
+
+def _save_partition(grain, key, df):
+    path = os.path.join(rollup_dir(grain), f"{key}.parquet")
+    if df.empty:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def _replace_rows(grain, period, company, rows):
+    """Replace the (period, company) rows of a rollup, rewriting only the period's partition"""
+    key = partition_key(period, grain)
+    table = load_rollup(grain, period, period)
+    keep = ~((table["Period"] == period) & (table["Company"] == company))
+    frames = [frame for frame in (table[keep], rows) if not frame.empty]
+    if frames:
+        table = pd.concat(frames, ignore_index=True).sort_values(["Period"] + ROLLUP_DIMENSIONS, kind="stable")
+    else:
+        table = _empty_rollup()
+    _save_partition(grain, key, table)
+
+def prune_rollup(grain, before):
+    """Drop rows of a rollup whose period starts before `before` (see pend_pi_retention.py)"""
+    dropped = 0
+    for key, path in rollup_partitions(grain, end=before):
+        table = pd.read_parquet(path)
+        kept = table[table["Period"] >= before]
+        if len(kept) < len(table):
+            _save_partition(grain, key, kept)
+            dropped += len(table) - len(kept)
+    if dropped:
+        print(f"🧹 Dropped {dropped} {grain} rollup rows before {before}")
+
+# --------- Incremental Update ---------
+def update_rollups(grouped_df, company, date):
+    """
+    Fold one company's daily grouped frame into the daily, weekly and monthly rollups.
+
+    The day's rows replace any earlier rows for the same (date, company), so a
+    rerun on the same day is idempotent. Only the week and month containing
+    `date` are rebuilt, from the daily rows of that week/month, and only the
+    partitions holding them are read and rewritten, so the cost of an update
+    doesn't grow with the length of the history.
+    """
+    if grouped_df.empty:
+        return
+
+    day_rows = to_columnar(grouped_df.assign(Company=company))
+    day_rows = day_rows.groupby(ROLLUP_DIMENSIONS, as_index=False)[ROLLUP_MEASURES].sum()
+    day_rows.insert(0, "Period", period_start(date, "daily"))
+    day_rows["Days"] = 1
+    _replace_rows("daily", day_rows["Period"].iloc[0], company, day_rows)
+
+    for grain in ["weekly", "monthly"]:
+        period = period_start(date, grain)
+        end = next_period(period, grain)
+        # Period strings are ISO dates, so they compare in date order
+        daily = load_rollup("daily", period, end)
+        in_period = daily[(daily["Company"] == company) & (daily["Period"] >= period) & (daily["Period"] < end)]
+        rows = in_period.groupby(ROLLUP_DIMENSIONS, as_index=False)[ROLLUP_MEASURES].sum()
+        rows.insert(0, "Period", period)
+        rows["Days"] = in_period["Period"].nunique()
+        _replace_rows(grain, period, company, rows)
+
+    print(f"📈 Updated pending PI rollups for {company} on {date}")
+
+# --------- Query ---------
+def read_rollup(grain, start=None, end=None, by=None, company=None):
+    """
+    Return a rollup table, optionally filtered by period and company and re-summed
+    over a subset of the dimensions (`by`, e.g. ["Buyer"]). Avg columns give the
+    average daily pending value over each period.
+    """
+    table = load_rollup(grain, start and period_start(start, grain), end)
+    if start:
+        table = table[table["Period"] >= period_start(start, grain)]
+    if end:
+        table = table[table["Period"] <= end]
+    if company:
+        table = table[table["Company"] == company]
+    table = table.copy()
+    # Averages are taken per row first so companies with fewer snapshots aren't diluted
+    for measure in ROLLUP_MEASURES:
+        table[f"Avg {measure}"] = table[measure] / table["Days"]
+    if by is not None:
+        summed = ROLLUP_MEASURES + [f"Avg {m}" for m in ROLLUP_MEASURES]
+        table = table.groupby(["Period"] + list(by), as_index=False).agg(
+            {**{col: "sum" for col in summed}, "Days": "max"}
+        )
+    return table.reset_index(drop=True)
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show pending PI rollups")
+    parser.add_argument("grain", choices=ROLLUP_GRAINS)
+    parser.add_argument("--start", help="First date to include (YYYY-MM-DD)")
+    parser.add_argument("--end", help="Last period start to include (YYYY-MM-DD)")
+    parser.add_argument("--company", help="Company name, e.g. Zipper")
+    parser.add_argument("--by", help="Comma-separated dimensions to keep, e.g. Buyer,Brand Group")
+    args = parser.parse_args()
+
+    result = read_rollup(
+        args.grain,
+        start=args.start,
+        end=args.end,
+        by=args.by.split(",") if args.by else None,
+        company=args.company
+    )
+    print(result.to_string(index=False))
@@ -1,5 +1,7 @@
 import os
+import sys
 import json
+import argparse
 import base64
 import requests
 import pandas as pd
@@ -9,6 +11,18 @@ from gspread_dataframe import set_with_dataframe
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
+from odoo_fetch import fetch_all_pages, odoo_post, login_uid
+from sheets_rate import RateLimitedHTTPClient
+from cost_plan import plan_dataset, print_plan
+from run_stats import record_run
+from upload_staging import stage_frame, mark_published, staged_frames
+from report_db import load_table
+from output_sinks import write_outputs
+from stage_profile import enable_profiling, profile_stage
+from odoo_spec import build_specification, report_unused_fields
+from compact_rows import new_row_store, to_columns
+from page_pool import PagePool
+from sheet_publish import frame_fingerprint, is_unchanged, remember_upload, fit_worksheet, col_num_to_letter, upload_frame
 
 load_dotenv()
 
@@ -20,13 +34,16 @@ ODOO_PASSWORD = os.getenv("ODOO_PASSWORD")
 GOOGLE_CREDENTIALS_BASE64 = os.getenv("GOOGLE_CREDENTIALS_BASE64")
 GOOGLE_SHEET_ID = "1acV7UrmC8ogC54byMrKRTaD9i1b1Cf9QZ-H1qHU5ZZc"
 
-# Decode Google Service Account credentials
-creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
-creds = Credentials.from_service_account_info(
-    creds_json,
-    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-)
-gc = gspread.authorize(creds)
+# Decode Google Service Account credentials. Without them (benchmarks.py) the
+# module still imports for its flatten and group functions, but can't publish
+gc = None
+if GOOGLE_CREDENTIALS_BASE64:
+    creds_json = json.loads(base64.b64decode(GOOGLE_CREDENTIALS_BASE64))
+    creds = Credentials.from_service_account_info(
+        creds_json,
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    gc = gspread.authorize(creds, http_client=RateLimitedHTTPClient)
 
 session = requests.Session()
 session.headers.update({"Content-Type": "application/json"})
@@ -44,69 +61,41 @@ def odoo_login():
         },
         "id": 1
     }
-    resp = session.post(url, data=json.dumps(payload))
-    resp.raise_for_status()
+    resp = odoo_post(session, url, json.dumps(payload))
     return resp.json()['result']['uid']
 
-# --------- Fetch PI Issue Bank-Wise Data ---------
-def fetch_pi_bank_data(uid, company_id, batch_size=1000):
-    all_records, offset = [], 0
-    
+# --------- Published Columns ---------
+# Odoo fields (relative to sale.order) behind each column that reaches the sheet
+PI_BANK_COLUMN_FIELDS = {
+    "PI Date": ["pi_date"],
+    "Bank": ["bank.display_name"],
+    "Total": ["amount_total"]
+}
+# Columns whose values repeat across rows (dictionary-encoded when DIMENSION_ENCODING=1)
+PI_BANK_DIMENSION_COLUMNS = ["PI Date", "Bank"]
+
+# --------- PI Issue Bank-Wise Domain ---------
+def pi_bank_domain():
     # Get current date for the domain filter
     local_tz = pytz.timezone("Asia/Dhaka")
     current_date = datetime.now(local_tz).strftime("%Y-%m-%d")
     
-    domain = [
+    return [
         "&", ["state", "=", "sale"],
         "&", ["sales_type", "=", "sale"],
         "&", ["pi_date", ">=", "2025-08-01"],
         ["pi_date", "<=", current_date]
     ]
-    
-    specification = {
-        "pi_date": {},
-        "bank": {"fields": {"display_name": {}}},
-        "amount_total": {}
-    }
 
-    while True:
-        payload = {
-            "jsonrpc": "2.0",
-            "method": "call",
-            "params": {
-                "model": "sale.order",
-                "method": "web_search_read",
-                "args": [],
-                "kwargs": {
-                    "domain": domain,
-                    "specification": specification,
-                    "offset": offset,
-                    "limit": batch_size,
-                    "context": {
-                        "lang": "en_US",
-                        "tz": "Asia/Dhaka",
-                        "uid": uid,
-                        "allowed_company_ids": [company_id],
-                        "bin_size": True,
-                        "current_company_id": company_id
-                    },
-                    "count_limit": 10001
-                }
-            },
-            "id": 2
-        }
-        resp = session.post(f"{ODOO_URL}/web/dataset/call_kw/sale.order/web_search_read", data=json.dumps(payload))
-        resp.raise_for_status()
-        result = resp.json()['result']
-        records = result['records']
-        all_records.extend(records)
-        print(f"[Company {company_id}] PI Bank Data: Fetched {len(records)} records, total so far: {len(all_records)}")
-        if len(records) < batch_size:
-            break
-        offset += batch_size
-
-    print(f"✅ Company {company_id} PI bank data total records fetched: {len(all_records)}")
-    return all_records
+# --------- Fetch PI Issue Bank-Wise Data ---------
+def fetch_pi_bank_data(uid, company_id, batch_size=1000, on_page=None):
+    domain = pi_bank_domain()
+    specification = build_specification(PI_BANK_COLUMN_FIELDS)
+
+    return fetch_all_pages(
+        session, ODOO_URL, uid, company_id, "sale.order", domain, specification,
+        "PI Bank Data", batch_size, on_page
+    )
 
 # --------- Safe Getter ---------
 def safe_get(obj, key, default=''):
@@ -122,6 +111,27 @@ def flatten_pi_bank_record(rec):
         "Total": rec.get("amount_total", "")
     }
 
+# --------- Flatten a Page of PI Bank Records ---------
+def flatten_pi_bank_page(records):
+    """Flatten one fetched page into column lists (runs in a page worker when PAGE_WORKERS > 1)"""
+    report_unused_fields(
+        "pi_bank",
+        build_specification(PI_BANK_COLUMN_FIELDS),
+        records,
+        flatten_pi_bank_record
+    )
+    return to_columns((flatten_pi_bank_record(r) for r in records), list(PI_BANK_COLUMN_FIELDS), PI_BANK_DIMENSION_COLUMNS)
+
+# --------- Group PI Bank Rows ---------
+def group_pi_bank_data(df):
+    """Group by PI Date, Bank and sum the Total"""
+    grouped_df = df.groupby(['PI Date', 'Bank']).agg({
+        'Total': 'sum'
+    }).reset_index()
+
+    print(f"📊 Grouped {len(df)} records into {len(grouped_df)} summary rows")
+    return grouped_df
+
 # --------- Upload to Google Sheet ---------
 def paste_to_gsheet(df, sheet_name):
     worksheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(sheet_name)
@@ -129,22 +139,18 @@ def paste_to_gsheet(df, sheet_name):
         print(f"Skip: {sheet_name} DataFrame is empty, not pasting.")
         return
 
-    # Helper function to convert column number to letter (1=A, 27=AA, etc.)
-    def col_num_to_letter(n):
-        result = ""
-        while n > 0:
-            n -= 1
-            result = chr(65 + (n % 26)) + result
-            n //= 26
-        return result
-    
-    # Group by PI Date, Bank and aggregate
-    grouped_df = df.groupby(['PI Date', 'Bank']).agg({
-        'Total': 'sum'
-    }).reset_index()
-    
-    print(f"📊 Grouped {len(df)} records into {len(grouped_df)} summary rows")
+    grouped_df = group_pi_bank_data(df)
     
+    # Skip the clear/update cycle when the data matches the last upload
+    fingerprint = frame_fingerprint(grouped_df)
+    if is_unchanged(GOOGLE_SHEET_ID, sheet_name, fingerprint):
+        local_tz = pytz.timezone("Asia/Dhaka")
+        current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
+        worksheet.update(range_name="J1", values=[[f"Last Updated: {current_timestamp}"]])
+        fit_worksheet(worksheet, len(grouped_df) + 1, 10)
+        print(f"⏭️ {sheet_name} unchanged since last upload, only refreshed the timestamp.")
+        return
+
     # Clear only range A:C instead of entire sheet
     worksheet.batch_clear(["A:C"])
     print(f"🗑️ Cleared range A:C from sheet: {sheet_name}")
@@ -154,12 +160,9 @@ def paste_to_gsheet(df, sheet_name):
     end_col_letter = col_num_to_letter(len(header))
     worksheet.update(range_name=f"A1:{end_col_letter}1", values=[header])
     
-    # Prepare data for writing (convert DataFrame to list of lists)
-    values_to_write = grouped_df.values.tolist()
-    
-    if values_to_write:
+    if not grouped_df.empty:
         # Calculate required rows
-        required_rows = 1 + len(values_to_write)  # Header + data rows
+        required_rows = 1 + len(grouped_df)  # Header + data rows
         current_row_count = worksheet.row_count
         
         # Expand sheet if necessary
@@ -168,34 +171,85 @@ def paste_to_gsheet(df, sheet_name):
             worksheet.add_rows(rows_to_add)
             print(f"📊 Added {rows_to_add} rows to sheet. New total: {required_rows}")
         
-        # Calculate the end column letter
-        end_col = col_num_to_letter(len(grouped_df.columns))
-        
         # Write data starting from row 2
-        range_to_update = f"A2:{end_col}{1 + len(values_to_write)}"
-        worksheet.update(range_name=range_to_update, values=values_to_write)
+        upload_frame(worksheet, grouped_df, 2)
         
         # Update timestamp in J1
         local_tz = pytz.timezone("Asia/Dhaka")
         current_timestamp = datetime.now(local_tz).strftime("%Y-%m-%d %H:%M:%S")
         worksheet.update(range_name="J1", values=[[f"Last Updated: {current_timestamp}"]])
+        remember_upload(GOOGLE_SHEET_ID, sheet_name, fingerprint)
+        # Header + data rows, columns up to the timestamp in J
+        fit_worksheet(worksheet, 1 + len(grouped_df), 10)
         
-        print(f"✅ Data pasted to Google Sheet ({sheet_name}) with {len(values_to_write)} rows.")
+        print(f"✅ Data pasted to Google Sheet ({sheet_name}) with {len(grouped_df)} rows.")
+
+# --------- Sheets Sink ---------
+def publish_tabs(tabs):
+    """Paste each (sheet_name, df) with paste_to_gsheet; the Sheets sink of write_outputs"""
+    for sheet_name, df in tabs:
+        paste_to_gsheet(df, sheet_name)
 
 # --------- Main ---------
-if __name__ == "__main__":
-    uid = odoo_login()
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch PI issue bank-wise data and upload it to Google Sheets")
+    parser.add_argument("--plan", action="store_true",
+                        help="Only estimate this run's Odoo and Sheets cost (runs search_count, uploads nothing)")
+    parser.add_argument("--resume-upload", action="store_true",
+                        help="Republish frames staged by a run whose upload failed, without fetching from Odoo")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile CPU and memory of each stage and write the dumps to PROFILE_DIR")
+    args = parser.parse_args(argv)
+    if args.profile:
+        enable_profiling('pi_bank')
+
+    if args.resume_upload:
+        for sheet_tab, df in staged_frames("pi_bank"):
+            write_outputs("pi_bank", [(sheet_tab, df)], publish_tabs)
+            mark_published("pi_bank", sheet_tab)
+        sys.exit(0)
+
+    uid = login_uid(odoo_login)
     
     # PI Bank data - Company ID mapping to Sheet Tab names
     pi_bank_map = [(1, "pi_bank_zp"), (3, "pi_bank_mt")]
 
+    if args.plan:
+        datasets = [
+            plan_dataset(session, ODOO_URL, uid, company_id, "sale.order", pi_bank_domain(), "PI Bank Data", 1000)
+            for company_id, _ in pi_bank_map
+        ]
+        # Per tab: 2 metadata reads; clear, header, add rows, data and timestamp writes
+        sys.exit(1 if print_plan("pi_bank", datasets, len(PI_BANK_COLUMN_FIELDS), len(pi_bank_map), 2, 5,
+                                  gc.open_by_key(GOOGLE_SHEET_ID), [tab for _, tab in pi_bank_map]) else 0)
+
     # Fetch PI Bank data
     print("\n========== Fetching PI Issue Bank-Wise Data ==========")
+    pool = PagePool()
+    # Fetch both companies first; pages are flattened as they arrive (in worker
+    # processes when PAGE_WORKERS > 1) so raw records are not kept in memory
     for company_id, sheet_tab in pi_bank_map:
-        records = fetch_pi_bank_data(uid, company_id)
-        # Flatten records
-        flat_records = [flatten_pi_bank_record(r) for r in records]
-        df = pd.DataFrame(flat_records)
-        paste_to_gsheet(df, sheet_tab)
+        fetch_pi_bank_data(uid, company_id, on_page=pool.on_page(flatten_pi_bank_page, tag=company_id))
+
+    uploaded_rows, uploaded_cells, query_frames = 0, 0, []
+    for company_id, sheet_tab in pi_bank_map:
+        with profile_stage("group", company_id):
+            flat_records = new_row_store(PI_BANK_COLUMN_FIELDS, PI_BANK_DIMENSION_COLUMNS)
+            for columns in pool.collect(company_id):
+                flat_records.extend_columns(columns)
+            df = flat_records.to_frame()
+        query_frames.append(df.assign(Company="Zipper" if company_id == 1 else "Metal Trims"))
+        # Staged first so a failed upload can be retried with --resume-upload
+        stage_frame("pi_bank", sheet_tab, df)
+        with profile_stage("upload", company_id):
+            write_outputs("pi_bank", [(sheet_tab, df)], publish_tabs)
+        mark_published("pi_bank", sheet_tab)
+        uploaded_rows, uploaded_cells = uploaded_rows + len(df), uploaded_cells + df.size
+    pool.close()
+    load_table("pi_bank", pd.concat(query_frames, ignore_index=True))
+    record_run("pi_bank", uploaded_rows, uploaded_cells)
     
     print("\n✅ All PI bank data fetched and uploaded successfully!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import os
+import json
+from contextlib import contextmanager
+from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking
+    fcntl = None
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Directory for state kept between runs (page sizes, run statistics, upload hashes, ...)
+PIPELINE_STATE_DIR = os.getenv("PIPELINE_STATE_DIR", ".pipeline_state")
+
+# --------- State Files ---------
+def state_path(*parts):
+    """Return a path inside the state directory, creating its parent folders"""
+    path = os.path.join(PIPELINE_STATE_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+def load_state(name, default=None):
+    """Load a JSON state file, returning `default` (or {}) when it is missing or unreadable"""
+    path = state_path(f"{name}.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {} if default is None else default
+
+def save_state(name, data):
+    """Write a JSON state file atomically so an interrupted run never leaves it half-written"""
+    path = state_path(f"{name}.json")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, sort_keys=True, default=str)
+    os.replace(tmp_path, path)
+
+@contextmanager
+def state_lock(name):
+    """
+    Hold an exclusive lock on a state file while it is read, changed and written,
+    so reports run in parallel (see run_reports.py) don't overwrite each other's keys
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(state_path(f"{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def update_state(name, key, value):
+    """Set one key of a JSON state file"""
+    with state_lock(name):
+        data = load_state(name)
+        data[key] = value
+        save_state(name, data)
+    return data
@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import traceback
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from dotenv import load_dotenv
+load_dotenv()
+# Incremental id-set refresh unless configured otherwise; set before the
+# report modules (and id_snapshot) read their config
+os.environ.setdefault("ID_DIFF_REFRESH", "1")
+
+from run_reports import REPORTS, select_reports, load_report_module
+from run_stats import reset_run, last_run
+from odoo_fetch import reuse_logins, forget_logins
+from odoo_cache import start_run, clear_run
+
+# --------- Config from Environment ---------
+# Address of the health and metrics endpoint (local only by default)
+DAEMON_HOST = os.getenv("DAEMON_HOST", "127.0.0.1")
+DAEMON_PORT = int(os.getenv("DAEMON_PORT", "8787"))
+# Refresh intervals overriding the registry, in seconds: "Dispatch=600,pi_bank=1800"
+DAEMON_INTERVALS = os.getenv("DAEMON_INTERVALS", "")
+# Seconds before a failed report is tried again
+DAEMON_RETRY_SECONDS = int(os.getenv("DAEMON_RETRY_SECONDS", "300"))
+# /health turns 503 when a report hasn't succeeded for this many of its intervals
+DAEMON_STALE_INTERVALS = float(os.getenv("DAEMON_STALE_INTERVALS", "3"))
+
+# Reports run one at a time in this process, so the Odoo session, the Sheets
+# client, interned dimension values and id snapshots stay in memory between
+# runs. The run counters, profiler and query cache are per process, which is
+# also why reports don't overlap. The registry's timeout isn't enforced (a
+# thread can't be killed); instead every request a report makes has one: the
+# Odoo request timeouts and the Sheets timeout of RateLimitedHTTPClient.
+
+_lock = threading.Lock()
+_status = {}
+_started = time.time()
+
+def parse_intervals(text):
+    intervals = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        report, _, seconds = item.rpartition("=")
+        if report not in REPORTS:
+            raise SystemExit(f"❌ Unknown report in DAEMON_INTERVALS: {report}")
+        intervals[report] = int(seconds)
+    return intervals
+
+def _last_finished(report):
+    """Epoch seconds of the report's last completed run (any process), or None"""
+    stats = last_run(report)
+    if not stats or "finished" not in stats:
+        return None
+    return datetime.fromisoformat(stats["finished"]).timestamp()
+
+# --------- Scheduling ---------
+def init_status(reports, intervals):
+    now = time.time()
+    for report in reports:
+        interval = intervals.get(report, REPORTS[report]["interval"])
+        finished = _last_finished(report)
+        _status[report] = {
+            "interval": interval,
+            # A restart doesn't rerun reports that ran recently (pend_pi appends a snapshot per run)
+            "next_due": finished + interval if finished is not None else now,
+            "running": False, "runs": 0, "failures": 0, "consecutive_failures": 0,
+            "last_result": None, "last_started": None, "last_finished": None,
+            "last_success": finished, "last_seconds": None
+        }
+
+def _dependencies_ok(report):
+    return all(_status[dep]["last_result"] == "ok" for dep in REPORTS[report]["after"] if dep in _status)
+
+def next_report():
+    """The most overdue report whose dependencies succeeded, or None"""
+    now = time.time()
+    due = [r for r, s in _status.items() if s["next_due"] <= now and _dependencies_ok(r)]
+    return min(due, key=lambda r: _status[r]["next_due"]) if due else None
+
+def run_report(report, number):
+    """Run the report's main() in this process and reschedule it"""
+    run = f"daemon{os.getpid()}-{number}"
+    with _lock:
+        _status[report].update(running=True, last_started=time.time())
+    print(f"\n▶️ Refreshing {report}")
+    start_run(run)
+    reset_run()
+    result, started = "ok", time.monotonic()
+    try:
+        load_report_module(report).main([])
+    except SystemExit as exc:
+        if exc.code not in (None, 0):
+            result = "failed"
+    except Exception:
+        traceback.print_exc()
+        result = "failed"
+    finally:
+        clear_run(run)
+    seconds = time.monotonic() - started
+
+    if result != "ok":
+        # The Odoo session may have expired; log in again next time
+        forget_logins()
+    with _lock:
+        status = _status[report]
+        now = time.time()
+        status.update(
+            running=False, runs=status["runs"] + 1, last_result=result,
+            last_finished=now, last_seconds=round(seconds, 1),
+            next_due=now + (status["interval"] if result == "ok" else DAEMON_RETRY_SECONDS)
+        )
+        if result == "ok":
+            status.update(last_success=now, consecutive_failures=0)
+        else:
+            status.update(failures=status["failures"] + 1, consecutive_failures=status["consecutive_failures"] + 1)
+    print(f"{'✅' if result == 'ok' else '❌'} {report} refreshed in {seconds:.0f}s, "
+          f"next in {_status[report]['next_due'] - time.time():.0f}s")
+
+def serve_forever():
+    number = 0
+    while True:
+        report = next_report()
+        if report is None:
+            with _lock:
+                upcoming = min(s["next_due"] for s in _status.values())
+            time.sleep(max(1.0, min(30.0, upcoming - time.time())))
+            continue
+        number += 1
+        run_report(report, number)
+
+# --------- Health and Metrics ---------
+def health():
+    """(healthy, body): unhealthy when a report hasn't succeeded for DAEMON_STALE_INTERVALS intervals"""
+    now = time.time()
+    reports = {}
+    with _lock:
+        for report, status in _status.items():
+            since = status["last_success"] if status["last_success"] is not None else _started
+            stale = now - since > DAEMON_STALE_INTERVALS * status["interval"]
+            reports[report] = {**status, "stale": stale, "next_in": round(status["next_due"] - now)}
+    healthy = not any(r["stale"] for r in reports.values())
+    return healthy, {"status": "ok" if healthy else "stale", "uptime": round(now - _started), "reports": reports}
+
+def _label(report):
+    return report.replace("\\", "\\\\").replace('"', '\\"')
+
+def metrics():
+    """Prometheus text format: per-report runs, freshness and the last run's Odoo statistics"""
+    lines = [
+        "# TYPE refresh_uptime_seconds gauge",
+        f"refresh_uptime_seconds {time.time() - _started:.0f}"
+    ]
+    series = {
+        "refresh_runs_total": ("counter", lambda s, _: s["runs"]),
+        "refresh_failures_total": ("counter", lambda s, _: s["failures"]),
+        "refresh_running": ("gauge", lambda s, _: int(s["running"])),
+        "refresh_last_success_timestamp_seconds": ("gauge", lambda s, _: s["last_success"]),
+        "refresh_last_duration_seconds": ("gauge", lambda s, _: s["last_seconds"]),
+        "refresh_next_run_timestamp_seconds": ("gauge", lambda s, _: s["next_due"]),
+        "refresh_odoo_records": ("gauge", lambda _, r: r.get("records")),
+        "refresh_odoo_pages": ("gauge", lambda _, r: r.get("pages")),
+        "refresh_odoo_bytes": ("gauge", lambda _, r: r.get("bytes")),
+        "refresh_odoo_hedged_pages": ("gauge", lambda _, r: r.get("hedged")),
+        "refresh_sheet_rows": ("gauge", lambda _, r: r.get("rows"))
+    }
+    with _lock:
+        statuses = {report: dict(status) for report, status in _status.items()}
+    stats = {report: last_run(report) or {} for report in statuses}
+    for name, (kind, value) in series.items():
+        lines.append(f"# TYPE {name} {kind}")
+        for report, status in statuses.items():
+            v = value(status, stats[report])
+            if v is not None:
+                lines.append(f'{name}{{report="{_label(report)}"}} {v}')
+    return "\n".join(lines) + "\n"
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/health":
+            healthy, body = health()
+            self._send(200 if healthy else 503, "application/json", json.dumps(body, indent=2))
+        elif self.path == "/metrics":
+            self._send(200, "text/plain; version=0.0.4", metrics())
+        else:
+            self._send(404, "text/plain", "Not found: use /health or /metrics\n")
+
+    def _send(self, code, content_type, text):
+        body = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the reports' output readable
+        pass
+
+def start_health_server(host, port):
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"🩺 Health on http://{host}:{port}/health, metrics on /metrics")
+    return server
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep the reports fresh: refresh each on its own interval in one warm process")
+    parser.add_argument("reports", nargs="*", help="Report or script names (default: ALL)")
+    parser.add_argument("--host", default=DAEMON_HOST, help="Health endpoint address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="Health endpoint port (default: %(default)s)")
+    args = parser.parse_args()
+
+    reports = select_reports(args.reports)
+    intervals = parse_intervals(DAEMON_INTERVALS)
+    init_status(sorted(reports), intervals)
+    # Import every report up front: Odoo and Google clients are created once, at import
+    for report in _status:
+        load_report_module(report)
+    reuse_logins()
+    start_health_server(args.host, args.port)
+    for report, status in _status.items():
+        print(f"🕒 {report}: every {status['interval']}s, first in {max(0, status['next_due'] - time.time()):.0f}s")
+    try:
+        serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 Refresh daemon stopped")
+        sys.exit(0)
@@ -0,0 +1,127 @@
+import os
+import sys
+import json
+import base64
+import sqlite3
+import argparse
+from datetime import datetime, timezone
+import pandas as pd
+from dotenv import load_dotenv
+from history_store import HISTORY_STORE_DIR, to_columnar
+load_dotenv()
+
+# --------- Config from Environment ---------
+# SQLite database holding the latest flattened frames of every report
+REPORT_DB_PATH = os.getenv("REPORT_DB_PATH", os.path.join(HISTORY_STORE_DIR, "reports.sqlite"))
+# Seconds to wait for another report's load (or a long query) to release the database lock
+REPORT_DB_TIMEOUT = float(os.getenv("REPORT_DB_TIMEOUT", "60"))
+
+# Tables (replaced on every run of their report):
+#   pend_pi_detail, pend_pi   - Regular sale lines and the grouped pending PI, with Company
+#   pi_bank                   - PI issue bank-wise, with Company
+#   pending_orders            - Carter's pending manufacturing orders
+#   dispatch                  - Carter's FG delivery, grouped
+#   carters_journey           - OA/SA/BO/PI journey, with the tab in "Tab"
+
+def connect(path=None):
+    path = path or REPORT_DB_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    return sqlite3.connect(path, timeout=REPORT_DB_TIMEOUT)
+
+# --------- Load ---------
+def load_table(table, df):
+    """
+    Replace `table` with the frame's rows.
+
+    The frame is written to a scratch table first and swapped in with one
+    transaction, so queries never see a half-loaded table. The query tables
+    are a side copy: if the load fails (database locked past
+    REPORT_DB_TIMEOUT, disk full, ...) the old table is kept and the run
+    goes on with a warning.
+    """
+    if len(df.columns) == 0:
+        print(f"Skip: {table} has no columns, query table not replaced.")
+        return
+    scratch = f"_load_{table}"
+    conn = None
+    try:
+        conn = connect()
+        with conn:
+            to_columnar(df).to_sql(scratch, conn, if_exists="replace", index=False)
+            # DDL doesn't open a transaction implicitly in sqlite3, so start one for the swap
+            conn.execute("BEGIN")
+            conn.execute("CREATE TABLE IF NOT EXISTS _loaded (name TEXT PRIMARY KEY, rows INTEGER, loaded_at TEXT)")
+            conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+            conn.execute(f'ALTER TABLE "{scratch}" RENAME TO "{table}"')
+            conn.execute(
+                "INSERT OR REPLACE INTO _loaded VALUES (?, ?, ?)",
+                (table, len(df), datetime.now(timezone.utc).isoformat(timespec="seconds"))
+            )
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Query table {table} not loaded, keeping the previous one: {e}")
+        return
+    finally:
+        if conn is not None:
+            conn.close()
+    print(f"🧮 Loaded {len(df)} rows into query table {table}")
+
+# --------- Query ---------
+def query(sql, params=()):
+    """Run a SELECT against the report tables and return the result as a frame"""
+    conn = connect()
+    try:
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+def list_tables():
+    if query("SELECT name FROM sqlite_master WHERE name = '_loaded'").empty:
+        return pd.DataFrame(columns=["name", "rows", "loaded_at"])
+    return query("SELECT name, rows, loaded_at FROM _loaded ORDER BY name")
+
+# --------- Publish ---------
+def publish_query(df, spreadsheet_id, tab):
+    """Replace a tab (created if missing) with the query result in one batchUpdate"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from sheets_rate import RateLimitedHTTPClient
+    from sheet_publish import frame_requests, publish_batch
+
+    creds = Credentials.from_service_account_info(
+        json.loads(base64.b64decode(os.getenv("GOOGLE_CREDENTIALS_BASE64"))),
+        scopes=["https://www.googleapis.com/auth/spreadsheets"]
+    )
+    spreadsheet = gspread.authorize(creds, http_client=RateLimitedHTTPClient).open_by_key(spreadsheet_id)
+    try:
+        worksheet = spreadsheet.worksheet(tab)
+    except gspread.WorksheetNotFound:
+        worksheet = spreadsheet.add_worksheet(title=tab, rows=len(df) + 1, cols=max(len(df.columns), 1))
+
+    # frame_requests resizes the tab to the result's rows
+    publish_batch(spreadsheet, frame_requests(worksheet, df, max(len(df.columns), 1)))
+    print(f"✅ Published {len(df)} rows to {tab}")
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run SQL against the local report tables")
+    parser.add_argument("sql", nargs="?", help='Query, e.g. "SELECT Customer, SUM(Total) FROM pend_pi GROUP BY Customer"')
+    parser.add_argument("--tables", action="store_true", help="List the tables and when they were loaded")
+    parser.add_argument("--csv", help="Write the result to this CSV file instead of printing it")
+    parser.add_argument("--sheet-id", help="Spreadsheet to publish the result to (with --tab)")
+    parser.add_argument("--tab", help="Tab to replace with the result (created if missing)")
+    args = parser.parse_args()
+
+    if args.tables or not args.sql:
+        print(list_tables().to_string(index=False))
+        sys.exit(0)
+
+    result = query(args.sql)
+    if args.tab:
+        if not args.sheet_id:
+            parser.error("--tab needs --sheet-id")
+        publish_query(result, args.sheet_id, args.tab)
+    elif args.csv:
+        result.to_csv(args.csv, index=False)
+        print(f"✅ Wrote {len(result)} rows to {args.csv}")
+    else:
+        print(result.to_string(index=False))
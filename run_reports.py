@@ -0,0 +1,211 @@
+import os
+import re
+import sys
+import time
+import argparse
+import threading
+import subprocess
+import importlib.util
+from dotenv import load_dotenv
+from run_stats import last_run
+from odoo_cache import clear_run
+load_dotenv()
+
+# --------- Report Registry ---------
+# after:       reports that must finish successfully first
+# timeout:     seconds before the report's process is killed
+# priority:    higher runs first among ready reports; equal priorities run longest-first
+# spreadsheet: reports sharing a spreadsheet are limited by --per-spreadsheet
+# interval:    seconds between refreshes in refresh_daemon.py (pend_pi appends a
+#              snapshot per run, so it stays daily)
+# in_all:      run by "ALL"; the others only run when named or listed in SCHEDULER_OPT_IN
+REPORTS = {
+    "pend_pi": {
+        "script": "pending_pi_fetch_data.py", "after": [], "timeout": 1800, "priority": 0,
+        "spreadsheet": "pend_pi", "interval": 86400, "in_all": True
+    },
+    "pend_pi_retention": {
+        "script": "pend_pi_retention.py", "after": ["pend_pi"], "timeout": 900, "priority": 0,
+        "spreadsheet": "pend_pi", "interval": 86400, "in_all": False
+    },
+    "pi_bank": {
+        "script": "pi_issue_bank_wise.py", "after": [], "timeout": 1800, "priority": 0,
+        "spreadsheet": "pi_bank", "interval": 900, "in_all": True
+    },
+    "Pending_Orders": {
+        "script": "carter's_pending.py", "after": [], "timeout": 1800, "priority": 0,
+        "spreadsheet": "carters", "interval": 900, "in_all": True
+    },
+    "Carter's Journey": {
+        "script": "carter's_journey_oa_bo_sa_pi.py", "after": [], "timeout": 3600, "priority": 0,
+        "spreadsheet": "carters", "interval": 3600, "in_all": True
+    },
+    "Dispatch": {
+        "script": "fg_delivery_carters.py", "after": [], "timeout": 1800, "priority": 0,
+        "spreadsheet": "carters", "interval": 900, "in_all": True
+    }
+}
+
+# --------- Config from Environment ---------
+SCHEDULER_JOBS = int(os.getenv("SCHEDULER_JOBS", str(len(REPORTS))))
+SCHEDULER_SPREADSHEET_JOBS = int(os.getenv("SCHEDULER_SPREADSHEET_JOBS", "0"))
+# Comma-separated reports added to "ALL" although their in_all is False, e.g. pend_pi_retention
+# (it deletes history and rewrites the pend_pi tabs, so it is only scheduled on purpose)
+SCHEDULER_OPT_IN = {name.strip() for name in os.getenv("SCHEDULER_OPT_IN", "").split(",") if name.strip()}
+
+# --------- Job Ordering ---------
+def expected_seconds(report):
+    """Last run's duration; reports without history are treated as the longest"""
+    stats = last_run(report)
+    return stats["seconds"] if stats and "seconds" in stats else float("inf")
+
+def select_reports(names):
+    """
+    Resolve report names or script file names, adding every report they depend on.
+    "ALL" is every report with in_all, plus those in SCHEDULER_OPT_IN.
+    """
+    by_script = {spec["script"]: name for name, spec in REPORTS.items()}
+    selected = set()
+
+    def add(name):
+        name = by_script.get(name, name)
+        if name not in REPORTS:
+            raise SystemExit(f"❌ Unknown report: {name}")
+        if name not in selected:
+            selected.add(name)
+            for dependency in REPORTS[name]["after"]:
+                add(dependency)
+
+    for name in names or ["ALL"]:
+        if name == "ALL":
+            for report, spec in REPORTS.items():
+                if spec["in_all"] or report in SCHEDULER_OPT_IN:
+                    add(report)
+        else:
+            add(name)
+    return selected
+
+# --------- In-Process Reports ---------
+_modules = {}
+
+def load_report_module(report):
+    """
+    Import a report's script as a module, once per process (the file names
+    aren't valid module names). Its main(argv) runs the report in this process.
+    """
+    if report not in _modules:
+        script = REPORTS[report]["script"]
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), script)
+        spec = importlib.util.spec_from_file_location(re.sub(r"\W", "_", script[:-len(".py")]), path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[report] = module
+    return _modules[report]
+
+# --------- Running a Report ---------
+def _relay_output(report, stream):
+    # Prefix each line with its report so parallel output stays readable
+    for line in stream:
+        print(f"[{report}] {line}", end="", flush=True)
+
+def start_report(report, extra_args):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), REPORTS[report]["script"])
+    process = subprocess.Popen(
+        [sys.executable, "-u", script, *extra_args],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace"
+    )
+    relay = threading.Thread(target=_relay_output, args=(report, process.stdout), daemon=True)
+    relay.start()
+    return {"process": process, "relay": relay, "started": time.monotonic()}
+
+# --------- Scheduler ---------
+def run_reports(reports, jobs=None, per_spreadsheet=None, extra_args=()):
+    """
+    Run `reports` as a DAG: a report starts once everything in its `after` list
+    has succeeded, at most `jobs` at a time and at most `per_spreadsheet` per
+    spreadsheet (0 = no limit). Ready reports start by priority, then longest
+    expected duration first, so the slowest report never waits behind short ones.
+    A failed or timed-out report skips everything that depends on it.
+
+    Returns {report: "ok" | "failed" | "timeout" | "skipped"}.
+    """
+    jobs = jobs or SCHEDULER_JOBS
+    per_spreadsheet = SCHEDULER_SPREADSHEET_JOBS if per_spreadsheet is None else per_spreadsheet
+    pending = set(reports)
+    running, results = {}, {}
+
+    while pending or running:
+        # Skip reports whose dependencies did not succeed
+        for report in sorted(pending):
+            if any(results.get(dep, "ok") != "ok" for dep in REPORTS[report]["after"]):
+                print(f"⏭️ Skipping {report}: a dependency did not succeed")
+                results[report] = "skipped"
+                pending.discard(report)
+
+        ready = [report for report in pending if all(results.get(dep) == "ok" for dep in REPORTS[report]["after"])]
+        if pending and not ready and not running:
+            raise SystemExit(f"❌ Dependency cycle between: {', '.join(sorted(pending))}")
+        ready.sort(key=lambda r: (-REPORTS[r]["priority"], -expected_seconds(r), r))
+        for report in ready:
+            if len(running) >= jobs:
+                break
+            spreadsheet = REPORTS[report]["spreadsheet"]
+            sharing = sum(1 for r in running if REPORTS[r]["spreadsheet"] == spreadsheet)
+            if per_spreadsheet and sharing >= per_spreadsheet:
+                continue
+            expected = expected_seconds(report)
+            print(f"▶️ Starting {report}" + (f" (last run {expected:.0f}s)" if expected != float("inf") else ""))
+            running[report] = start_report(report, extra_args)
+            pending.discard(report)
+
+        time.sleep(0.2)
+        for report, job in list(running.items()):
+            process, elapsed = job["process"], time.monotonic() - job["started"]
+            if process.poll() is None:
+                if elapsed > REPORTS[report]["timeout"]:
+                    process.kill()
+                    process.wait()
+                    job["relay"].join()
+                    print(f"⏱️ {report} timed out after {elapsed:.0f}s")
+                    results[report] = "timeout"
+                    del running[report]
+                continue
+            job["relay"].join()
+            results[report] = "ok" if process.returncode == 0 else "failed"
+            print(f"{'✅' if process.returncode == 0 else '❌'} {report} finished in {elapsed:.0f}s "
+                  f"(exit code {process.returncode})")
+            del running[report]
+
+    return results
+
+# --------- CLI ---------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the reports in parallel, respecting their dependencies")
+    parser.add_argument("reports", nargs="*", help="Report or script names (default: ALL)")
+    parser.add_argument("--jobs", type=int, help="Maximum reports running at once")
+    parser.add_argument("--per-spreadsheet", type=int, help="Maximum reports writing to one spreadsheet at once (0 = no limit)")
+    parser.add_argument("--plan", action="store_true", help="Pass --plan to every report")
+    parser.add_argument("--resume-upload", action="store_true", help="Pass --resume-upload to every report")
+    parser.add_argument("--profile", action="store_true", help="Pass --profile to every report")
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    # Reports of this run share one Odoo query cache (used with ODOO_QUERY_CACHE=1)
+    os.environ["ODOO_CACHE_RUN"] = f"run{os.getpid()}"
+    reports = select_reports(args.reports)
+    # Shared supersets are only fetched when every report they feed runs
+    os.environ["ODOO_CACHE_REPORTS"] = ",".join(sorted(reports))
+    results = run_reports(
+        reports,
+        jobs=args.jobs,
+        per_spreadsheet=args.per_spreadsheet,
+        extra_args=(
+            (["--plan"] if args.plan else [])
+            + (["--resume-upload"] if args.resume_upload else [])
+            + (["--profile"] if args.profile else [])
+        )
+    )
+    clear_run(os.environ["ODOO_CACHE_RUN"])
+    print(f"\nFinished in {time.monotonic() - started:.0f}s: "
+          + ", ".join(f"{report} {status}" for report, status in sorted(results.items())))
+    sys.exit(0 if all(status == "ok" for status in results.values()) else 1)
@@ -0,0 +1,49 @@
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from pipeline_state import load_state, update_state
+load_dotenv()
+
+RUN_STATS_STATE = "run_stats"
+
+# --------- Current Run Counters ---------
+# fetch_all_pages adds every page here; record_run() stores the totals per report
+_current = {"records": 0, "pages": 0, "bytes": 0, "fetch_seconds": 0.0, "hedged": 0, "hedges_won": 0}
+_started = time.monotonic()
+
+def reset_run():
+    """Start the counters and the clock of a new run in this process (see refresh_daemon.py)"""
+    global _started
+    _current.update(dict.fromkeys(_current, 0))
+    _started = time.monotonic()
+
+def count_fetch(records, response_bytes, seconds):
+    """Add one fetched Odoo page to the current run's counters"""
+    _current["records"] += records
+    _current["pages"] += 1
+    _current["bytes"] += response_bytes
+    _current["fetch_seconds"] += seconds
+
+def count_hedge(won):
+    """Count a page that got a duplicate request, and whether the duplicate answered first"""
+    _current["hedged"] += 1
+    _current["hedges_won"] += bool(won)
+
+# --------- Stored Statistics ---------
+def record_run(report, rows, cells):
+    """
+    Store this run's statistics for `report`: Odoo records, pages and bytes
+    fetched, rows and cells written to Sheets, and total seconds since the
+    script started. The planner and the scheduler read them back.
+    """
+    update_state(RUN_STATS_STATE, report, {
+        **_current,
+        "rows": rows,
+        "cells": cells,
+        "seconds": round(time.monotonic() - _started, 1),
+        "finished": datetime.now(timezone.utc).isoformat(timespec="seconds")
+    })
+
+def last_run(report):
+    """Statistics of the last completed run of `report`, or None"""
+    return load_state(RUN_STATS_STATE).get(report)
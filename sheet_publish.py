@@ -0,0 +1,308 @@
+import os
+import re
+import csv
+import math
+import hashlib
+import functools
+import gspread
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from pipeline_state import load_state, save_state, state_lock, update_state
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Set SHEETS_FORCE_UPLOAD=1 to re-upload frames even when their content hash is unchanged
+SHEETS_FORCE_UPLOAD = os.getenv("SHEETS_FORCE_UPLOAD", "") not in ("", "0", "false", "False")
+
+# Cells per tab before a frame is split across numbered tabs ("Dispatch", "Dispatch 2", ...); 0 = never split
+SHEETS_TAB_CELL_BUDGET = int(os.getenv("SHEETS_TAB_CELL_BUDGET", "0"))
+
+# How frames are sent: "values" (cells as JSON arrays, written RAW) or "paste"
+# (the frame serialized once to tab-delimited text and sent as a pasteData request)
+SHEETS_UPLOAD_MODE = os.getenv("SHEETS_UPLOAD_MODE", "values")
+
+# Set SHEETS_TRIM_COLUMNS=1 to also delete the columns right of what a report writes
+# (by default tabs keep their column count, so columns users added there survive)
+SHEETS_TRIM_COLUMNS = os.getenv("SHEETS_TRIM_COLUMNS", "") not in ("", "0", "false", "False")
+
+UPLOAD_HASH_STATE = "upload_hashes"
+
+# --------- Content Fingerprint ---------
+def frame_fingerprint(df):
+    """
+    Stable, row-order independent hash of a frame's columns and values.
+
+    Each row is hashed on its own, the row hashes are sorted and then digested
+    together with the column names, so the same rows in a different order give
+    the same fingerprint while any changed, added or removed row does not.
+    """
+    digest = hashlib.sha256()
+    digest.update("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    if not df.empty:
+        # Hash the text form so object columns mixing False, str and numbers hash consistently
+        row_hashes = np.sort(pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy())
+        digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+def _hash_key(spreadsheet_id, sheet_name):
+    return f"{spreadsheet_id}:{sheet_name}"
+
+def is_unchanged(spreadsheet_id, sheet_name, fingerprint):
+    """True when the last successful upload to this tab had the same fingerprint"""
+    if SHEETS_FORCE_UPLOAD:
+        return False
+    return load_state(UPLOAD_HASH_STATE).get(_hash_key(spreadsheet_id, sheet_name)) == fingerprint
+
+def remember_upload(spreadsheet_id, sheet_name, fingerprint):
+    """Store the fingerprint of a completed upload for the next run to compare against"""
+    update_state(UPLOAD_HASH_STATE, _hash_key(spreadsheet_id, sheet_name), fingerprint)
+
+def forget_upload(spreadsheet_id, sheet_name):
+    """Drop a tab's stored fingerprint (the tab was added or removed, so its content is gone)"""
+    with state_lock(UPLOAD_HASH_STATE):
+        state = load_state(UPLOAD_HASH_STATE)
+        if state.pop(_hash_key(spreadsheet_id, sheet_name), None) is not None:
+            save_state(UPLOAD_HASH_STATE, state)
+
+# --------- A1 Notation ---------
+def col_num_to_letter(n):
+    """Convert a column number to its letter (1=A, 27=AA, etc.)"""
+    result = ""
+    while n > 0:
+        n -= 1
+        result = chr(65 + (n % 26)) + result
+        n //= 26
+    return result
+
+# --------- Worksheet Size ---------
+def _fit_size(worksheet, rows, cols):
+    """
+    `rows` x `cols`, but at least one row and column past the frozen ones:
+    the API rejects a resize that would leave every row or column frozen
+    (an empty tab with a frozen header). The frozen counts come from the
+    gridProperties gspread read when opening the tab.
+
+    Columns are only ever added unless SHEETS_TRIM_COLUMNS is set: the
+    columns right of the report's range may hold users' own notes or formulas.
+    """
+    if not SHEETS_TRIM_COLUMNS:
+        cols = max(cols, worksheet.col_count)
+    return max(rows, worksheet.frozen_row_count + 1), max(cols, worksheet.frozen_col_count + 1)
+
+def fit_worksheet(worksheet, rows, cols):
+    """
+    Resize the grid to exactly the `rows` just written, and to `cols`
+    columns (grown only, see _fit_size).
+
+    Tabs otherwise keep every row they ever needed, and the empty grid slows
+    down reads and recalculation. row_count/col_count are cached by gspread,
+    so an already-fitting tab costs no request.
+    """
+    rows, cols = _fit_size(worksheet, rows, cols)
+    if worksheet.row_count != rows or worksheet.col_count != cols:
+        worksheet.resize(rows=rows, cols=cols)
+        print(f"📐 Resized {worksheet.title} to {rows} rows x {cols} columns")
+
+def resize_request(worksheet, rows, cols):
+    """batchUpdate request form of fit_worksheet"""
+    rows, cols = _fit_size(worksheet, rows, cols)
+    return {
+        "updateSheetProperties": {
+            "properties": {
+                "sheetId": worksheet.id,
+                "gridProperties": {"rowCount": rows, "columnCount": cols}
+            },
+            "fields": "gridProperties(rowCount,columnCount)"
+        }
+    }
+
+# --------- Sharding Across Tabs ---------
+def shard_name(sheet_name, number):
+    return sheet_name if number == 1 else f"{sheet_name} {number}"
+
+def shard_frame(sheet_name, df, extra_columns=0, budget=None):
+    """
+    Split a frame into [(tab name, part)] so no tab holds more than the cell
+    budget (each part's rows x (columns + extra_columns), e.g. a timestamp
+    column). The first part keeps the original tab name.
+    """
+    budget = SHEETS_TAB_CELL_BUDGET if budget is None else budget
+    width = len(df.columns) + extra_columns
+    if not budget or df.empty or (len(df) + 1) * width <= budget:
+        return [(sheet_name, df)]
+    rows_per_tab = max(budget // width - 1, 1)
+    return [
+        (shard_name(sheet_name, i + 1), df.iloc[start:start + rows_per_tab].reset_index(drop=True))
+        for i, start in enumerate(range(0, len(df), rows_per_tab))
+    ]
+
+def open_worksheet(spreadsheet, title, rows=1000, cols=26):
+    """Return the tab named `title`, adding it when it doesn't exist yet (new shards)"""
+    try:
+        return spreadsheet.worksheet(title)
+    except gspread.WorksheetNotFound:
+        print(f"➕ Adding tab {title}")
+        forget_upload(spreadsheet.id, title)
+        return spreadsheet.add_worksheet(title=title, rows=rows, cols=cols)
+
+def remove_stale_shards(spreadsheet, sheet_name, shard_count, worksheets=None):
+    """Delete numbered shard tabs of `sheet_name` beyond `shard_count` left by a larger earlier run"""
+    if not SHEETS_TAB_CELL_BUDGET:
+        return
+    pattern = re.compile(rf"{re.escape(sheet_name)} (\d+)")
+    for worksheet in worksheets if worksheets is not None else spreadsheet.worksheets():
+        match = pattern.fullmatch(worksheet.title)
+        if match and int(match.group(1)) > shard_count:
+            spreadsheet.del_worksheet(worksheet)
+            forget_upload(spreadsheet.id, worksheet.title)
+            print(f"🗑️ Removed stale shard tab {worksheet.title}")
+
+# --------- Spreadsheet-Level Batch Publish ---------
+def to_cell_data(value):
+    """Convert a Python value to a Sheets API CellData, typed like a RAW values update"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    return {"userEnteredValue": {"stringValue": str(value)}}
+
+def tab_requests(worksheet, rows, clear_columns, timestamp_cell=None, timestamp_text=None):
+    """
+    batchUpdate requests that replace columns [0, clear_columns) of a tab with `rows`.
+
+    The grid is first resized to exactly the rows written (never below the
+    frozen rows) and to at least the columns up to the band or the timestamp,
+    whichever is wider (see _fit_size). One updateCells then covers the whole
+    column band. `timestamp_cell` is a zero-based (row, column).
+    """
+    columns = max(clear_columns, timestamp_cell[1] + 1 if timestamp_cell is not None else 0)
+    requests = [resize_request(worksheet, len(rows), columns)]
+    requests.append({
+        "updateCells": {
+            "range": {"sheetId": worksheet.id, "startRowIndex": 0, "startColumnIndex": 0, "endColumnIndex": clear_columns},
+            "rows": [{"values": [to_cell_data(v) for v in row]} for row in rows],
+            "fields": "userEnteredValue"
+        }
+    })
+    if timestamp_cell is not None:
+        requests.append(timestamp_request(worksheet, timestamp_cell, timestamp_text))
+    return requests
+
+def frame_requests(worksheet, df, clear_columns, timestamp_cell=None, timestamp_text=None, header=None):
+    """
+    tab_requests for a frame (header row + values) in the SHEETS_UPLOAD_MODE.
+
+    In paste mode the band is cleared and the frame pasted as text in place
+    of the updateCells with one CellData per cell.
+    """
+    header = df.columns.tolist() if header is None else header
+    if SHEETS_UPLOAD_MODE != "paste":
+        return tab_requests(worksheet, [header] + df.values.tolist(), clear_columns, timestamp_cell, timestamp_text)
+    columns = max(clear_columns, timestamp_cell[1] + 1 if timestamp_cell is not None else 0)
+    requests = [
+        resize_request(worksheet, len(df) + 1, columns),
+        {
+            "updateCells": {
+                "range": {"sheetId": worksheet.id, "startRowIndex": 0, "startColumnIndex": 0, "endColumnIndex": clear_columns},
+                "fields": "userEnteredValue"
+            }
+        },
+        paste_request(worksheet, df, header=header)
+    ]
+    if timestamp_cell is not None:
+        requests.append(timestamp_request(worksheet, timestamp_cell, timestamp_text))
+    return requests
+
+def timestamp_request(worksheet, cell, text):
+    row, col = cell
+    return {
+        "updateCells": {
+            "start": {"sheetId": worksheet.id, "rowIndex": row, "columnIndex": col},
+            "rows": [{"values": [to_cell_data(text)]}],
+            "fields": "userEnteredValue"
+        }
+    }
+
+def publish_batch(spreadsheet, requests):
+    """Send every tab's requests as one spreadsheets.batchUpdate (one recalculation, applied atomically)"""
+    if not requests:
+        return None
+    return spreadsheet.batch_update({"requests": requests})
+
+
+# --------- Delimited Text Upload ---------
+# Text that Sheets would otherwise parse into something else: formulas, signs,
+# numbers and booleans stored as text. A leading apostrophe keeps it as typed.
+_LITERAL_TEXT = re.compile(r"[=+\-'\"]|\s*[-+]?(\d[\d,]*\.?\d*|\.\d+)([eE][-+]?\d+)?%?\s*$|(?i:true|false)$")
+_SEPARATORS = str.maketrans({"\t": " ", "\r": " ", "\n": " ", "\x1f": None})
+
+@functools.lru_cache(maxsize=65536)
+def _paste_string(text):
+    # Cached: dimension columns repeat the same few thousand strings
+    text = text.translate(_SEPARATORS)
+    return f"'{text}" if _LITERAL_TEXT.match(text) else text
+
+def _paste_cell(value):
+    if type(value) is str:
+        return _paste_string(value)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is None or value is pd.NA or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return _paste_string(str(value))
+
+def paste_text(df, header=None):
+    """
+    The frame (with `header` as its first row, if given) as tab-delimited text
+    for pasteData.
+
+    Numeric columns are written by pandas' CSV writer without per-cell Python
+    work; they and ISO dates are parsed back into numbers and dates by Sheets
+    (with a "." decimal separator, so the spreadsheet locale should use one).
+    Strings that would be parsed as numbers, booleans or formulas keep their
+    text with a leading apostrophe, like a RAW values update.
+    """
+    columns = {}
+    for i, name in enumerate(df.columns):
+        series = df.iloc[:, i]
+        if series.dtype == bool:
+            columns[i] = series.map({True: "TRUE", False: "FALSE"})
+        elif series.dtype.kind in "iuf":
+            columns[i] = series
+        else:
+            columns[i] = series.map(_paste_cell)
+    text_df = pd.DataFrame(columns, index=df.index)
+    return text_df.to_csv(
+        sep="\t", index=False, na_rep="", lineterminator="\n",
+        header=[_paste_cell(name) for name in header] if header is not None else False,
+        # Tabs, line breaks and the quote character were stripped from the text above
+        quoting=csv.QUOTE_NONE, quotechar="\x1f"
+    )
+
+def paste_request(worksheet, df, row=0, column=0, header=None):
+    """pasteData request writing the frame from the zero-based (row, column) cell"""
+    return {
+        "pasteData": {
+            "coordinate": {"sheetId": worksheet.id, "rowIndex": row, "columnIndex": column},
+            "data": paste_text(df, header),
+            "type": "PASTE_NORMAL",
+            "delimiter": "\t"
+        }
+    }
+
+def upload_frame(worksheet, df, start_row):
+    """Write the frame's values from row `start_row` (1-based) in column A, in the SHEETS_UPLOAD_MODE"""
+    if SHEETS_UPLOAD_MODE == "paste":
+        worksheet.spreadsheet.batch_update({"requests": [paste_request(worksheet, df, row=start_row - 1)]})
+        return
+    end_col = col_num_to_letter(len(df.columns))
+    worksheet.update(range_name=f"A{start_row}:{end_col}{start_row + len(df) - 1}", values=df.values.tolist())
@@ -0,0 +1,120 @@
+import os
+import time
+import random
+from http import HTTPStatus
+from dotenv import load_dotenv
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from pipeline_state import load_state, save_state, state_lock
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Google Sheets quota: read and write requests per minute per user
+SHEETS_READS_PER_MINUTE = int(os.getenv("SHEETS_READS_PER_MINUTE", "60"))
+SHEETS_WRITES_PER_MINUTE = int(os.getenv("SHEETS_WRITES_PER_MINUTE", "60"))
+# Requests that may go out back to back before the steady rate applies
+SHEETS_BURST = int(os.getenv("SHEETS_BURST", "10"))
+# Retries after a 429 or 5xx, with exponential backoff capped at SHEETS_MAX_BACKOFF seconds
+SHEETS_MAX_RETRIES = int(os.getenv("SHEETS_MAX_RETRIES", "6"))
+SHEETS_MAX_BACKOFF = float(os.getenv("SHEETS_MAX_BACKOFF", "64"))
+# Seconds to wait for a connection and for a response (gspread's default is
+# no timeout, so one hung request would stall the run for good)
+SHEETS_CONNECT_TIMEOUT = float(os.getenv("SHEETS_CONNECT_TIMEOUT", "10"))
+SHEETS_READ_TIMEOUT = float(os.getenv("SHEETS_READ_TIMEOUT", "300"))
+
+RATE_STATE = "sheets_rate"
+
+# --------- Token Bucket ---------
+class TokenBucket:
+    """
+    Token bucket shared by every process using the same state directory.
+
+    The bucket refills at `per_minute` / 60 tokens per second up to `burst`.
+    Its level lives in the pipeline state file and is changed under a file
+    lock, so reports run in parallel by run_reports.py share one quota. After
+    a 429, block() holds back every process until the backoff has passed.
+    """
+
+    def __init__(self, name, per_minute, burst=None):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = burst or SHEETS_BURST
+
+    def _take(self, now):
+        """Take a token if one is available; otherwise return the seconds to wait"""
+        with state_lock(RATE_STATE):
+            state = load_state(RATE_STATE)
+            bucket = state.get(self.name, {"tokens": self.burst, "updated": now, "blocked_until": 0})
+            # No refill while blocked: `updated` is moved to the end of the block
+            bucket["tokens"] = min(self.burst, bucket["tokens"] + max(now - bucket["updated"], 0) * self.rate)
+            bucket["updated"] = max(now, bucket["updated"])
+            if now < bucket["blocked_until"]:
+                wait = bucket["blocked_until"] - now
+            elif bucket["tokens"] >= 1:
+                bucket["tokens"] -= 1
+                wait = 0
+            else:
+                wait = (1 - bucket["tokens"]) / self.rate
+            state[self.name] = bucket
+            save_state(RATE_STATE, state)
+        return wait
+
+    def acquire(self):
+        """Block until a request may be sent; returns the seconds spent waiting"""
+        waited = 0.0
+        while True:
+            wait = self._take(time.time())
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def block(self, seconds):
+        """Hold back every process using this bucket for `seconds` and empty it"""
+        with state_lock(RATE_STATE):
+            state = load_state(RATE_STATE)
+            now = time.time()
+            bucket = state.get(self.name, {"tokens": self.burst, "updated": now, "blocked_until": 0})
+            blocked_until = max(bucket["blocked_until"], now + seconds)
+            bucket.update(tokens=0, updated=blocked_until, blocked_until=blocked_until)
+            state[self.name] = bucket
+            save_state(RATE_STATE, state)
+
+read_bucket = TokenBucket("read", SHEETS_READS_PER_MINUTE)
+write_bucket = TokenBucket("write", SHEETS_WRITES_PER_MINUTE)
+
+# --------- gspread HTTP Client ---------
+class RateLimitedHTTPClient(HTTPClient):
+    """
+    gspread HTTP client that takes a read (GET) or write (anything else) token
+    before every Sheets request and retries 429 and 5xx responses with
+    exponential backoff and jitter. Requests time out after
+    SHEETS_CONNECT_TIMEOUT / SHEETS_READ_TIMEOUT; a timed-out request is
+    not retried, as a write may have been applied.
+
+    Use with gspread.authorize(creds, http_client=RateLimitedHTTPClient).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.set_timeout((SHEETS_CONNECT_TIMEOUT, SHEETS_READ_TIMEOUT))
+
+    def request(self, method, endpoint, *args, **kwargs):
+        bucket = read_bucket if method.upper() == "GET" else write_bucket
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            bucket.acquire()
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except APIError as err:
+                # The HTTP status, as err.code is -1 when the error body isn't JSON
+                status = err.response.status_code
+                retryable = status == HTTPStatus.TOO_MANY_REQUESTS or status >= HTTPStatus.INTERNAL_SERVER_ERROR
+                if not retryable or attempt == SHEETS_MAX_RETRIES:
+                    raise
+                wait = min(2 ** attempt, SHEETS_MAX_BACKOFF) + random.uniform(0, 1)
+                print(f"⏳ Sheets API returned {status}, retrying in {wait:.1f}s")
+                if status == HTTPStatus.TOO_MANY_REQUESTS:
+                    # Quota exhausted: pause every report, not just this request
+                    bucket.block(wait)
+                else:
+                    time.sleep(wait)
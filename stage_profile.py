@@ -0,0 +1,133 @@
+import os
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+load_dotenv()
+
+# --------- Config from Environment ---------
+# Where --profile writes <PROFILE_DIR>/<report>/<timestamp>/<stage>[_company<id>].prof and summary.json
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Allocation sites listed per stage in the memory breakdown (0 = none)
+PROFILE_TOP_ALLOCATIONS = int(os.getenv("PROFILE_TOP_ALLOCATIONS", "10"))
+# Frames kept per tracemalloc allocation (more = slower, but allocations are attributed to callers)
+PROFILE_TRACE_FRAMES = int(os.getenv("PROFILE_TRACE_FRAMES", "1"))
+
+# Stages: fetch (waiting on Odoo), decode (JSON), flatten (page handlers),
+# group (merging and grouping frames), upload (every output sink)
+
+_report = None
+_stages = {}
+_active = []
+
+# --------- Switch ---------
+def enable_profiling(report):
+    """Profile every stage of this run of `report`; the dumps are written when the process exits"""
+    global _report
+    if _report is not None:
+        return
+    _report = report
+    tracemalloc.start(PROFILE_TRACE_FRAMES)
+    atexit.register(write_profiles)
+    if int(os.getenv("PAGE_WORKERS", "0")) > 1:
+        print("⚠️ PAGE_WORKERS > 1: flattening runs in worker processes and is not profiled")
+
+def _snapshot():
+    # tracemalloc's own bookkeeping would otherwise top every list
+    return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+def _stage_key(name, company):
+    return name if company is None else f"{name}_company{company}"
+
+# --------- Stage Context ---------
+@contextmanager
+def profile_stage(name, company=None):
+    """
+    Attribute the CPU time and memory of the block to stage `name` (per company).
+
+    A stage can be entered many times (once per page) and accumulates. Stages
+    nest: cProfile allows one active profiler, so the enclosing stage's
+    profiler is paused while an inner stage runs. Peak memory is the highest
+    traced memory above what was allocated when the stage was entered.
+    Does nothing unless enable_profiling() was called.
+    """
+    if _report is None:
+        yield
+        return
+
+    key = _stage_key(name, company)
+    stage = _stages.setdefault(key, {
+        "stage": name, "company": company, "profile": cProfile.Profile(),
+        "calls": 0, "seconds": 0.0, "peak_bytes": 0, "allocations": None
+    })
+    outer = _active[-1] if _active else None
+    if outer is not None:
+        outer["stage"]["profile"].disable()
+        outer["peak"] = max(outer["peak"], tracemalloc.get_traced_memory()[1])
+    # Allocation sites come from the first pass through each top-level stage:
+    # snapshots are too slow to take on every page
+    first = outer is None and stage["calls"] == 0 and PROFILE_TOP_ALLOCATIONS
+    snapshot = _snapshot() if first else None
+    tracemalloc.reset_peak()
+    frame = {"stage": stage, "start": tracemalloc.get_traced_memory()[0], "peak": 0, "started": time.perf_counter()}
+    _active.append(frame)
+    stage["profile"].enable()
+    try:
+        yield
+    finally:
+        stage["profile"].disable()
+        _active.pop()
+        peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+        stage["calls"] += 1
+        stage["seconds"] += time.perf_counter() - frame["started"]
+        stage["peak_bytes"] = max(stage["peak_bytes"], peak - frame["start"])
+        if snapshot is not None:
+            stats = _snapshot().compare_to(snapshot, "lineno")[:PROFILE_TOP_ALLOCATIONS]
+            stage["allocations"] = [
+                {"site": str(stat.traceback[0]), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+                for stat in stats
+            ]
+        if outer is not None:
+            # Allocations of the inner stage also count toward the enclosing one
+            outer["peak"] = max(outer["peak"], peak)
+            outer["stage"]["profile"].enable()
+
+# --------- Output ---------
+def write_profiles():
+    """
+    Write one cProfile dump per stage (open with snakeviz, or turn into a
+    flame graph with flameprof / gprof2dot) and summary.json with each
+    stage's wall time, CPU time, peak memory and top allocation sites.
+    """
+    if _report is None or not _stages:
+        return
+    folder = os.path.join(PROFILE_DIR, _report.replace("'", "").replace(" ", "_"), datetime.now().strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(folder, exist_ok=True)
+
+    summary = []
+    for key, stage in _stages.items():
+        path = os.path.join(folder, f"{key}.prof")
+        stage["profile"].dump_stats(path)
+        summary.append({
+            "stage": stage["stage"],
+            "company": stage["company"],
+            "calls": stage["calls"],
+            "seconds": round(stage["seconds"], 3),
+            "cpu_seconds": round(pstats.Stats(stage["profile"]).total_tt, 3),
+            "peak_bytes": stage["peak_bytes"],
+            "top_allocations": stage["allocations"],
+            "profile": path
+        })
+    with open(os.path.join(folder, "summary.json"), "w", encoding="utf-8") as f:
+        json.dump({"report": _report, "stages": summary}, f, indent=2)
+
+    print(f"\n🔬 Profile of {_report} written to {folder}")
+    print(f"{'Stage':<24}{'Calls':>7}{'Wall s':>10}{'CPU s':>10}{'Peak MiB':>10}")
+    for row in summary:
+        print(f"{_stage_key(row['stage'], row['company']):<24}{row['calls']:>7}{row['seconds']:>10.2f}"
+              f"{row['cpu_seconds']:>10.2f}{row['peak_bytes'] / 1024 / 1024:>10.1f}")
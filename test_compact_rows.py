@@ -0,0 +1,88 @@
+import random
+import pandas as pd
+import pytest
+from compact_rows import DictRows, RowBlock, EncodedRows, Dictionary, to_columns
+
+COLUMNS = ["Date", "Customer", "Buyer", "Code", "Total", "Quantity"]
+DIMENSIONS = ["Date", "Customer", "Buyer", "Code"]
+GROUP = ["Date", "Customer", "Buyer"]
+SUMS = ["Total", "Quantity"]
+
+def _rows(count=500, seed=3):
+    """Flattened rows like the reports': every column present, False and "" for empty values"""
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        row = {
+            "Date": rng.choice(["2025-09-01", "2025-09-02"]),
+            "Customer": rng.choice(["Zeta Apparel", "Alpha Knit", "", None]),
+            "Buyer": rng.choice(["Carter's", "OshKosh", "Next"]),
+            "Code": rng.choice([0, 1, 1.0, "A-1", False]),
+            "Total": rng.choice([10, 2.5, 0.1, 1000]),
+            "Quantity": rng.choice([1, 3, 12.5])
+        }
+        rows.append(row)
+    return rows
+
+def _store(kind):
+    if kind == "dict":
+        return DictRows(COLUMNS)
+    if kind == "block":
+        return RowBlock(COLUMNS)
+    return EncodedRows(COLUMNS, DIMENSIONS)
+
+def _filled(kind, rows, pages=None):
+    """A row store fed whole (extend_dicts) or page by page through to_columns, like page workers"""
+    store = _store(kind)
+    if pages is None:
+        store.extend_dicts(rows)
+    else:
+        for start in range(0, len(rows), pages):
+            store.extend_columns(to_columns(rows[start:start + pages], COLUMNS, DIMENSIONS))
+    return store
+
+def _expected(rows):
+    return pd.DataFrame(rows, columns=COLUMNS)
+
+@pytest.mark.parametrize("kind", ["dict", "block", "encoded"])
+@pytest.mark.parametrize("pages", [None, 1, 64])
+def test_stores_build_the_same_frame(kind, pages):
+    rows = _rows()
+    frame = _filled(kind, rows, pages).to_frame()
+    pd.testing.assert_frame_equal(frame[COLUMNS], _expected(rows))
+
+@pytest.mark.parametrize("pages", [None, 64])
+def test_encoded_keeps_value_types(pages):
+    rows = _rows()
+    store = _filled("encoded", rows, pages)
+    for col in COLUMNS:
+        decoded = store.column(col)
+        expected = [row[col] for row in rows]
+        assert decoded == expected
+        assert [v.__class__ for v in decoded] == [v.__class__ for v in expected]
+    assert len(store) == len(rows)
+
+def test_dictionary_codes_by_type():
+    dictionary = Dictionary()
+    codes = [dictionary.encode(v) for v in [0, False, 1, 1.0, True, "", "a", "a"]]
+    assert codes == [0, 1, 2, 3, 4, 5, 6, 6]
+    assert dictionary.decode(codes).tolist() == [0, False, 1, 1.0, True, "", "a", "a"]
+
+@pytest.mark.parametrize("pages", [None, 64])
+def test_group_sum_matches_dict_rows_groupby(pages):
+    rows = _rows()
+    expected = _filled("dict", rows, pages).to_frame().groupby(GROUP).agg({col: "sum" for col in SUMS}).reset_index()
+    grouped = _filled("encoded", rows, pages).group_sum(GROUP, SUMS)
+    pd.testing.assert_frame_equal(grouped, expected)
+
+def test_group_sum_on_an_unencoded_column_falls_back():
+    rows = _rows()
+    store = EncodedRows(COLUMNS, ["Date", "Customer"])
+    store.extend_dicts(rows)
+    expected = _expected(rows).groupby(GROUP).agg({col: "sum" for col in SUMS}).reset_index()
+    pd.testing.assert_frame_equal(store.group_sum(GROUP, SUMS), expected)
+
+def test_empty_stores():
+    assert _store("encoded").to_frame().empty
+    assert _store("dict").to_frame().empty
+    assert _filled("encoded", [], 10).to_frame().empty
@@ -0,0 +1,95 @@
+import math
+import random
+import pandas as pd
+import pytest
+from hash_aggregate import PartialAggregate
+
+KEYS = ["Order", "Buyer"]
+AGGREGATIONS = {"Date": "first", "Brand": "first", "Qty": "sum", "Value": "sum", "Lines": "count"}
+
+def _rows(count=400, seed=7):
+    """Flattened rows like the reports': empty numbers as "" or False, missing text as "" or None"""
+    rng = random.Random(seed)
+    rows = []
+    for i in range(count):
+        rows.append({
+            "Order": rng.choice(["S001", "S002", "S010", "", None, math.nan]),
+            "Buyer": rng.choice(["Carter's", "OshKosh", ""]),
+            "Date": rng.choice(["2025-05-01", "2025-06-15", None]),
+            "Brand": rng.choice(["Carter's", "", None, math.nan]),
+            "Qty": rng.choice([1, 2.5, 10, "", False]),
+            "Value": rng.choice([100.0, 0.25, "", 3]),
+            "Lines": rng.choice([1, None])
+        })
+    return rows
+
+def _groupby(rows):
+    """The pandas result PartialAggregate must reproduce (empty numbers summed as 0)"""
+    df = pd.DataFrame(rows)
+    for col in ["Qty", "Value"]:
+        df[col] = df[col].map(lambda v: 0 if v == "" or v is False else v)
+    return df.groupby(KEYS, as_index=False).agg(AGGREGATIONS)
+
+def _pages(rows, size):
+    return [rows[start:start + size] for start in range(0, len(rows), size)]
+
+def _aggregate(pages):
+    return [PartialAggregate(KEYS, AGGREGATIONS).add_rows(page) for page in pages]
+
+def _assert_same(actual, expected):
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True), check_dtype=False)
+
+def test_matches_groupby():
+    rows = _rows()
+    _assert_same(PartialAggregate(KEYS, AGGREGATIONS).add_rows(rows).to_frame(), _groupby(rows))
+
+def test_null_keys_are_dropped_empty_keys_kept():
+    rows = _rows()
+    frame = PartialAggregate(KEYS, AGGREGATIONS).add_rows(rows).to_frame()
+    assert frame["Order"].notna().all()
+    assert "" in set(frame["Order"]) and "" in set(frame["Buyer"])
+
+@pytest.mark.parametrize("size", [1, 37, 400])
+def test_merged_pages_match_groupby(size):
+    rows = _rows()
+    merged = PartialAggregate(KEYS, AGGREGATIONS)
+    for partial in _aggregate(_pages(rows, size)):
+        merged.merge(partial)
+    _assert_same(merged.to_frame(), _groupby(rows))
+    assert merged.row_count == len(rows)
+
+def test_merge_order_only_changes_first():
+    pages = _pages(_rows(), 50)
+    forward, backward = PartialAggregate(KEYS, AGGREGATIONS), PartialAggregate(KEYS, AGGREGATIONS)
+    for partial in _aggregate(pages):
+        forward.merge(partial)
+    for partial in reversed(_aggregate(pages)):
+        backward.merge(partial)
+    summed = KEYS + ["Qty", "Value", "Lines"]
+    _assert_same(backward.to_frame()[summed], forward.to_frame()[summed])
+    # "first" follows the order the partials were merged in, like the rows they came from
+    reversed_rows = [row for page in reversed(pages) for row in page]
+    _assert_same(backward.to_frame(), _groupby(reversed_rows))
+
+def test_column_order():
+    rows = _rows()
+    frame = PartialAggregate(KEYS, AGGREGATIONS).add_rows(rows).to_frame()
+    assert list(frame.columns) == list(_groupby(rows).columns) == KEYS + list(AGGREGATIONS)
+    order = ["Date", "Order", "Value", "Buyer", "Qty", "Lines", "Brand"]
+    assert list(PartialAggregate(KEYS, AGGREGATIONS).add_rows(rows).to_frame(columns=order).columns) == order
+
+def test_line_totals_count_every_row():
+    rows = _rows()
+    merged = PartialAggregate(KEYS, AGGREGATIONS, line_totals=["Value"])
+    for page in _pages(rows, 64):
+        merged.merge(PartialAggregate(KEYS, AGGREGATIONS, line_totals=["Value"]).add_rows(page))
+    expected = sum(0 if v == "" else v for v in (row["Value"] for row in rows))
+    assert merged.total("Value") == pytest.approx(expected)
+    # Rows with a null key are in the line total but not in any group
+    assert merged.total("Value") > merged.to_frame()["Value"].sum()
+
+def test_merge_rejects_different_partials():
+    with pytest.raises(ValueError):
+        PartialAggregate(KEYS, AGGREGATIONS).merge(PartialAggregate(KEYS, {"Qty": "sum"}))
+    with pytest.raises(ValueError):
+        PartialAggregate(KEYS, AGGREGATIONS).merge(PartialAggregate(KEYS, AGGREGATIONS, line_totals=["Qty"]))
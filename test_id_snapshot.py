@@ -0,0 +1,137 @@
+import pandas as pd
+import pytest
+import id_snapshot
+import pipeline_state
+from id_snapshot import diff_fetch
+
+COLUMNS = ["Order", "Customer", "Qty"]
+SPEC = {"name": {}, "partner_id": {"fields": {"display_name": {}}}, "qty": {}}
+
+def _flatten(record):
+    return {"Order": record["name"], "Customer": record["partner_id"]["display_name"], "Qty": record["qty"]}
+
+class FakeOdoo:
+    """Records of the report's domain, in Odoo's order, answering fetch() like fetch_all_pages would"""
+
+    def __init__(self, count=6):
+        self.records = {i: self.record(i, f"Customer {i % 2}", i * 10) for i in range(1, count + 1)}
+        self.calls = []
+
+    @staticmethod
+    def record(i, customer, qty, write_date="2025-09-01 08:00:00"):
+        return {"id": i, "name": f"MO{i:04d}", "partner_id": {"id": 1, "display_name": customer}, "qty": qty,
+                "write_date": write_date}
+
+    def modify(self, i, **changes):
+        self.records[i] = {**self.records[i], **changes, "write_date": "2025-09-02 08:00:00"}
+
+    def fetch(self, extra_domain, specification, label):
+        self.calls.append((extra_domain, specification, label))
+        records = list(self.records.values())
+        if extra_domain:
+            [(field, operator, ids)] = extra_domain
+            assert (field, operator) == ("id", "in")
+            records = [r for r in records if r["id"] in ids]
+        return [{"id": r["id"], **{name: r[name] for name in specification}} for r in records]
+
+    def frame(self):
+        return pd.DataFrame([_flatten(r) for r in self.records.values()], columns=COLUMNS)
+
+@pytest.fixture
+def odoo(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline_state, "PIPELINE_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(id_snapshot, "_loaded", {})
+    monkeypatch.setattr(id_snapshot, "ID_DIFF_FULL_EVERY", 0)
+    return FakeOdoo()
+
+def _run(odoo, **kwargs):
+    odoo.calls.clear()
+    return diff_fetch(odoo.fetch, "Pending_Orders", 1, "Pending Orders", SPEC, _flatten, COLUMNS, **kwargs)
+
+def _detail_ids(odoo):
+    """Ids fetched in full by the last run (None: every record, a full refresh)"""
+    details = [domain for domain, spec, _ in odoo.calls if spec != {"write_date": {}}]
+    if details == [[]]:
+        return None
+    return sorted(i for [(_, _, ids)] in details for i in ids)
+
+# --------- Full Refresh ---------
+def test_first_run_fetches_everything(odoo):
+    rows = _run(odoo)
+    pd.testing.assert_frame_equal(rows, odoo.frame())
+    assert _detail_ids(odoo) is None
+    assert odoo.calls[0][1] == {**SPEC, "write_date": {}}
+
+def test_unchanged_run_fetches_only_ids(odoo):
+    _run(odoo)
+    rows = _run(odoo)
+    pd.testing.assert_frame_equal(rows, odoo.frame())
+    assert odoo.calls == [([], {"write_date": {}}, "Pending Orders ids")]
+
+# --------- Added, Removed and Modified Ids ---------
+def test_added_removed_and_modified_ids(odoo):
+    _run(odoo)
+    odoo.modify(2, qty=999)
+    odoo.modify(5, partner_id={"id": 2, "display_name": "Renamed"})
+    del odoo.records[3]
+    odoo.records[7] = odoo.record(7, "Customer 7", 70)
+    rows = _run(odoo)
+    pd.testing.assert_frame_equal(rows, odoo.frame())
+    assert _detail_ids(odoo) == [2, 5, 7]
+    assert "MO0003" not in set(rows["Order"])
+
+def test_rows_follow_odoo_order(odoo):
+    _run(odoo)
+    # Odoo now returns a changed record first and a new one in the middle
+    odoo.modify(4, qty=1)
+    records = odoo.records
+    odoo.records = {4: records[4], 1: records[1], 8: odoo.record(8, "Customer 8", 80),
+                    **{i: r for i, r in records.items() if i not in (1, 4)}}
+    pd.testing.assert_frame_equal(_run(odoo), odoo.frame())
+
+def test_detail_fetches_are_chunked(odoo, monkeypatch):
+    monkeypatch.setattr(id_snapshot, "ID_DIFF_CHUNK", 2)
+    _run(odoo)
+    for i in (1, 3, 4, 6):
+        odoo.modify(i, qty=i)
+    pd.testing.assert_frame_equal(_run(odoo), odoo.frame())
+    chunks = [domain[0][2] for domain, spec, _ in odoo.calls if domain]
+    assert chunks == [[1, 3], [4, 6]]
+
+def test_everything_departed(odoo):
+    _run(odoo)
+    odoo.records = {}
+    rows = _run(odoo)
+    assert rows.empty and list(rows.columns) == COLUMNS
+
+# --------- Full-Refresh Cadence ---------
+def test_full_refresh_every_n_runs(odoo, monkeypatch):
+    monkeypatch.setattr(id_snapshot, "ID_DIFF_FULL_EVERY", 3)
+    full_runs = []
+    for run in range(1, 8):
+        _run(odoo)
+        if _detail_ids(odoo) is None:
+            full_runs.append(run)
+    assert full_runs == [1, 4, 7]
+
+def test_full_refresh_catches_changes_without_write_date(odoo, monkeypatch):
+    monkeypatch.setattr(id_snapshot, "ID_DIFF_FULL_EVERY", 2)
+    _run(odoo)
+    # A renamed customer doesn't touch the order's write_date
+    odoo.records[1] = {**odoo.records[1], "partner_id": {"id": 1, "display_name": "Renamed"}}
+    assert _run(odoo)["Customer"][0] == "Customer 1"
+    assert _run(odoo)["Customer"][0] == "Renamed"
+
+def test_changed_fields_or_request_refresh_everything(odoo):
+    _run(odoo)
+    odoo.calls.clear()
+    diff_fetch(odoo.fetch, "Pending_Orders", 1, "Pending Orders", SPEC, _flatten, COLUMNS[:2])
+    assert _detail_ids(odoo) is None
+    _run(odoo, full=True)
+    assert _detail_ids(odoo) is None
+
+def test_companies_keep_separate_snapshots(odoo):
+    _run(odoo)
+    odoo.calls.clear()
+    diff_fetch(odoo.fetch, "Pending_Orders", 3, "Pending Orders", SPEC, _flatten, COLUMNS)
+    assert _detail_ids(odoo) is None
@@ -0,0 +1,166 @@
+import pytest
+import odoo_cache
+import pipeline_state
+from odoo_cache import normalize_domain, filter_records, cached_fetch
+
+STATE = ["state", "=", "sale"]
+TYPE = ["sales_type", "=", "sale"]
+DATE = ["pi_date", ">=", "2025-08-01"]
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """An empty query cache in a temporary state directory, with no shared supersets in play"""
+    monkeypatch.setattr(pipeline_state, "PIPELINE_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_RUN", "test")
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_REPORTS", set())
+    calls = []
+
+    def fetcher(records):
+        def fetch(domain, specification):
+            calls.append(domain)
+            return records
+        return fetch
+    return calls, fetcher
+
+# --------- Domain Normalization ---------
+def test_and_nesting_and_order_do_not_matter():
+    assert normalize_domain(["&", STATE, "&", TYPE, DATE]) == normalize_domain([STATE, TYPE, DATE])
+    assert normalize_domain(["&", "&", DATE, TYPE, STATE]) == normalize_domain([STATE, TYPE, DATE])
+
+def test_or_is_one_condition():
+    either = normalize_domain(["|", STATE, TYPE])
+    assert either == normalize_domain(["|", TYPE, STATE])
+    assert either != normalize_domain([STATE, TYPE])
+    assert len(normalize_domain([DATE, "|", STATE, TYPE])) == 2
+
+def test_one_value_in_is_equals():
+    assert normalize_domain([["sales_type", "in", ["sale"]]]) == normalize_domain([TYPE])
+    assert normalize_domain([["sales_type", "not in", ["sale"]]]) == normalize_domain([["sales_type", "!=", "sale"]])
+    assert normalize_domain([["brand_group", "in", [2, 1, 2]]]) == normalize_domain([["brand_group", "in", [1, 2]]])
+
+# --------- Local Filtering ---------
+def _filter(records, domain):
+    return [r["id"] for r in filter_records(records, normalize_domain(domain))]
+
+def test_empty_values_pass_not_equal_and_not_in():
+    records = [{"id": 1, "bank": False}, {"id": 2, "bank": {"id": 7}}, {"id": 3, "bank": {"id": 8}}]
+    assert _filter(records, [["bank", "!=", 7]]) == [1, 3]
+    assert _filter(records, [["bank", "not in", [7, 8]]]) == [1]
+    assert _filter(records, [["bank", "!=", False]]) == [2, 3]
+    assert _filter(records, [["bank", "not in", [False, 7]]]) == [3]
+    assert _filter(records, [["bank", "=", False]]) == [1]
+    assert _filter(records, [["bank", "in", [7, 8]]]) == [2, 3]
+
+def test_empty_values_fail_comparisons():
+    records = [{"id": 1, "pi_date": False}, {"id": 2, "pi_date": "2025-09-01"}]
+    assert _filter(records, [DATE]) == [2]
+    assert _filter(records, [["pi_date", "<", "2025-08-01"]]) == []
+
+def test_path_through_empty_many2one_is_empty():
+    records = [{"id": 1, "partner_id": False}, {"id": 2, "partner_id": {"id": 4, "country_id": {"id": 5}}}]
+    assert _filter(records, [["partner_id.country_id", "=", 5]]) == [2]
+    assert _filter(records, [["partner_id.country_id", "!=", 5]]) == [1]
+
+# --------- Cached Fetch ---------
+def test_narrower_query_is_filtered_from_cache(cache):
+    calls, fetcher = cache
+    spec = {"pi_date": {}, "name": {}}
+    records = [{"id": 1, "pi_date": "2025-07-01"}, {"id": 2, "pi_date": "2025-09-01"}]
+    assert cached_fetch(fetcher(records), "sale.order", 1, [STATE, TYPE], spec, "all") == records
+    served = cached_fetch(fetcher([]), "sale.order", 1, ["&", TYPE, "&", DATE, STATE], {"name": {}}, "recent")
+    assert [r["id"] for r in served] == [2]
+    assert calls == [[STATE, TYPE]]
+
+def test_other_company_is_not_served(cache):
+    calls, fetcher = cache
+    cached_fetch(fetcher([{"id": 1}]), "sale.order", 1, [STATE], {}, "zipper")
+    cached_fetch(fetcher([{"id": 2}]), "sale.order", 3, [STATE], {}, "metal")
+    assert len(calls) == 2
+
+def test_field_missing_from_spec_fetches(cache):
+    calls, fetcher = cache
+    cached_fetch(fetcher([{"id": 1, "name": "S1"}]), "sale.order", 1, [STATE], {"name": {}}, "all")
+    # pi_date wasn't fetched with the cached entry, so the condition can't be checked locally
+    served = cached_fetch(fetcher([{"id": 2, "name": "S2"}]), "sale.order", 1, [STATE, DATE], {"name": {}}, "recent")
+    assert served == [{"id": 2, "name": "S2"}]
+    assert calls == [[STATE], [STATE, DATE]]
+
+def test_wider_spec_fetches(cache):
+    calls, fetcher = cache
+    cached_fetch(fetcher([{"id": 1, "name": "S1"}]), "sale.order", 1, [STATE], {"name": {}}, "names")
+    cached_fetch(fetcher([{"id": 1, "name": "S1", "bank": False}]), "sale.order", 1, [STATE],
+                 {"name": {}, "bank": {}}, "banks")
+    assert calls == [[STATE], [STATE]]
+
+def test_to_many_path_fetches(cache):
+    calls, fetcher = cache
+    spec = {"order_line": {"fields": {"product_id": {}}}}
+    records = [{"id": 1, "order_line": [{"id": 10, "product_id": {"id": 7}}]}]
+    cached_fetch(fetcher(records), "sale.order", 1, [STATE], spec, "all")
+    # Order lines are a list: whether "any line" matches is Odoo's to decide
+    line = ["order_line.product_id", "=", 7]
+    served = cached_fetch(fetcher(records), "sale.order", 1, [STATE, line], spec, "product")
+    assert served == records
+    assert calls == [[STATE], [STATE, line]]
+
+# --------- Shared Supersets ---------
+def test_superset_only_when_all_its_reports_run(cache, monkeypatch):
+    calls, fetcher = cache
+    shared_domain, reports = odoo_cache.SHARED_QUERIES[0][1:]
+    records = [{"id": 1, "pi_date": "2025-09-01"}]
+    cached_fetch(fetcher(records), "sale.order", 1, [STATE, TYPE, DATE], {"pi_date": {}}, "PI Bank Data")
+    assert calls == [[STATE, TYPE, DATE]]
+
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_RUN", "shared")
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_REPORTS", set(reports))
+    served = cached_fetch(fetcher(records), "sale.order", 1, [STATE, TYPE, DATE], {"pi_date": {}}, "PI Bank Data")
+    assert calls[-1] == shared_domain
+    assert served == records
+
+PI_BANK = [STATE, TYPE, DATE, ["pi_date", "<=", "2025-10-19"]]
+JOURNEY_PI = [["brand_group", "in", [183784, 180989]], ["date_order", ">=", "2025-04-01 00:00:00"],
+              ["date_order", "<=", "2025-10-19 09:00:00"], STATE, ["sales_type", "in", ["sale"]]]
+JOURNEY_SPEC = {"date_order": {}, "order_line": {"fields": {"price_subtotal": {}}}}
+ORDERS = [
+    {"id": 1, "pi_date": "2025-09-01", "brand_group": {"id": 5}, "date_order": "2025-08-20 10:00:00", "bank": False,
+     "order_line": [{"id": 10, "price_subtotal": 1.0}]},
+    {"id": 2, "pi_date": False, "brand_group": {"id": 183784}, "date_order": "2025-05-02 10:00:00", "bank": False,
+     "order_line": [{"id": 20, "price_subtotal": 2.0}]},
+    {"id": 3, "pi_date": "2025-09-02", "brand_group": {"id": 180989}, "date_order": "2025-10-20 10:00:00", "bank": False,
+     "order_line": []}
+]
+
+@pytest.fixture
+def shared_run(cache, monkeypatch):
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_REPORTS", set(odoo_cache.SHARED_QUERIES[0][2]))
+    return cache
+
+def test_superset_is_bounded_by_either_report(shared_run):
+    shared = normalize_domain(odoo_cache.SHARED_QUERIES[0][1])
+    assert odoo_cache._covers(shared, normalize_domain(PI_BANK))
+    assert odoo_cache._covers(shared, normalize_domain(JOURNEY_PI))
+    # An earlier PI date isn't inside the superset, so the query is fetched as it is
+    calls, fetcher = shared_run
+    earlier = [STATE, TYPE, ["pi_date", ">=", "2025-01-01"]]
+    cached_fetch(fetcher(ORDERS), "sale.order", 1, earlier, {"pi_date": {}}, "PI Bank Data")
+    assert calls == [earlier]
+
+def test_first_run_fetches_the_superset_once(shared_run):
+    calls, fetcher = shared_run
+    bank = cached_fetch(fetcher(ORDERS), "sale.order", 1, PI_BANK, {"pi_date": {}, "bank": {}}, "PI Bank Data")
+    assert [r["id"] for r in bank] == [1, 3]
+    # The superset came without the journey's lines: the journey fetches its own query, not the superset again
+    cached_fetch(fetcher(ORDERS[1:2]), "sale.order", 1, JOURNEY_PI, JOURNEY_SPEC, "Carter's Journey")
+    assert calls == [odoo_cache.SHARED_QUERIES[0][1], JOURNEY_PI]
+
+def test_later_runs_serve_both_reports_from_one_fetch(shared_run, monkeypatch):
+    calls, fetcher = shared_run
+    cached_fetch(fetcher(ORDERS), "sale.order", 1, PI_BANK, {"pi_date": {}, "bank": {}}, "PI Bank Data")
+    cached_fetch(fetcher(ORDERS[1:2]), "sale.order", 1, JOURNEY_PI, JOURNEY_SPEC, "Carter's Journey")
+
+    monkeypatch.setattr(odoo_cache, "ODOO_CACHE_RUN", "next")
+    journey = cached_fetch(fetcher(ORDERS), "sale.order", 1, JOURNEY_PI, JOURNEY_SPEC, "Carter's Journey")
+    bank = cached_fetch(fetcher([]), "sale.order", 1, PI_BANK, {"pi_date": {}, "bank": {}}, "PI Bank Data")
+    assert [r["id"] for r in journey] == [2]
+    assert [r["id"] for r in bank] == [1, 3]
+    assert calls[2:] == [odoo_cache.SHARED_QUERIES[0][1]]
@@ -0,0 +1,38 @@
+import os
+import glob
+import pandas as pd
+from urllib.parse import quote, unquote
+from dotenv import load_dotenv
+from pipeline_state import state_path
+load_dotenv()
+
+# --------- Staged Frames ---------
+# Layout: <PIPELINE_STATE_DIR>/staging/<report>/<tab>.pkl
+# A frame is staged before it is published and removed once the publish
+# completed, so whatever is left belongs to an upload that failed. Frames are
+# pickled rather than written as Parquet so mixed-type columns (False next to
+# strings) come back exactly as they would have been uploaded.
+
+def _staged_path(report, tab):
+    return state_path("staging", quote(report, safe=""), f"{quote(tab, safe='')}.pkl")
+
+def stage_frame(report, tab, df):
+    """Atomically write the frame about to be published to `tab`"""
+    path = _staged_path(report, tab)
+    tmp_path = f"{path}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+def mark_published(report, tab):
+    """Drop the staged frame once its publish has completed"""
+    try:
+        os.remove(_staged_path(report, tab))
+    except FileNotFoundError:
+        pass
+
+def staged_frames(report):
+    """(tab, df) for every frame of `report` whose publish never completed, oldest first"""
+    paths = sorted(glob.glob(os.path.join(os.path.dirname(_staged_path(report, "x")), "*.pkl")), key=os.path.getmtime)
+    if not paths:
+        print(f"✅ No staged uploads to resume for {report}")
+    return [(unquote(os.path.basename(path)[:-len(".pkl")]), pd.read_pickle(path)) for path in paths]